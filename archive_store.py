@@ -0,0 +1,204 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Content-addressed archive of every downloaded revision of the EIA forms.
+
+Each downloaded zip file is stored once, as a gzip compressed blob named by
+the SHA1 of its contents (the hash logged in download_log.csv):
+
+    archive_store/objects/b3/15a638e3e3c095aa606462ae8cf3d7987478c3.gz
+
+An index (archive_store/index.tab) maps each download of a form and year to
+its blob. Downloads of revisions that were already archived only add a line
+to the index, so identical revisions take no extra space, while every
+revision published upstream stays available as evidence of changes. Any
+revision can be restored to a zip file for re-parsing.
+
+Forms downloaded by scrape.py are archived as they are downloaded (see
+archive_downloads in config.py). Previous downloads can be archived with 'python
+eia_scrape.py archive', and revisions restored with 'python eia_scrape.py
+restore FORM YEAR'.
+
+"""
+
+import csv
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from utils import file_sha1, BLOCKSIZE
+
+store_directory = 'archive_store'
+index_fields = ('form', 'year', 'download_timestamp_utc', 'sha1', 'size',
+    'filename', 'url')
+COMPRESSION_LEVEL = 6
+# Form and year of each downloaded file name (see scrape.eia860_file and
+# scrape.eia923_file)
+form_file_patterns = [
+    ('eia860', re.compile(r'^eia860(\d{4})\.zip$')),
+    ('eia923', re.compile(r'^f923_(\d{4})\.zip$')),
+    ('eia923', re.compile(r'^f906920_(\d{4})\.zip$')),
+    ]
+# Serializes additions to the index by the download threads of the pipeline
+_index_lock = threading.Lock()
+
+
+def index_path():
+    return os.path.join(store_directory, 'index.tab')
+
+
+def blob_path(sha1):
+    return os.path.join(store_directory, 'objects', sha1[:2], sha1[2:] + '.gz')
+
+
+def form_and_year(filename):
+    """
+    Returns the form and year of a downloaded file, or (None, None) if its
+    name is not recognized.
+    """
+    for form, pattern in form_file_patterns:
+        match = pattern.match(os.path.basename(filename))
+        if match:
+            return form, int(match.group(1))
+    return None, None
+
+
+def read_index():
+    """
+    Returns the entries of the index (as dicts of strings), in the order they
+    were added.
+    """
+    if not os.path.isfile(index_path()):
+        return []
+    with open(index_path(), 'rb') as f:
+        return list(csv.DictReader(f, delimiter='\t', quotechar="'"))
+
+
+def _write_blob(path, sha1):
+    """
+    Writes the compressed contents of the file to the blob of its SHA1,
+    unless the blob exists. Returns True if the blob was written.
+    """
+    target = blob_path(sha1)
+    if os.path.isfile(target):
+        return False
+    if not os.path.isdir(os.path.dirname(target)):
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError:
+            # Created by another thread
+            pass
+    # Blobs are renamed into place once complete, so they are never partial
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            blob = gzip.GzipFile(fileobj=tmp_file, mode='wb',
+                compresslevel=COMPRESSION_LEVEL)
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, blob, BLOCKSIZE)
+            blob.close()
+        os.rename(tmp_path, target)
+    except:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+def add_file(path, timestamp, url='', sha1=None):
+    """
+    Archives a downloaded form and records its download in the index.
+    Downloads already in the index (same file, timestamp and SHA1) are not
+    added again. Returns the SHA1 of the file.
+    """
+    form, year = form_and_year(path)
+    if form is None:
+        raise ValueError("Unknown form file {}".format(path))
+    if sha1 is None:
+        sha1 = file_sha1(path)
+    written = _write_blob(path, sha1)
+    entry = {'form': form, 'year': str(year),
+        'download_timestamp_utc': str(timestamp), 'sha1': sha1,
+        'size': str(os.path.getsize(path)),
+        'filename': os.path.basename(path), 'url': url}
+    with _index_lock:
+        key = lambda e: (e['filename'], e['download_timestamp_utc'], e['sha1'])
+        if key(entry) in set(key(e) for e in read_index()):
+            return sha1
+        write_header = not os.path.isfile(index_path())
+        with open(index_path(), 'ab') as f:
+            writer = csv.DictWriter(f, index_fields, delimiter='\t',
+                quotechar="'", quoting=csv.QUOTE_MINIMAL)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(entry)
+    print "Archived {} ({} revision {})".format(os.path.basename(path),
+        'new' if written else 'known', sha1[:10])
+    return sha1
+
+
+def revisions(form, year):
+    """
+    Returns the index entries of the downloads of a form and year, sorted by
+    download time.
+    """
+    return sorted([e for e in read_index()
+        if e['form'] == form and int(e['year']) == year],
+        key=lambda e: e['download_timestamp_utc'])
+
+
+def restore(form, year, output=None, timestamp=None):
+    """
+    Writes a revision of a form to a zip file and returns its path. The
+    latest revision is restored unless the timestamp of a download is given.
+    The restored file is checked against its SHA1.
+    """
+    entries = revisions(form, year)
+    if timestamp is not None:
+        entries = [e for e in entries if e['download_timestamp_utc'] == timestamp]
+    if not entries:
+        raise KeyError("No archived revision of {} {}{}".format(form, year,
+            '' if timestamp is None else ' downloaded at ' + timestamp))
+    entry = entries[-1]
+    if output is None:
+        output = entry['filename']
+    blob = gzip.open(blob_path(entry['sha1']), 'rb')
+    try:
+        with open(output, 'wb') as f:
+            shutil.copyfileobj(blob, f, BLOCKSIZE)
+    finally:
+        blob.close()
+    if file_sha1(output) != entry['sha1']:
+        raise IOError("Restored file {} does not match its SHA1 {}".format(
+            output, entry['sha1']))
+    print "Restored {} {} downloaded at {} to {}".format(form, year,
+        entry['download_timestamp_utc'], output)
+    return output
+
+
+def archive_downloads(directory=None, log_path=None):
+    """
+    Archives the forms in the downloads directory, with the download time of
+    their latest entry in the download log. Files that no longer match their
+    logged SHA1 are not archived.
+    """
+    from config import default_config
+    from integrity import logged_downloads
+    if directory is None:
+        directory = default_config.unzip_directory
+    log = logged_downloads(log_path or default_config.download_log_path)
+    for filename in sorted(os.listdir(directory)):
+        if form_and_year(filename)[0] is None:
+            continue
+        path = os.path.join(directory, filename)
+        if filename not in log:
+            print "--Skipped {}: it is not in the download log".format(filename)
+            continue
+        sha1 = file_sha1(path)
+        if sha1 != log[filename]['sha1']:
+            print "--Skipped {}: its SHA1 does not match the download log".format(filename)
+            continue
+        add_file(path, log[filename]['download_timestamp_utc'],
+            log[filename]['url'], sha1)
@@ -0,0 +1,412 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Benchmark of the database steps (upload of generation projects, variable
+capacity factors and final fixes) against a local, throwaway PostgreSQL
+server with PostGIS.
+
+The harness creates a switch_wecc database with a minimal version of the
+tables used by database_interface.py, seeds it with synthetic load zones,
+counties and AMPL capacity factor tables, writes synthetic processed tab files
+of a configurable scale, and times each phase end to end:
+
+    python benchmark.py [--plants N] [--zones N] [--hours N] [--prep-schema]
+        [--staging] [--profile] [--keep]
+
+The server must listen on localhost:5433, like the SSH tunnel used by the
+database functions. The benchmark database is dropped and created again on
+every run, so a database named switch_wecc that was not created by this
+harness is never touched. Timings are appended to benchmark_results.tab, so
+each run can be compared with previous baselines.
+
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from utils import append_historic_output_to_csv
+
+database = 'switch_wecc'
+host = 'localhost'
+port = 5433
+# Comment that identifies databases created by the harness
+database_comment = 'eia_scrape benchmark'
+results_file = 'benchmark_results.tab'
+# Bounding box of the synthetic load zones (roughly the WECC region)
+min_lon, max_lon, min_lat, max_lat = -125.0, -102.0, 31.0, 49.0
+# Synthetic technologies: prime mover, energy source, mean heat rate, share
+technologies = [
+    ('ST', 'Coal', 10.5, 0.10),
+    ('CC', 'Gas', 7.5, 0.15),
+    ('GT', 'Gas', 11.5, 0.15),
+    ('IC', 'Gas', 10.0, 0.05),
+    ('ST', 'Nuclear', 10.4, 0.02),
+    ('ST', 'Geothermal', 21.0, 0.03),
+    ('HY', 'Water', float('nan'), 0.15),
+    ('PV', 'Solar', float('nan'), 0.20),
+    ('WT', 'Wind', float('nan'), 0.15),
+    ]
+
+schema = """
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE SCHEMA switch;
+CREATE TABLE load_zone (
+    load_zone_id integer PRIMARY KEY,
+    name text,
+    boundary geometry(MultiPolygon, 4326));
+CREATE TABLE us_states (state text, state_fips text);
+CREATE TABLE us_counties (
+    gid serial PRIMARY KEY,
+    name text,
+    statefp text,
+    state_name text,
+    the_geom geometry(MultiPolygon, 4326));
+CREATE TABLE generation_plant_technologies (
+    gen_tech text,
+    energy_source text,
+    max_age integer,
+    forced_outage_rate double precision,
+    scheduled_outage_rate double precision,
+    variable_o_m double precision);
+CREATE SEQUENCE generation_plant_id_seq;
+CREATE TABLE generation_plant (
+    generation_plant_id integer PRIMARY KEY DEFAULT nextval('generation_plant_id_seq'),
+    name text,
+    gen_tech text,
+    load_zone_id integer NOT NULL REFERENCES load_zone,
+    connect_cost_per_mw double precision,
+    capacity_limit_mw double precision,
+    variable_o_m double precision,
+    forced_outage_rate double precision,
+    scheduled_outage_rate double precision,
+    full_load_heat_rate double precision,
+    min_build_capacity double precision,
+    max_age integer NOT NULL,
+    unit_size double precision,
+    is_variable boolean,
+    is_baseload boolean,
+    is_cogen boolean,
+    energy_source text,
+    hydro_efficiency double precision,
+    storage_efficiency double precision,
+    store_to_release_ratio double precision,
+    min_load_fraction double precision,
+    startup_fuel double precision,
+    startup_om double precision,
+    ccs_capture_efficiency double precision,
+    ccs_energy_load double precision,
+    eia_plant_code integer,
+    latitude double precision,
+    longitude double precision,
+    county text,
+    state text,
+    geom geometry(Point, 4326));
+CREATE TABLE fuel_cell_generation_plants (LIKE generation_plant);
+CREATE TABLE generation_plant_scenario_member (
+    generation_plant_scenario_id integer,
+    generation_plant_id integer REFERENCES generation_plant,
+    PRIMARY KEY (generation_plant_scenario_id, generation_plant_id));
+CREATE TABLE generation_plant_existing_and_planned (
+    generation_plant_existing_and_planned_scenario_id integer,
+    generation_plant_id integer REFERENCES generation_plant,
+    build_year integer,
+    capacity double precision);
+CREATE TABLE generation_plant_cost (
+    generation_plant_cost_scenario_id integer,
+    generation_plant_id integer REFERENCES generation_plant,
+    build_year integer,
+    fixed_o_m double precision,
+    overnight_cost double precision);
+CREATE TABLE hydro_historical_monthly_capacity_factors (
+    hydro_simple_scenario_id integer,
+    generation_plant_id integer REFERENCES generation_plant,
+    year integer,
+    month integer,
+    hydro_min_flow_mw double precision,
+    hydro_avg_flow_mw double precision);
+CREATE TABLE raw_timepoint (
+    raw_timepoint_id integer PRIMARY KEY,
+    timestamp_utc timestamp);
+CREATE TABLE variable_capacity_factors (
+    generation_plant_id integer REFERENCES generation_plant,
+    raw_timepoint_id integer,
+    timestamp_utc timestamp,
+    capacity_factor double precision,
+    variable_capacity_factors_historical_scenario_id integer);
+CREATE TABLE temp_ampl__proposed_projects_v3 (
+    project_id integer PRIMARY KEY,
+    area_id integer,
+    technology_id integer);
+CREATE TABLE temp_variable_capacity_factors_historical (
+    project_id integer,
+    hour integer,
+    cap_factor double precision);
+CREATE TABLE temp_load_scenario_historic_timepoints (
+    timepoint_id integer,
+    historic_hour integer);
+"""
+
+# Server-side generation of the synthetic tables. Zones and counties are
+# cells of regular grids over the bounding box.
+seed = """
+INSERT INTO load_zone
+SELECT i+1, 'LZ_' || (i+1), ST_Multi(ST_MakeEnvelope(
+    %(min_lon)s + (i %% %(zone_cols)s) * %(zone_dx)s,
+    %(min_lat)s + (i / %(zone_cols)s) * %(zone_dy)s,
+    %(min_lon)s + (i %% %(zone_cols)s + 1) * %(zone_dx)s,
+    %(min_lat)s + (i / %(zone_cols)s + 1) * %(zone_dy)s, 4326))
+FROM generate_series(0, %(zones)s - 1) i;
+INSERT INTO us_counties (name, statefp, state_name, the_geom)
+SELECT 'County_' || i, lpad((i %% %(states)s)::text, 2, '0'),
+    'State_' || (i %% %(states)s), ST_Multi(ST_MakeEnvelope(
+    %(min_lon)s + (i %% %(county_cols)s) * %(county_dx)s,
+    %(min_lat)s + (i / %(county_cols)s) * %(county_dy)s,
+    %(min_lon)s + (i %% %(county_cols)s + 1) * %(county_dx)s,
+    %(min_lat)s + (i / %(county_cols)s + 1) * %(county_dy)s, 4326))
+FROM generate_series(0, %(counties)s - 1) i;
+INSERT INTO us_states
+SELECT 'State_' || i, lpad(i::text, 2, '0') FROM generate_series(0, %(states)s - 1) i;
+INSERT INTO raw_timepoint
+SELECT h, timestamp '2006-01-01' + h * interval '1 hour'
+FROM generate_series(0, %(hours)s - 1) h;
+INSERT INTO temp_load_scenario_historic_timepoints
+SELECT h, h FROM generate_series(0, %(hours)s - 1) h;
+INSERT INTO temp_ampl__proposed_projects_v3
+SELECT p, 1 + (p / 2) %% %(zones)s, CASE WHEN p %% 2 = 0 THEN 4 ELSE 6 END
+FROM generate_series(0, 2 * %(zones)s * %(projects_per_zone)s - 1) p;
+INSERT INTO temp_variable_capacity_factors_historical
+SELECT project_id, h, random()
+FROM temp_ampl__proposed_projects_v3 CROSS JOIN generate_series(0, %(hours)s - 1) h;
+ANALYZE;
+"""
+
+
+def connect(dbname, user, password):
+    import psycopg2
+    con = psycopg2.connect(database=dbname, user=user, host=host, port=port,
+        password=password)
+    con.autocommit = True
+    return con
+
+
+def create_database(user, password):
+    """
+    Creates an empty benchmark database, replacing a previous one. Exits if
+    a database with the same name was not created by the harness.
+    """
+    con = connect('postgres', user, password)
+    cur = con.cursor()
+    cur.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database\
+        WHERE datname = %s", (database,))
+    existing = cur.fetchone()
+    if existing is not None:
+        if existing[0] != database_comment:
+            sys.exit("Database {} at {}:{} was not created by the benchmark. "
+                "Use a throwaway server.".format(database, host, port))
+        cur.execute("DROP DATABASE {}".format(database))
+    cur.execute("CREATE DATABASE {}".format(database))
+    cur.execute("COMMENT ON DATABASE {} IS %s".format(database), (database_comment,))
+    con.close()
+
+
+def drop_database(user, password):
+    con = connect('postgres', user, password)
+    con.cursor().execute("DROP DATABASE {}".format(database))
+    con.close()
+
+
+def grid(n_cells):
+    """
+    Returns the number of columns and the width and height of the cells of a
+    grid with at least n_cells over the bounding box.
+    """
+    cols = int(np.ceil(np.sqrt(n_cells)))
+    rows = int(np.ceil(n_cells / float(cols)))
+    return cols, (max_lon - min_lon) / cols, (max_lat - min_lat) / rows
+
+
+def seed_database(user, password, zones, counties, states, hours,
+    projects_per_zone):
+    zone_cols, zone_dx, zone_dy = grid(zones)
+    county_cols, county_dx, county_dy = grid(counties)
+    con = connect(database, user, password)
+    cur = con.cursor()
+    cur.execute(schema)
+    cur.execute("INSERT INTO generation_plant_technologies VALUES " +
+        ','.join(cur.mogrify("(%s,%s,30,0.05,0.04,1.0)", (gen_tech, energy_source))
+        for gen_tech, energy_source, heat_rate, share in technologies))
+    cur.execute(seed, dict(min_lon=min_lon, min_lat=min_lat, zones=zones,
+        zone_cols=zone_cols, zone_dx=zone_dx, zone_dy=zone_dy,
+        counties=counties, county_cols=county_cols, county_dx=county_dx,
+        county_dy=county_dy, states=states, hours=hours,
+        projects_per_zone=projects_per_zone))
+    con.close()
+
+
+def write_processed_files(directory, year, plants, counties, states,
+    hydro_years, random_state, changed_fraction=0.0):
+    """
+    Writes synthetic existing and new generation projects and hydro capacity
+    factors with the columns of the processed tab files. A fraction of the
+    plants can have their capacity changed, to benchmark reconciliation.
+    """
+    rng = np.random.RandomState(random_state)
+    shares = np.array([t[3] for t in technologies])
+    tech = rng.choice(len(technologies), plants, p=shares/shares.sum())
+    plant_codes = np.arange(1, plants+1)
+    # One to three units per plant
+    units = rng.randint(1, 4, plants)
+    plant_index = np.repeat(np.arange(plants), units)
+    gens = pd.DataFrame({
+        'EIA Plant Code': plant_codes[plant_index],
+        'Generator Id': np.concatenate([np.arange(1, n+1) for n in units]),
+        'Plant Name': ['Plant_{}'.format(c) for c in plant_codes[plant_index]],
+        'Prime Mover': [technologies[t][0] for t in tech[plant_index]],
+        'Energy Source': [technologies[t][1] for t in tech[plant_index]],
+        'Operating Year': rng.randint(1950, year+5, len(plant_index)),
+        'Nameplate Capacity (MW)': rng.lognormal(3.5, 1.0, len(plant_index)).round(1),
+        'Best Heat Rate': [technologies[t][2] for t in tech[plant_index]] *
+            rng.normal(1.0, 0.1, len(plant_index)),
+        'Cogen': np.where(rng.rand(len(plant_index)) < 0.05, 'Y', 'N'),
+        })
+    changed = rng.rand(len(gens)) < changed_fraction
+    gens.loc[changed, 'Nameplate Capacity (MW)'] *= 1.1
+
+    # Plants are located in the bounding box, and 5% of them are only
+    # located by county
+    county = rng.randint(0, counties, plants)
+    located = rng.rand(plants) >= 0.05
+    gens['Latitude'] = np.where(located, rng.uniform(min_lat, max_lat, plants),
+        float('nan'))[plant_index]
+    gens['Longitude'] = np.where(located, rng.uniform(min_lon, max_lon, plants),
+        float('nan'))[plant_index]
+    gens['County'] = np.array(['County_{}'.format(c) for c in county])[plant_index]
+    gens['State'] = np.array(['State_{}'.format(c % states) for c in county])[plant_index]
+
+    new = gens['Operating Year'] > year
+    columns = ['EIA Plant Code','Generator Id','Plant Name','Prime Mover',
+        'Energy Source','Operating Year','Nameplate Capacity (MW)',
+        'Best Heat Rate','Cogen','Latitude','Longitude','County','State']
+    gens[~new][columns].to_csv(os.path.join(directory,
+        'existing_generation_projects_{}.tab'.format(year)), sep='\t', index=False)
+    gens[new][columns].to_csv(os.path.join(directory,
+        'new_generation_projects_{}.tab'.format(year)), sep='\t', index=False)
+
+    hydro = gens[gens['Prime Mover'] == 'HY'].groupby(['EIA Plant Code',
+        'Prime Mover'], as_index=False)['Nameplate Capacity (MW)'].sum()
+    months = pd.DataFrame([(y, m) for y in range(year-hydro_years+1, year+1)
+        for m in range(1, 13)], columns=['Year','Month'])
+    hydro['key'] = months['key'] = 0
+    hydro = pd.merge(hydro, months, on='key').drop('key', axis=1).rename(
+        columns={'EIA Plant Code':'Plant Code'})
+    hydro['Capacity Factor'] = rng.uniform(0.1, 0.9, len(hydro))
+    hydro.to_csv(os.path.join(directory,
+        'historic_hydro_capacity_factors_NARROW.tab'), sep='\t', index=False)
+    return len(gens)
+
+
+def timed(results, phase, function, *args, **kwargs):
+    print "\n=============================="
+    print "Benchmark phase: {}".format(phase)
+    print "==============================\n"
+    start = time.time()
+    value = function(*args, **kwargs)
+    results.append((phase, time.time() - start))
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the database steps "
+        "against synthetic data in a local throwaway PostgreSQL/PostGIS server.")
+    parser.add_argument('--plants', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=50,
+        help="Number of load zones (capacity factors are assigned to zones 1-50)")
+    parser.add_argument('--counties', type=int, default=400)
+    parser.add_argument('--states', type=int, default=11)
+    parser.add_argument('--hours', type=int, default=8760)
+    parser.add_argument('--projects-per-zone', type=int, default=2,
+        help="AMPL wind and solar projects per load zone")
+    parser.add_argument('--hydro-years', type=int, default=10)
+    parser.add_argument('--year', type=int, default=2015)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--prep-schema', action='store_true',
+        help="Create the indexes of schema_prep.py before the upload.")
+    parser.add_argument('--staging', action='store_true',
+        help="Load capacity factors through a staging table.")
+    parser.add_argument('--profile', action='store_true',
+        help="Write reports of the slowest statements of each phase.")
+    parser.add_argument('--keep', action='store_true',
+        help="Keep the benchmark database and files after the run.")
+    args = parser.parse_args(argv)
+
+    import database_interface
+    import heat_rates
+    import queries
+    from config import default_config
+    directory = tempfile.mkdtemp(prefix='eia_scrape_benchmark_')
+    config = default_config.replace(outputs_directory=directory)
+    queries.PROFILE_QUERIES = args.profile
+    credentials = dict(user=args.user, password=args.password)
+    results = []
+
+    timed(results, 'create database', create_database, **credentials)
+    timed(results, 'seed database', seed_database, zones=args.zones,
+        counties=args.counties, states=args.states, hours=args.hours,
+        projects_per_zone=args.projects_per_zone, **credentials)
+    n_units = timed(results, 'write processed files', write_processed_files,
+        directory, args.year, args.plants, args.counties, args.states,
+        args.hydro_years, args.seed)
+    if args.prep_schema:
+        import schema_prep
+        db = queries.QuerySession(database=database, report_directory=directory,
+            **credentials)
+        timed(results, 'prep-schema', schema_prep.ensure_indexes, db)
+        db.close()
+    timed(results, 'upload', database_interface.upload_generation_projects,
+        args.year, confirm=False, config=config, **credentials)
+    timed(results, 'upload --reconcile (unchanged)',
+        database_interface.upload_generation_projects, args.year,
+        reconcile=True, config=config, **credentials)
+    write_processed_files(directory, args.year, args.plants, args.counties,
+        args.states, args.hydro_years, args.seed, changed_fraction=0.05)
+    heat_rates.clear_cache()
+    timed(results, 'upload --reconcile (5% changed)',
+        database_interface.upload_generation_projects, args.year,
+        reconcile=True, config=config, **credentials)
+    timed(results, 'varcf', database_interface.assign_var_cap_factors,
+        staging=args.staging, config=config, **credentials)
+    timed(results, 'others', database_interface.others, config=config,
+        **credentials)
+
+    results = pd.DataFrame(results, columns=['phase','seconds'])
+    print "\n==============================\n"
+    print "Benchmark of {} plants ({} units), {} zones and {} hours:\n".format(
+        args.plants, n_units, args.zones, args.hours)
+    print results.to_string(index=False, float_format='{:.2f}'.format)
+    results.insert(0, 'timestamp', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    results.insert(1, 'plants', args.plants)
+    results.insert(2, 'zones', args.zones)
+    results.insert(3, 'hours', args.hours)
+    results.insert(4, 'options', ' '.join(o for o, used in [('prep-schema', args.prep_schema),
+        ('staging', args.staging)] if used))
+    append_historic_output_to_csv(results_file, results)
+    print "\nAppended results to {}".format(results_file)
+
+    if args.keep:
+        print "Kept database {} and processed files in {}".format(database, directory)
+    else:
+        drop_database(**credentials)
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
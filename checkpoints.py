@@ -0,0 +1,78 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Checkpoints for long sequences of processing steps, so that a run that fails
+halfway (e.g. because the connection to the database dropped) can be resumed
+without repeating the steps it already completed.
+
+The names of the completed steps and the values they produced (e.g. the ids
+of uploaded rows) are saved to a JSON state file after each step. The file is
+replaced atomically, so it always describes a consistent state.
+
+"""
+
+import json
+import os
+
+
+class Checkpoints(object):
+    """
+    Completed steps of a run and the values they produced. Unless resume is
+    True, the state of previous runs is discarded.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = []
+        self.values = {}
+        if resume and os.path.isfile(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.completed = state['completed']
+            self.values = state['values']
+            print "Resuming from {} ({} steps already completed)".format(
+                path, len(self.completed))
+        else:
+            if resume:
+                print "No checkpoints found in {}. Starting from the first step.".format(path)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def done(self, step):
+        """
+        Returns True if the step was completed (in this or a previous run).
+        """
+        if step in self.completed:
+            print "Skipping step '{}', which was already completed.".format(step)
+            return True
+        return False
+
+    def record(self, **values):
+        """
+        Saves values before the step that uses them is completed (e.g. the
+        first id of the rows a step inserts, to remove them if it has to be
+        repeated).
+        """
+        self.values.update(values)
+        self._save()
+
+    def complete(self, step, **values):
+        """
+        Records a step as completed, along with the values it produced.
+        """
+        self.completed.append(step)
+        self.values.update(values)
+        self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'completed':self.completed, 'values':self.values}, f,
+                indent=1)
+        os.rename(tmp_path, self.path)
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def __getitem__(self, name):
+        return self.values[name]
@@ -0,0 +1,152 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Registry of the EIA code tables in the other_data directory of the run
+configuration (energy sources, prime movers, generator status and cooling
+codes).
+
+Each table is loaded once into a CodeTable, which numbers its codes. Columns
+of codes are translated to those integers with a single hash lookup, and
+remappings (e.g. coal types to 'COAL', or EIA energy sources to Switch fuels)
+and membership tests are precomputed as arrays indexed by those integers.
+So applying them is a single array take, instead of string comparisons in
+DataFrame.replace and isin. Values that are not in a table (e.g. aggregated
+codes such as 'COAL', or nulls) are kept unchanged by remappings.
+
+    from codes import code_table
+    statuses = code_table('status', config.other_data_directory)
+    active = statuses.isin(generators['Status'], config.accepted_status_codes)
+    generators['Energy Source'] = code_table('energy_source',
+        config.other_data_directory).remap(generators['Energy Source'], fuels)
+
+"""
+
+import csv
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import default_config
+
+# Types of coal, which are aggregated as 'COAL' (the 'Coal' group of energy
+# sources)
+coal_codes = ['ANT','BIT','LIG','SGC','SUB','WC','RC']
+# File, code column and group column (or None) of each table
+code_table_files = {
+    'energy_source': ('energy_source_codes.txt', 'Energy Source Code', 'Fuel Type'),
+    'prime_mover': ('prime_mover_codes.txt', 'Prime Mover Code', None),
+    'status': ('gen_status_codes.txt', 'Generator Status Code', None),
+    'cooling_system': ('cooling_system_codes.txt', 'Cooling System Type Code', None),
+    'cooling_tower': ('cooling_tower_codes.txt', 'Tower Type Code', None),
+    'cooling_water_source': ('cooling_water_source_codes.txt',
+        'Cooling Water Source Code', None),
+    'cooling_water_type': ('type_of_cooling_water_codes.txt',
+        'Type of Cooling Water Code', None),
+    }
+_tables = {}
+
+
+class CodeTable(object):
+    """
+    Codes of an EIA table, numbered in the order of the file, with their
+    descriptions and groups (e.g. the fuel type of energy sources).
+    """
+
+    def __init__(self, name, records, code_column, group_column=None):
+        self.name = name
+        codes = OrderedDict()
+        for record in records:
+            code = record[code_column].strip()
+            # Codes listed twice (e.g. WAT) keep their first description
+            if code not in codes:
+                codes[code] = record
+        self.codes = pd.Index(list(codes), dtype=object)
+        description_column = [c for c in records[0] if 'Description' in c][0]
+        self.descriptions = [r[description_column] for r in codes.values()]
+        self.groups = ([r[group_column] for r in codes.values()]
+            if group_column else None)
+        self._remappings = {}
+        self._memberships = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def group(self, group):
+        """
+        Returns the codes of a group.
+        """
+        return [c for c, g in zip(self.codes, self.groups) if g == group]
+
+    def encode(self, values, categories=None):
+        """
+        Returns the integer code of each value (-1 for values not in the
+        table).
+        """
+        categories = self.codes if categories is None else categories
+        return categories.get_indexer(np.asarray(values, dtype=object))
+
+    def _categories(self, extra_codes):
+        """
+        Returns the codes of the table followed by the extra codes that are
+        not in it.
+        """
+        extra = [c for c in extra_codes if c not in self.codes]
+        if not extra:
+            return self.codes
+        return self.codes.append(pd.Index(extra, dtype=object))
+
+    def remap(self, values, mapping):
+        """
+        Replaces the values with the codes given by the mapping (a dict), and
+        keeps the values that it does not map. Returns an object of the type
+        of values (Series or array).
+        """
+        key = tuple(sorted(mapping.items()))
+        if key not in self._remappings:
+            categories = self._categories(sorted(mapping))
+            target = np.array([mapping.get(c, c) for c in categories], dtype=object)
+            self._remappings[key] = (categories, target)
+        categories, target = self._remappings[key]
+        raw = np.asarray(values, dtype=object)
+        positions = self.encode(raw, categories)
+        result = np.where(positions >= 0, target.take(positions), raw)
+        if isinstance(values, pd.Series):
+            return pd.Series(result, index=values.index, name=values.name)
+        return result
+
+    def isin(self, values, subset):
+        """
+        Returns a boolean array that tells which values are in the subset of
+        codes.
+        """
+        key = tuple(sorted(subset))
+        if key not in self._memberships:
+            categories = self._categories(key)
+            # The last position is taken by values not in the categories
+            lookup = np.zeros(len(categories) + 1, dtype=bool)
+            lookup[self.encode(list(key), categories)] = True
+            self._memberships[key] = (categories, lookup)
+        categories, lookup = self._memberships[key]
+        return lookup.take(self.encode(values, categories))
+
+
+def load_code_table(name, directory=default_config.other_data_directory):
+    """
+    Reads a code table from its tab separated file.
+    """
+    fname, code_column, group_column = code_table_files[name]
+    with open(os.path.join(directory, fname), 'rb') as f:
+        records = list(csv.DictReader(f, delimiter='\t'))
+    return CodeTable(name, records, code_column, group_column)
+
+
+def code_table(name, directory=default_config.other_data_directory):
+    """
+    Returns a code table of a directory, loading it the first time it is
+    requested.
+    """
+    if (name, directory) not in _tables:
+        _tables[(name, directory)] = load_code_table(name, directory)
+    return _tables[(name, directory)]
@@ -0,0 +1,122 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Run configuration of the scraping and processing steps.
+
+The settings of a run (years, directories, reuse of previous downloads and
+pickles, filtering and aggregation criteria...) are held in an immutable
+RunConfig, which is passed to every stage instead of being read from module
+globals. Configurations are namedtuples, so they can be pickled and shipped to
+worker processes with the tasks that use them (see pipeline.py and sweep.py),
+and several configurations can be run in the same process. Lists of settings
+are stored as tuples.
+
+Configurations are derived from the defaults (default_settings) with
+replace():
+
+    from config import default_config
+    config = default_config.replace(start_year=2012, stream_eia923=True)
+    scrape.main(config)
+
+"""
+
+import os
+from collections import namedtuple, OrderedDict
+
+default_settings = OrderedDict([
+    ('start_year', 2010),
+    ('end_year', 2015),
+    ('unzip_directory', 'downloads'),
+    ('pickle_directory', 'pickle_data'),
+    ('other_data_directory', 'other_data'),
+    ('outputs_directory', 'processed_data'),
+    ('reuse_prior_downloads', True),
+    # Keep every downloaded revision in the content-addressed store (see
+    # archive_store.py)
+    ('archive_downloads', True),
+    # Directory or url of a mirror of the forms (see mirror.py), or None to
+    # always download them from upstream
+    ('mirror', None),
+    ('clear_prior_outputs', True),
+    ('rewrite_pickles', False),
+    # Read EIA923 workbooks in chunks of rows instead of loading (and
+    # pickling) whole spreadsheets. Memory usage is only bounded for xlsx
+    # workbooks (2011 on), since xlrd loads whole xls sheets
+    ('stream_eia923', False),
+    ('eia923_chunksize', 20000),
+    # Overlap downloads, unzipping and parsing of different years (see
+    # pipeline.py)
+    ('run_as_pipeline', False),
+    ('accepted_status_codes', ('OP','SB','CO','SC','OA','OZ','TS','L','T','U','V')),
+    ('gen_aggregation_lists', (
+        ('Plant Code','Unit Code'),
+        ('Plant Code', 'Prime Mover', 'Energy Source', 'Operating Year'),
+        )),
+    ('aggregate_coal', True),
+    # The k-th best monthly heat rate of each year is reported as 'Best Heat Rate'
+    ('best_heat_rate_rank', 2),
+    # Generators without a NERC Region are assigned to a region if at least
+    # this fraction of the area of their County falls in it
+    ('region_county_area', 0.5),
+    # Fraction of the best and worst heat rates that get replaced by the heat
+    # rates found at those positions. Calculated separately for each group of
+    # the listed columns (use an empty list to consider all thermal generators
+    # together).
+    ('heat_rate_outlier_fraction', 0.008),
+    ('heat_rate_outlier_groups', ('Prime Mover','Energy Source')),
+    # How to render heat rate distribution plots: 'background', 'inline',
+    # 'deferred' (render later with reports.py) or None to skip them
+    ('heat_rate_plots', 'background'),
+    ])
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _restore_config(settings):
+    return RunConfig(**settings)
+
+
+class RunConfig(namedtuple('RunConfig', list(default_settings))):
+    """
+    Immutable settings of a run. Settings that are not given take their
+    values from default_settings.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, **settings):
+        unknown = sorted(set(settings) - set(default_settings))
+        if unknown:
+            raise TypeError("Unknown settings: {}".format(', '.join(unknown)))
+        values = dict(default_settings, **settings)
+        return super(RunConfig, cls).__new__(cls,
+            *[_freeze(values[name]) for name in cls._fields])
+
+    def __reduce__(self):
+        return (_restore_config, (dict(self._asdict()),))
+
+    def replace(self, **changes):
+        """
+        Returns a copy of the configuration with some settings changed.
+        """
+        return RunConfig(**dict(self._asdict(), **changes))
+
+    @property
+    def years(self):
+        return range(self.start_year, self.end_year+1)
+
+    @property
+    def download_log_path(self):
+        return os.path.join(self.unzip_directory, 'download_log.csv')
+
+    @property
+    def layout_registry_directory(self):
+        # Detected layouts of the workbooks of each form revision (see layouts.py)
+        return os.path.join(self.pickle_directory, 'layout_registry')
+
+
+default_config = RunConfig()
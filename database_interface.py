@@ -7,17 +7,39 @@ Switch-WECC database. Some functions may be used for other purposes.
 """
 
 import os, sys
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import getpass
 
-from IPython import embed
-from ggplot import *
-
-from utils import connect_to_db_and_run_query, append_historic_output_to_csv, connect_to_db_and_push_df
-
-coal_codes = ['ANT','BIT','LIG','SGC','SUB','WC','RC']
-outputs_directory = 'processed_data'
+from utils import connect_to_db_and_run_query, append_historic_output_to_csv, read_frame
+from heat_rates import fuels, load_heat_rate_table, read_processed_table
+from historic_series import read_records
+from heat_rate_stats import clip_outliers
+from queries import QuerySession, pyformat, technology_default_columns, nan_columns
+from reports import request_heat_rate_plot
+from reconcile import diff_frames, update_rows, sync_table
+from checkpoints import Checkpoints
+from codes import code_table, coal_codes
+from config import default_config
+from schema_prep import staged, create_staging_table, index_staging_table, merge_staging_table
+
+# Prime movers of the technologies of the Switch AMPL generation projects
+ampl_prime_movers = {
+    'Coal_Steam_Turbine':'ST',
+    'Gas_Steam_Turbine':'ST',
+    'Gas_Combustion_Turbine':'GT',
+    'Gas_Combustion_Turbine_Cogen':'GT',
+    'CCGT':'CC',
+    'DistillateFuelOil_Combustion_Turbine':'GT',
+    'DistillateFuelOil_Internal_Combustion_Engine':'IC',
+    'Geothermal':'ST',
+    'Gas_Internal_Combustion_Engine':'IC',
+    'Bio_Gas_Internal_Combustion_Engine':'IC',
+    'Bio_Gas_Steam_Turbine':'ST'
+    }
+# The outputs directory, area threshold of counties and heat rate outlier
+# and plot settings are read from the run configuration (see config.py)
 # Disable false positive warnings from pandas
 pd.options.mode.chained_assignment = None
 
@@ -29,11 +51,8 @@ def pull_generation_projects_data(gen_scenario_id):
     """
 
     print "Reading in existing and planned generation project data from database..."
-    query = "SELECT * \
-            FROM generation_plant JOIN generation_plant_existing_and_planned \
-            USING (generation_plant_id) \
-            WHERE generation_plant_existing_and_planned_scenario_id = {}".format(gen_scenario_id)
-    db_gens = connect_to_db_and_run_query(query=query, database='switch_wecc')
+    db_gens = read_frame(query=pyformat('existing_and_planned_plants'),
+        params=(gen_scenario_id,), database='switch_wecc')
     print "======="
     print "Read in {} projects from the database for id {}, with {:.0f} GW of capacity".format(
         len(db_gens), gen_scenario_id, db_gens['capacity'].sum()/1000.0)
@@ -45,16 +64,12 @@ def pull_generation_projects_data(gen_scenario_id):
     return db_gens
 
 
-def filter_plants_by_region_id(region_id, year, host='localhost', area=0.5):
+def region_counties(region_id, area=0.5, host='localhost',
+    directory=default_config.other_data_directory):
     """
-    Filters generation plant data by NERC Region, according to the provided id.
-    Generation plants w/o Region get assigned to the NERC Region with which more
-    than a certain percentage of its County area intersects (by default, 50%).
-    A list is saved with Counties and States belonging to the specified Region.
-    Both County and State are necessary to correctly assign plants (some County
-    names exist in multiple States).
-
-    Returns a DataFrame with the filtered data.
+    Returns the name of a region and a DataFrame with the Counties and States
+    that have at least the given fraction of their area in it. The list is
+    saved to a tab file in the directory, and read from it by later calls.
 
     """
 
@@ -112,48 +127,63 @@ def filter_plants_by_region_id(region_id, year, host='localhost', area=0.5):
     }
 
     print "Getting region name from database..."
-    query = "SELECT regionabr FROM ventyx_nerc_reg_region WHERE gid={}".format(
-        region_id)
-    region_name = connect_to_db_and_run_query(query=query,
-        database='switch_gis', host=host)['regionabr'][0]
-    counties_path = os.path.join('other_data', '{}_counties.tab'.format(region_name))
+    region_name = connect_to_db_and_run_query(query=pyformat('region_name'),
+        params=(region_id,), database='switch_gis', host=host)['regionabr'][0]
+    # Lists for other thresholds than the default one are saved separately
+    counties_path = os.path.join(directory, '{}_counties{}.tab'.format(
+        region_name, '' if area == 0.5 else '_{}'.format(area)))
     
     if not os.path.exists(counties_path):
         # assign county if (area)% or more of its area falls in the region
-        query = "SELECT name, state\
-                 FROM ventyx_nerc_reg_region regions CROSS JOIN us_counties cts\
-                 JOIN (SELECT DISTINCT state, state_fips FROM us_states) sts \
-                 ON (sts.state_fips=cts.statefp) \
-                 WHERE regions.gid={} AND\
-                 ST_Area(ST_Intersection(cts.the_geom, regions.the_geom))/\
-                 ST_Area(cts.the_geom)>={}".format(region_id, area)
         print "\nGetting counties and states for the region from database..."
-        region_counties = pd.DataFrame(connect_to_db_and_run_query(query=query,
+        counties = pd.DataFrame(connect_to_db_and_run_query(
+            query=pyformat('region_counties'), params=(region_id, area),
             database='switch_gis', host=host)).rename(columns={'name':'County','state':'State'})
-        region_counties.replace(state_dict, inplace=True)
-        region_counties.to_csv(counties_path, sep='\t', index=False)
+        counties.replace(state_dict, inplace=True)
+        counties.to_csv(counties_path, sep='\t', index=False)
     else:
         print "Reading counties from .tab file..."
-        region_counties = pd.read_csv(counties_path, sep='\t', index_col=None)
+        counties = pd.read_csv(counties_path, sep='\t', index_col=None)
+    return region_name, counties
 
-    generators = pd.read_csv(
-        os.path.join('processed_data','generation_projects_{}.tab'.format(year)), sep='\t')
+
+def filter_plants_by_region_id(region_id, year, host='localhost', area=0.5,
+    config=default_config):
+    """
+    Filters generation plant data by NERC Region, according to the provided id.
+    Generation plants w/o Region get assigned to the NERC Region with which more
+    than a certain percentage of its County area intersects (by default, 50%).
+    A list is saved with Counties and States belonging to the specified Region.
+    Both County and State are necessary to correctly assign plants (some County
+    names exist in multiple States).
+
+    Returns a DataFrame with the filtered data.
+
+    """
+
+    region_name, counties = region_counties(region_id, area, host,
+        config.other_data_directory)
+
+    # Only generators in the region or without an assigned region are read
+    generators = read_processed_table('generation_projects_{}.tab'.format(year),
+        config.outputs_directory, where={'Nerc Region':[region_name, None]})
     generators.loc[:,'County'] = generators['County'].map(lambda c: str(c).title())
 
-    print "\nRead in data for {} generators, of which:".format(len(generators))
+    print "\nRead in data for {} generators in the region or without a region, of which:".format(len(generators))
     print "--{} are existing".format(len(generators[generators['Operational Status']=='Operable']))
     print "--{} are proposed".format(len(generators[generators['Operational Status']=='Proposed']))
 
     generators_with_assigned_region = generators.loc[generators['Nerc Region'] == region_name]
     generators = generators[generators['Nerc Region'].isnull()]
-    generators_without_assigned_region = pd.merge(generators, region_counties, how='inner', on=['County','State'])
+    generators_without_assigned_region = pd.merge(generators, counties, how='inner', on=['County','State'])
     generators = pd.concat([
         generators_with_assigned_region,
         generators_without_assigned_region],
         axis=0)
-    generators.replace(
-            to_replace={'Energy Source':coal_codes, 'Energy Source 2':coal_codes,
-            'Energy Source 3':coal_codes}, value='COAL', inplace=True)
+    energy_sources = code_table('energy_source', config.other_data_directory)
+    for col in ['Energy Source', 'Energy Source 2', 'Energy Source 3']:
+        generators[col] = energy_sources.remap(generators[col],
+            dict.fromkeys(coal_codes, 'COAL'))
     generators_columns = list(generators.columns)
 
     existing_gens = generators[generators['Operational Status']=='Operable']
@@ -171,37 +201,29 @@ def filter_plants_by_region_id(region_id, year, host='localhost', area=0.5):
     return generators
 
 
-def compare_eia_heat_rates_to_ampl_projs(year):
+def compare_eia_heat_rates_to_ampl_projs(year, config=default_config):
     """
     Compares calculated 'Best Heat Rates' for EIA plants with full load heat
     rates of previously stored Switch AMPL data (generation scenario id 1) in
     the database.
 
-    ToDo: Only EIA860 data is merged with existing AMPL data, so no 'Best Heat
-    Rate' column is present. Need to also merge with EIA923 processed data
-    (historic_heat_rates_WIDE.tab file).
+    'Best Heat Rates' are read from EIA923 processed data (historic_heat_rates_WIDE.tab
+    file) and merged with the EIA860 projects of the year.
     
     Returns the comparison DataFrame and prints it to a tab file.
     """
 
     db_gen_projects = pull_generation_projects_data(gen_scenario_id=1).rename(
         columns={'name':'Plant Name', 'gen_tech':'Prime Mover'})
-    db_gen_projects.loc[:,'Prime Mover'].replace(
-        {
-        'Coal_Steam_Turbine':'ST',
-        'Gas_Steam_Turbine':'ST',
-        'Gas_Combustion_Turbine':'GT',
-        'Gas_Combustion_Turbine_Cogen':'GT',
-        'CCGT':'CC',
-        'DistillateFuelOil_Combustion_Turbine':'GT',
-        'DistillateFuelOil_Internal_Combustion_Engine':'IC',
-        'Geothermal':'ST',
-        'Gas_Internal_Combustion_Engine':'IC',
-        'Bio_Gas_Internal_Combustion_Engine':'IC',
-        'Bio_Gas_Steam_Turbine':'ST'
-        },
-        inplace=True)
-    eia_gen_projects = filter_plants_by_region_id(13, year)
+    db_gen_projects['Prime Mover'] = code_table('prime_mover',
+        config.other_data_directory).remap(db_gen_projects['Prime Mover'],
+        ampl_prime_movers)
+    eia_gen_projects = filter_plants_by_region_id(13, year, config=config)
+    eia_gen_projects = pd.merge(eia_gen_projects,
+        load_heat_rate_table(year, map_fuels=False,
+            directory=config.outputs_directory,
+            codes_directory=config.other_data_directory).reset_index(),
+        on=['EIA Plant Code','Prime Mover','Energy Source'], how='left')
 
     df = pd.merge(db_gen_projects, eia_gen_projects,
         on=['Plant Name','Prime Mover'], how='left').loc[:,[
@@ -211,14 +233,14 @@ def compare_eia_heat_rates_to_ampl_projs(year):
 
     print "\nPrinting intersection of DB and EIA generation projects that have a specified heat rate to heat_rate_comparison.tab"
     
-    fpath = os.path.join('processed_data','heat_rate_comparison.tab')
+    fpath = os.path.join(config.outputs_directory,'heat_rate_comparison.tab')
     with open(fpath, 'w') as outfile:
         df.to_csv(outfile, sep='\t', header=True, index=False)
 
     return df
 
 
-def assign_heat_rates_to_projects(generators, year):
+def assign_heat_rates_to_projects(generators, year, config=default_config):
     """
     Assigns calculated heat rates based on EIA923 data to plants parsed from
     EIA860 data. Receives a DataFrame with all generators and the year.
@@ -228,9 +250,12 @@ def assign_heat_rates_to_projects(generators, year):
     plants with heat rate better (lower) than 6.711 MMBTU/MWh are ignored and get
     assigned an average heat rate, since we assume a report error has taken place.
 
-    The top and bottom .5% of heat rates get replaced by the heat rate at the
-    top and bottom .5 percentile, respectively. This replaces unrealistic values
-    that must have been caused by reporting errors.
+    The top and bottom .8% of heat rates of each technology and energy source
+    get replaced by the heat rate at the top and bottom .8 percentile,
+    respectively (see heat_rate_outlier_fraction and heat_rate_outlier_groups
+    in config.py).
+    This replaces unrealistic values that must have been caused by reporting
+    errors.
 
     Heat rate averages used to replace unrealistic values and to be assigned to
     projects without heat rate are calculated as the average heat rate of plants
@@ -249,32 +274,9 @@ def assign_heat_rates_to_projects(generators, year):
 
     """
 
-    fuels = {
-        'LFG':'Bio_Gas',
-        'OBG':'Bio_Gas',
-        'AB':'Bio_Solid',
-        'BLQ':'Bio_Liquid',
-        'NG':'Gas',
-        'OG':'Gas',
-        'PG':'Gas',
-        'DFO':'DistillateFuelOil',
-        'JF':'ResidualFuelOil',
-        'COAL':'Coal',
-        'GEO':'Geothermal',
-        'NUC':'Uranium',
-        'PC':'Coal',
-        'SUN':'Solar',
-        'WDL':'Bio_Liquid',
-        'WDS':'Bio_Solid',
-        'MSW':'Bio_Solid',
-        'PUR':'Purchased_Steam',
-        'WH':'Waste_Heat',
-        'OTH':'Other',
-        'WAT':'Water',
-        'MWH':'Electricity',
-        'WND':'Wind'
-    }
-    generators = generators.replace({'Energy Source':fuels})
+    generators = generators.copy()
+    generators['Energy Source'] = code_table('energy_source',
+        config.other_data_directory).remap(generators['Energy Source'], fuels)
 
     existing_gens = generators[generators['Operational Status']=='Operable']
     print "-------------------------------------"
@@ -282,13 +284,11 @@ def assign_heat_rates_to_projects(generators, year):
         len(existing_gens[existing_gens['Prime Mover'].isin(['CC','GT','IC','ST'])]),
         existing_gens[existing_gens['Prime Mover'].isin(['CC','GT','IC','ST'])][
             'Nameplate Capacity (MW)'].sum()/1000)
-    heat_rate_data = pd.read_csv(
-        os.path.join('processed_data','historic_heat_rates_WIDE.tab'), sep='\t').rename(
-        columns={'Plant Code':'EIA Plant Code'})
-    heat_rate_data = heat_rate_data[heat_rate_data['Year']==year]
-    heat_rate_data = heat_rate_data.replace({'Energy Source':fuels})
+    heat_rate_data = load_heat_rate_table(year,
+        directory=config.outputs_directory,
+        codes_directory=config.other_data_directory).reset_index()
     thermal_gens = pd.merge(
-        existing_gens, heat_rate_data[['EIA Plant Code','Prime Mover','Energy Source','Best Heat Rate']],
+        existing_gens, heat_rate_data,
         how='left', suffixes=('',''),
         on=['EIA Plant Code','Prime Mover','Energy Source']).drop_duplicates()
 
@@ -320,19 +320,17 @@ def assign_heat_rates_to_projects(generators, year):
     #                 (thermal_gens_wo_hr['Prime Mover']==prime_mover)]),prime_mover)
     
     print "-------------------------------------"
-    print "Assigning max/min heat rates per technology and fuel to top .5% / bottom .5%, respectively:"
-    n_outliers = int(len(thermal_gens_w_hr)*0.008)
-    thermal_gens_w_hr = thermal_gens_w_hr.sort_values('Best Heat Rate')
-    min_hr = thermal_gens_w_hr.loc[thermal_gens_w_hr.index[n_outliers],'Best Heat Rate']
-    max_hr = thermal_gens_w_hr.loc[thermal_gens_w_hr.index[-1-n_outliers],'Best Heat Rate']
+    print "Assigning max/min heat rates per technology and fuel to top {0:.1f}% / bottom {0:.1f}%, respectively:".format(
+        config.heat_rate_outlier_fraction*100)
+    clipped_heat_rates, bounds = clip_outliers(thermal_gens_w_hr, 'Best Heat Rate',
+        config.heat_rate_outlier_fraction,
+        groupby=list(config.heat_rate_outlier_groups))
+    outliers = clipped_heat_rates != thermal_gens_w_hr['Best Heat Rate']
     print "(Total capacity of these plants is {:.1f} GW)".format(
-        thermal_gens_w_hr[thermal_gens_w_hr['Best Heat Rate'] < min_hr]['Nameplate Capacity (MW)'].sum()/1000.0 +
-        thermal_gens_w_hr[thermal_gens_w_hr['Best Heat Rate'] > max_hr]['Nameplate Capacity (MW)'].sum()/1000.0)
-    print "Minimum heat rate is {:.3f}".format(min_hr)
-    print "Maximum heat rate is {:.3f}".format(max_hr)
-    for i in range(n_outliers):
-        thermal_gens_w_hr.loc[thermal_gens_w_hr.index[i],'Best Heat Rate'] = min_hr
-        thermal_gens_w_hr.loc[thermal_gens_w_hr.index[-1-i],'Best Heat Rate'] = max_hr
+        thermal_gens_w_hr[outliers]['Nameplate Capacity (MW)'].sum()/1000.0)
+    print "Minimum heat rate is {:.3f}".format(bounds['lower'].min())
+    print "Maximum heat rate is {:.3f}".format(bounds['upper'].max())
+    thermal_gens_w_hr.loc[:,'Best Heat Rate'] = clipped_heat_rates
 
 
     def calculate_avg_heat_rate(thermal_gens_df, prime_mover, energy_source, vintage, window=2):
@@ -373,9 +371,10 @@ def assign_heat_rates_to_projects(generators, year):
 
 
     # Plot histograms for resulting heat rates per technology and fuel
-    thermal_gens["Technology"] = thermal_gens["Energy Source"].map(str) + ' ' + thermal_gens["Prime Mover"]
-    p = ggplot(aes(x='Best Heat Rate',fill='Technology'), data=thermal_gens) + geom_histogram(binwidth=0.5) + facet_wrap("Technology")  + ylim(0,30)
-    p.save(os.path.join(outputs_directory,'heat_rate_distributions.pdf'))
+    if config.heat_rate_plots:
+        thermal_gens["Technology"] = thermal_gens["Energy Source"].map(str) + ' ' + thermal_gens["Prime Mover"]
+        request_heat_rate_plot(thermal_gens, config.outputs_directory,
+            config.heat_rate_plots)
 
     proposed_gens = generators[generators['Operational Status']=='Proposed']
     thermal_proposed_gens = proposed_gens[proposed_gens['Prime Mover'].isin(['CC','GT','IC','ST'])]
@@ -396,7 +395,7 @@ def assign_heat_rates_to_projects(generators, year):
     return pd.concat([existing_gens, proposed_gens], axis=0)
 
 
-def finish_project_processing(year):
+def finish_project_processing(year, config=default_config):
     """
     Receives a year, and processes the scraped EIA data for that year by using
     previously defined functions.
@@ -421,13 +420,14 @@ def finish_project_processing(year):
 
     """
 
-    generators = filter_plants_by_region_id(13, year)
-    generators = assign_heat_rates_to_projects(generators, year)
+    generators = filter_plants_by_region_id(13, year,
+        area=config.region_county_area, config=config)
+    generators = assign_heat_rates_to_projects(generators, year, config)
     existing_gens = generators[generators['Operational Status']=='Operable']
     proposed_gens = generators[generators['Operational Status']=='Proposed']
 
     fname = 'existing_generation_projects_{}.tab'.format(year)
-    with open(os.path.join(outputs_directory, fname),'w') as f:
+    with open(os.path.join(config.outputs_directory, fname),'w') as f:
         existing_gens.to_csv(f, sep='\t', encoding='utf-8', index=False)
 
     uprates = pd.DataFrame()
@@ -448,15 +448,16 @@ def finish_project_processing(year):
             print "There is more than one option for uprating plant id {}, prime mover {} and energy source {}".format(int(pc), pm, es)
 
     fname = 'new_generation_projects_{}.tab'.format(year)
-    with open(os.path.join(outputs_directory, fname),'w') as f:
+    with open(os.path.join(config.outputs_directory, fname),'w') as f:
         new_gens.to_csv(f, sep='\t', encoding='utf-8', index=False)
 
     fname = 'uprates_to_generation_projects_{}.tab'.format(year)
-    with open(os.path.join(outputs_directory, fname),'w') as f:
+    with open(os.path.join(config.outputs_directory, fname),'w') as f:
         uprates.to_csv(f, sep='\t', encoding='utf-8', index=False)
 
 
-def upload_generation_projects(year):
+def upload_generation_projects(year, reconcile=False, resume=False, user=None,
+    password=None, confirm=True, config=default_config):
     """
     Reads existing and new project data previously processed from the EIA forms
     in order to upload it to the Switch-WECC database of RAEL, at UC Berkeley.
@@ -541,14 +542,32 @@ def upload_generation_projects(year):
     The dataset is uploaded with id 3, and build years, hydro capacity factors,
     and all other data is processed in the same way as for id 2.   
 
+    If reconcile is True, the stored scenarios are updated with only the
+    differences to the processed data instead of being deleted and uploaded
+    again (see reconcile_generation_projects).
+
+    Each step of the upload runs in its own transaction and is recorded in a
+    checkpoint file in the outputs directory, along with the ids of the
+    uploaded plants. If resume is True, an upload that failed halfway (e.g.
+    because of a dropped connection) continues from the last completed step,
+    without asking for confirmation again. Steps that push data delete the
+    data of their scenario (or the plants of a previous attempt) first, so they
+    can be safely repeated. Reconciling runs in a single transaction, so it
+    does not need to be resumed.
+
+    Database credentials are asked for unless they are provided, and the
+    confirmation of the upload can be skipped with confirm=False.
+
     """
 
-    user = getpass.getpass('Enter username for the database:')
-    password = getpass.getpass('Enter database password for user {}:'.format(user))
+    if user is None:
+        user = getpass.getpass('Enter username for the database:')
+    if password is None:
+        password = getpass.getpass('Enter database password for user {}:'.format(user))
 
     def read_output_csv(fname):
         try:
-            return pd.read_csv(os.path.join(outputs_directory,fname), sep='\t', index_col=None)
+            return read_processed_table(fname, config.outputs_directory)
         except:
             print "Failed to read file {}. It will be considered to be empty.".format(fname)
             return None
@@ -635,240 +654,303 @@ def upload_generation_projects(year):
 
     generators.replace(' ',float('nan'), inplace=True)
 
-    carry_on = getpass.getpass('WARNING: In order to push projects into the DB,'
-        'all projects currently in the generation_plant table that are'
-        'not present in the generation_plant_scenario_member table will be'
-        'removed. Continue? [y/n]')
-    while carry_on not in ['y','n']:
+    # Only the records of the plants being uploaded are read (see historic_series.py)
+    hydro_cf = read_records('historic_hydro_capacity_factors_NARROW.tab',
+        generators['eia_plant_code'].unique(), directory=config.outputs_directory)
+
+    if reconcile:
+        reconcile_generation_projects(generators, hydro_cf, user, password,
+            config)
+        return
+
+    # Progress is saved after each step, so a failed upload can be resumed
+    checkpoints = Checkpoints(os.path.join(config.outputs_directory,
+        'upload_generation_projects_{}.json'.format(year)), resume)
+
+    if confirm and not checkpoints.completed:
         carry_on = getpass.getpass('WARNING: In order to push projects into the DB,'
-        'all projects currently in the generation_plant table that are'
-        'not present in the generation_plant_scenario_member table will be'
-        'removed. Continue? [y/n]')
-    if carry_on == 'n':
-        sys.exit()
+            'all projects currently in the generation_plant table that are'
+            'not present in the generation_plant_scenario_member table will be'
+            'removed. Continue? [y/n]')
+        while carry_on not in ['y','n']:
+            carry_on = getpass.getpass('WARNING: In order to push projects into the DB,'
+            'all projects currently in the generation_plant table that are'
+            'not present in the generation_plant_scenario_member table will be'
+            'removed. Continue? [y/n]')
+        if carry_on == 'n':
+            sys.exit()
 
     print "\n-----------------------------"
     print "Pushing generation plants to the DB:\n"
+    print "Progress is saved to {}.".format(checkpoints.path)
+    print "If the upload fails, run it again with --resume to continue it.\n"
 
     # Make sure the "switch" schema is on the search path
+    db = QuerySession(database='switch_wecc', user=user, password=password,
+        report_directory=config.outputs_directory)
+
+    # Each step runs in its own transaction
+    gen_scenario_id = 2
+
+    if not checkpoints.done('delete_scenario_2'):
+        with db.transaction():
+            # Drop NOT NULL constraint for load_zone_id & max_age cols to avoid raising error
+            db.execute('relax_plant_constraints')
+            # First, delete previously stored projects for the EIA scenario id
+            db.execute('delete_hydro_capacity_factors', gen_scenario_id)
+            db.execute('delete_scenario_members', gen_scenario_id)
+            db.execute('delete_plant_costs', gen_scenario_id)
+            db.execute('delete_build_years', gen_scenario_id)
+            db.execute('delete_plants_without_scenario')
+        checkpoints.complete('delete_scenario_2')
+        print "Deleted previously stored projects for the EIA dataset (id 2). Pushing data..."
+
+    if not checkpoints.done('push_plants_2'):
+        generators_to_db = generators[['name','gen_tech','capacity_limit_mw',
+            'full_load_heat_rate','is_variable','is_baseload','is_cogen',
+            'energy_source','eia_plant_code', 'Latitude','Longitude','County',
+            'State']].drop_duplicates().rename(columns={'Latitude':'latitude',
+            'Longitude':'longitude','County':'county','State':'state'})
+        remove_unassigned_plants(db, checkpoints, 'first_gen_id')
+        with db.transaction() as cur:
+            first_gen_id = db.scalar('last_plant_id') + 1
+            checkpoints.record(first_gen_id=first_gen_id)
+            db.insert(cur, 'generation_plant', generators_to_db)
+            last_gen_id = db.scalar('last_plant_id')
+        checkpoints.complete('push_plants_2', first_gen_id=first_gen_id,
+            last_gen_id=last_gen_id)
+        print "Successfully pushed generation plants!"
+    first_gen_id = checkpoints['first_gen_id']
+    last_gen_id = checkpoints['last_gen_id']
+
+    if not checkpoints.done('process_plants_2'):
+        with db.transaction():
+            process_new_plants(db, first_gen_id, last_gen_id)
+        checkpoints.complete('process_plants_2')
 
-    # Drop NOT NULL constraint for load_zone_id & max_age cols to avoid raising error
-    query = 'ALTER TABLE "generation_plant" ALTER "load_zone_id" DROP NOT NULL;'
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    query = 'ALTER TABLE "generation_plant" ALTER "max_age" DROP NOT NULL;'
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-
-    # First, delete previously stored projects for the EIA scenario id
-    gen_scenario_id = 2.0
-
-    query = 'DELETE FROM hydro_historical_monthly_capacity_factors\
-        WHERE hydro_simple_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM generation_plant_scenario_member\
-        WHERE generation_plant_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM generation_plant_cost\
-        WHERE generation_plant_cost_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM generation_plant_existing_and_planned\
-        WHERE generation_plant_existing_and_planned_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+    # Now, create scenario and assign ids for scenario #2
+    # Get the actual list of ids in the table, since some rows were deleted
+    # because no load zone could be assigned to those projects
+    if not checkpoints.done('add_members_2'):
+        print "\nAssigning all individual plants to scenario id {}...".format(gen_scenario_id)
+        with db.transaction():
+            db.execute('delete_scenario_members', gen_scenario_id)
+            db.execute('add_plants_to_scenario', gen_scenario_id, first_gen_id, last_gen_id)
+            # Recover original NOT NULL constraint
+            db.execute('restore_plant_constraints')
+        checkpoints.complete('add_members_2')
+        print "Successfully assigned pushed generation plants to a scenario!"
 
-    # It is necessary to temporarily disable triggers when deleting from
-    # generation_plant table, because of multiple fkey constraints
-    query = 'SET session_replication_role = replica;\
-            DELETE FROM generation_plant\
-            WHERE generation_plant_id NOT IN\
-            (SELECT generation_plant_id FROM generation_plant_scenario_member);\
-            SET session_replication_role = DEFAULT;'
-    connect_to_db_and_run_query(query,
+    # Get the list of indexes of plants actually uploaded
+    with db.timed('read scenario_plants'):
+        gens_in_db = read_frame(pyformat('scenario_plants'), params=(gen_scenario_id,),
             database='switch_wecc', user=user, password=password, quiet=True)
 
-    print "Deleted previously stored projects for the EIA dataset (id 2). Pushing data..."
-
-    query = 'SELECT last_value FROM generation_plant_id_seq'
-    first_gen_id = connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True).iloc[0,0] + 1
+    if not checkpoints.done('build_years_2'):
+        print "\nAssigning build years to generation plants..."
+        with db.transaction() as cur:
+            db.execute('delete_build_years', gen_scenario_id)
+            db.insert(cur, 'generation_plant_existing_and_planned',
+                plant_build_years(generators, gens_in_db, gen_scenario_id))
+        checkpoints.complete('build_years_2')
+        print "Successfully uploaded build years!"
+
+    if not checkpoints.done('costs_2'):
+        print "\nAssigning fixed and investment costs to generation plants..."
+        with db.transaction() as cur:
+            db.execute('delete_plant_costs', gen_scenario_id)
+            db.insert(cur, 'generation_plant_cost', plant_costs(
+                plant_build_years(generators, gens_in_db, gen_scenario_id)))
+        checkpoints.complete('costs_2')
+        print "Successfully uploaded fixed and capital costs!"
+
+    # Merge hydro capacity factor data with generators in the database, and upload
+    if not checkpoints.done('hydro_2'):
+        print "\nUploading hydro capacity factors..."
+        with db.transaction() as cur:
+            db.execute('delete_hydro_capacity_factors', gen_scenario_id)
+            db.insert(cur, 'hydro_historical_monthly_capacity_factors',
+                plant_hydro_capacity_factors(hydro_cf, gens_in_db, gen_scenario_id))
+        checkpoints.complete('hydro_2')
+        print "Successfully uploaded hydro capacity factors!"
 
-    generators_to_db = generators[['name','gen_tech','capacity_limit_mw',
-        'full_load_heat_rate','is_variable','is_baseload','is_cogen',
-        'energy_source','eia_plant_code', 'Latitude','Longitude','County',
-        'State']].drop_duplicates()
 
-    connect_to_db_and_push_df(df=generators_to_db,
-        col_formats=("(DEFAULT,%s,%s,NULL,NULL,%s,NULL,NULL,NULL,%s,NULL,NULL,"
-            "NULL,%s,%s,%s,%s,NULL,NULL,NULL,NULL,NULL,NULL,NULL,NULL,%s,%s,%s,%s,%s,NULL)"),
-        table='generation_plant',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully pushed generation plants!"
 
-    query = 'SELECT last_value FROM generation_plant_id_seq'
-    last_gen_id = connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True).iloc[0,0]
+    print "\n-----------------------------"
+    gen_scenario_id = 3
 
+    # First, delete previously stored projects for the aggregated plants
+    if not checkpoints.done('delete_scenario_3'):
+        with db.transaction():
+            db.execute('delete_scenario_members', gen_scenario_id)
+            db.execute('delete_build_years', gen_scenario_id)
+            db.execute('delete_plant_costs', gen_scenario_id)
+            db.execute('delete_hydro_capacity_factors', gen_scenario_id)
+            db.execute('delete_plants_without_scenario')
+        checkpoints.complete('delete_scenario_3')
+        print "Deleted previously stored projects for the load zone-aggregated EIA dataset (id 3)."
+
+    if not checkpoints.done('push_plants_3'):
+        print "Aggregating projects by load zone..."
+        aggregated_gens = aggregate_plants_by_load_zone(gens_in_db)
+        print "Aggregated into {} projects. Pushing data...".format(len(aggregated_gens))
+        remove_unassigned_plants(db, checkpoints, 'first_aggregated_gen_id')
+        with db.transaction() as cur:
+            first_gen_id = db.scalar('last_plant_id') + 1
+            checkpoints.record(first_aggregated_gen_id=first_gen_id)
+            db.insert(cur, 'generation_plant', aggregated_gens)
+            last_gen_id = db.scalar('last_plant_id')
+        checkpoints.complete('push_plants_3', first_aggregated_gen_id=first_gen_id,
+            last_aggregated_gen_id=last_gen_id)
+        print "Successfully pushed aggregated project data!"
+    first_gen_id = checkpoints['first_aggregated_gen_id']
+    last_gen_id = checkpoints['last_aggregated_gen_id']
+
+    if not checkpoints.done('add_members_3'):
+        print "\nAssigning all aggregated plants to scenario id {}...".format(gen_scenario_id)
+        with db.transaction():
+            db.execute('delete_scenario_members', gen_scenario_id)
+            db.execute('add_plants_to_scenario', gen_scenario_id, first_gen_id, last_gen_id)
+        checkpoints.complete('add_members_3')
+        print "Successfully assigned pushed generation plants to a scenario!"
+
+    with db.timed('read scenario_plants'):
+        aggregated_gens_in_db = read_frame(pyformat('scenario_plants'),
+            params=(gen_scenario_id,),
+            database='switch_wecc', user=user, password=password, quiet=True)
+    aggregated_gens_bld_yrs = aggregated_plant_build_years(aggregated_gens_in_db,
+        gens_in_db, generators, gen_scenario_id)
+
+    if not checkpoints.done('build_years_3'):
+        print "\nAssigning build years to generation plants..."
+        with db.transaction() as cur:
+            db.execute('delete_build_years', gen_scenario_id)
+            db.insert(cur, 'generation_plant_existing_and_planned',
+                aggregated_gens_bld_yrs)
+        checkpoints.complete('build_years_3')
+        print "Successfully pushed aggregated project build years data!"
+
+    if not checkpoints.done('costs_3'):
+        print "\nAssigning fixed and investment costs to generation plants..."
+        with db.transaction() as cur:
+            db.execute('delete_plant_costs', gen_scenario_id)
+            db.insert(cur, 'generation_plant_cost', plant_costs(aggregated_gens_bld_yrs))
+        checkpoints.complete('costs_3')
+        print "Successfully uploaded fixed and capital costs!"
+
+    if not checkpoints.done('hydro_3'):
+        print "\nUploading hydro capacity factors..."
+        with db.transaction() as cur:
+            db.execute('delete_hydro_capacity_factors', gen_scenario_id)
+            db.insert(cur, 'hydro_historical_monthly_capacity_factors',
+                aggregated_hydro_capacity_factors(hydro_cf, aggregated_gens_in_db,
+                gens_in_db, gen_scenario_id))
+        checkpoints.complete('hydro_3')
+        print "Successfully uploaded hydro capacity factors!"
+    db.close()
+    print "\nUpload completed."
+
+
+def process_new_plants(db, first_gen_id, last_gen_id):
+    """
+    Populates the geom column of the plants uploaded with ids between
+    first_gen_id and last_gen_id, assigns them to load zones (removing plants
+    that cannot be assigned to any) and sets their technology default values.
+    """
     # Populate geometry column for GIS work
-    query = "UPDATE generation_plant\
-        SET geom = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)\
-        WHERE longitude IS NOT NULL AND latitude IS NOT NULL AND\
-        generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id)
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
+    db.execute('set_plant_geoms', first_gen_id, last_gen_id)
 
     print "\nAssigning load zones..."
-    query = "UPDATE generation_plant SET load_zone_id = z.load_zone_id\
-        FROM load_zone z\
-        WHERE ST_contains(boundary, geom) AND\
-        generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id)
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    n_plants_assigned_by_lat_long = connect_to_db_and_run_query("SELECT count(*)\
-        FROM generation_plant WHERE load_zone_id IS NOT NULL AND\
-        generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id),
-        database='switch_wecc', user=user, password=password, quiet=True).iloc[0,0]
+    db.execute('assign_zones_by_location', first_gen_id, last_gen_id)
+    n_plants_assigned_by_lat_long = db.scalar('count_plants_with_zone',
+        first_gen_id, last_gen_id)
     print "--Assigned load zone according to lat & long to {} plants".format(
         n_plants_assigned_by_lat_long)
 
-    query = "UPDATE generation_plant g SET load_zone_id = z.load_zone_id\
-        FROM us_counties c\
-        JOIN load_zone z ON ST_contains(z.boundary, ST_centroid(c.the_geom))\
-        WHERE g.load_zone_id IS NULL AND g.state = c.state_name AND g.county = c.name\
-        AND generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id)
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    n_plants_assigned_by_county_state = connect_to_db_and_run_query("SELECT count(*)\
-        FROM generation_plant WHERE load_zone_id IS NOT NULL AND\
-        generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id),
-        database='switch_wecc', user=user, password=password, quiet=True
-        ).iloc[0,0] - n_plants_assigned_by_lat_long
+    db.execute('assign_zones_by_county', first_gen_id, last_gen_id)
+    n_plants_assigned_by_county_state = db.scalar('count_plants_with_zone',
+        first_gen_id, last_gen_id) - n_plants_assigned_by_lat_long
     print "--Assigned load zone according to county & state to {} plants".format(
         n_plants_assigned_by_county_state)
 
     # Plants that are located outside of the WECC region boundary get assigned
     # to the nearest load zone, ONLY if they are located less than 100 miles
     # out of the boundary
-    query = "UPDATE generation_plant AS g1 SET load_zone_id = lz1.load_zone_id\
-        FROM load_zone lz1\
-        WHERE g1.load_zone_id is NULL AND g1.geom IS NOT NULL\
-        AND g1.generation_plant_id between {} AND {}\
-        AND ST_Distance(g1.geom::geography,lz1.boundary::geography)/1609 < 100\
-        AND ST_Distance(g1.geom::geography,lz1.boundary::geography)/1609 = \
-        (SELECT min(ST_Distance(g2.geom::geography,lz2.boundary::geography)/1609)\
-        FROM generation_plant g2\
-        CROSS JOIN load_zone lz2\
-        WHERE g2.load_zone_id is NULL AND g2.geom IS NOT NULL\
-        AND g2.generation_plant_id = g1.generation_plant_id)".format(first_gen_id, last_gen_id)
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    n_plants_assigned_to_nearest_lz = connect_to_db_and_run_query("SELECT count(*)\
-        FROM generation_plant WHERE load_zone_id IS NOT NULL AND\
-        generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id),
-        database='switch_wecc', user=user, password=password, quiet=True
-        ).iloc[0,0] - n_plants_assigned_by_lat_long - n_plants_assigned_by_county_state
+    db.execute('assign_zones_by_distance', first_gen_id, last_gen_id, 100)
+    n_plants_assigned_to_nearest_lz = db.scalar('count_plants_with_zone',
+        first_gen_id, last_gen_id) - n_plants_assigned_by_lat_long - n_plants_assigned_by_county_state
     print "--Assigned load zone according to nearest load zone to {} plants".format(
         n_plants_assigned_to_nearest_lz)
 
-    plants_wo_load_zone_count_and_cap = connect_to_db_and_run_query("SELECT count(*),\
-        sum(capacity_limit_mw) FROM generation_plant WHERE load_zone_id IS NULL\
-        AND generation_plant_id BETWEEN {} AND {}".format(first_gen_id, last_gen_id),
-        database='switch_wecc', user=user, password=password, quiet=True)
+    plants_wo_load_zone_count_and_cap = db.execute('count_plants_without_zone',
+        first_gen_id, last_gen_id)
     if plants_wo_load_zone_count_and_cap.iloc[0,0] > 0:
         print ("--WARNING: There are {:.0f} plants with a total of {:.2f} GW of capacity"
         " w/o an assigned load zone. These will be removed.").format(
         plants_wo_load_zone_count_and_cap.iloc[0,0],
         plants_wo_load_zone_count_and_cap.iloc[0,1]/1000.0)
-        connect_to_db_and_run_query("DELETE FROM generation_plant\
-            WHERE load_zone_id IS NULL AND generation_plant_id BETWEEN {}\
-            AND {}".format(first_gen_id, last_gen_id),
-            database='switch_wecc', user=user, password=password, quiet=True)
+        db.execute('delete_plants_without_zone', first_gen_id, last_gen_id)
 
     # Assign default technology values
     print "\nAssigning default technology parameter values..."
-    for param in ['max_age','forced_outage_rate','scheduled_outage_rate', 'variable_o_m']:
-        query = "UPDATE generation_plant g SET {} = t.{}\
-                FROM generation_plant_technologies t\
-                WHERE g.energy_source = t.energy_source AND\
-                g.gen_tech = t.gen_tech AND generation_plant_id BETWEEN {} AND\
-                {}".format(param, param, first_gen_id, last_gen_id)
-        connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-        print "--Assigned {}".format(param)
+    db.execute('assign_technology_defaults', first_gen_id, last_gen_id)
+    print "--Assigned {}".format(', '.join(technology_default_columns))
 
     # Manually assign maximum age for diablo canyon
-    query = "UPDATE generation_plant SET max_age = 40 WHERE name = 'Diablo Canyon'"
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+    db.execute('set_max_age_by_name', 'Diablo Canyon', 40)
 
-    # Now, create scenario and assign ids for scenario #2
-    # Get the actual list of ids in the table, since some rows were deleted
-    # because no load zone could be assigned to those projects
-    print "\nAssigning all individual plants to scenario id {}...".format(gen_scenario_id)
-    query = 'SELECT generation_plant_id FROM generation_plant\
-        WHERE generation_plant_id BETWEEN {} AND {}'.format(first_gen_id, last_gen_id)
-    gen_plant_ids = connect_to_db_and_run_query(query,
-                database='switch_wecc', user=user, password=password, quiet=True)
-    gen_plant_ids['generation_plant_scenario_id'] = gen_scenario_id
-
-    connect_to_db_and_push_df(df=gen_plant_ids[['generation_plant_scenario_id','generation_plant_id']],
-        col_formats="(%s,%s)", table='generation_plant_scenario_member',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully assigned pushed generation plants to a scenario!"
-
-    # Recover original NOT NULL constraint
-    query = 'ALTER TABLE "generation_plant" ALTER "load_zone_id" SET NOT NULL;'
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    query = 'ALTER TABLE "generation_plant" ALTER "max_age" SET NOT NULL;'
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
 
-    # Get the list of indexes of plants actually uploaded
-    print "\nAssigning build years to generation plants..."
-    query = 'SELECT * FROM generation_plant\
-        JOIN generation_plant_scenario_member USING (generation_plant_id)\
-        WHERE generation_plant_scenario_id = {}'.format(gen_scenario_id)
-    gens_in_db = connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-    gen_indexes_in_db = gens_in_db[['generation_plant_id','eia_plant_code','energy_source','gen_tech']]
+def remove_unassigned_plants(db, checkpoints, first_id_name):
+    """
+    Deletes the plants inserted by a previous attempt of a push step, which
+    recorded their first id before its insert. The insert may have been
+    committed even if the step was not completed, so the plants with greater
+    ids that are not members of any scenario are deleted before pushing them
+    again.
+    """
+    if first_id_name in checkpoints:
+        with db.transaction():
+            db.execute('delete_unassigned_plants_from', checkpoints[first_id_name])
 
-    # Create the df and upload it
+
+def plant_build_years(generators, gens_in_db, gen_scenario_id):
+    """
+    Returns the build years and capacity of the plants stored in the database,
+    for the generation_plant_existing_and_planned table. Units of a plant built
+    in the same year are stored as a single row with their summed capacity, so
+    the upload and reconcile modes write the same rows.
+    """
+    gen_indexes_in_db = gens_in_db[['generation_plant_id','eia_plant_code','energy_source','gen_tech']]
     build_years_df = pd.merge(generators, gen_indexes_in_db,
         on=['eia_plant_code','energy_source','gen_tech'])[['generation_plant_id',
         'build_year','capacity']]
     build_years_df['generation_plant_existing_and_planned_scenario_id'] = gen_scenario_id
-    build_years_df = build_years_df[[
+    return build_years_df.groupby([
         'generation_plant_existing_and_planned_scenario_id','generation_plant_id',
-        'build_year','capacity']]
-    connect_to_db_and_push_df(df=build_years_df,
-        col_formats="(%s,%s,%s,%s)", table='generation_plant_existing_and_planned',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully uploaded build years!"
+        'build_year'], as_index=False)['capacity'].sum()
 
-    print "\nAssigning fixed and investment costs to generation plants..."
+
+def plant_costs(build_years_df):
+    """
+    Returns fixed and investment costs (0 by default) for each build year, for
+    the generation_plant_cost table.
+    """
     cost_df = build_years_df.rename(columns={
         'generation_plant_existing_and_planned_scenario_id':
         'generation_plant_cost_scenario_id'}).drop('capacity', axis=1)
     cost_df['fixed_o_m'] = 0
     cost_df['overnight_cost'] = 0
+    return cost_df
 
-    connect_to_db_and_push_df(df=cost_df,
-        col_formats="(%s,%s,%s,%s,%s)", table='generation_plant_cost',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully uploaded fixed and capital costs!"
 
-    # Read hydro capacity factor data, merge with generators in the database, and upload
-    print "\nUploading hydro capacity factors..."
-    hydro_cf = read_output_csv('historic_hydro_capacity_factors_NARROW.tab').rename(
+def plant_hydro_capacity_factors(hydro_cf, gens_in_db, gen_scenario_id):
+    """
+    Returns the monthly flows of the hydro plants stored in the database, for
+    the hydro_historical_monthly_capacity_factors table.
+    """
+    hydro_cf = hydro_cf.rename(
         columns={'Plant Code':'eia_plant_code','Prime Mover':'gen_tech'})
-    hydro_cf = pd.merge(hydro_cf,gen_indexes_in_db[['generation_plant_id','eia_plant_code','gen_tech']],
+    hydro_cf = pd.merge(hydro_cf,gens_in_db[['generation_plant_id','eia_plant_code','gen_tech']],
         on=['eia_plant_code','gen_tech'], how='inner')
     hydro_cf.rename(columns={'Month':'month','Year':'year'}, inplace=True)
     hydro_cf.loc[:,'hydro_avg_flow_mw'] = hydro_cf.loc[:,'Capacity Factor'] * hydro_cf.loc[:,'Nameplate Capacity (MW)']
@@ -876,20 +958,18 @@ def upload_generation_projects(year):
     hydro_cf.loc[:,'hydro_simple_scenario_id'] = gen_scenario_id
     hydro_cf = hydro_cf[['hydro_simple_scenario_id','generation_plant_id',
         'year','month','hydro_min_flow_mw','hydro_avg_flow_mw']]
-    hydro_cf = hydro_cf.fillna(0.01)
-
-    connect_to_db_and_push_df(df=hydro_cf,
-        col_formats="(%s,%s,%s,%s,%s,%s)", table='hydro_historical_monthly_capacity_factors',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully uploaded hydro capacity factors!"
+    return hydro_cf.fillna(0.01)
 
 
-
-    print "\n-----------------------------"
-    print "Aggregating projects by load zone..."
-
+def aggregate_plants_by_load_zone(gens_in_db):
+    """
+    Aggregates plants by load zone, technology, energy source and heat rate
+    group (heat rates rounded to 1 MMBTU/MWh). Returns the aggregated plants
+    with the columns of the generation_plant table.
+    """
     # First, group by load zone, gen tech, energy source and heat rate
     # (while calculating a capacity-weighted average heat rate)
+    gens_in_db = gens_in_db.copy()
     gens_in_db['hr_group'] = gens_in_db['full_load_heat_rate'].fillna(0).round()
     gens_in_db['full_load_heat_rate'] *= gens_in_db['capacity_limit_mw']
     gens_in_db_cols = gens_in_db.columns
@@ -905,82 +985,22 @@ def upload_generation_projects(year):
     aggregated_gens['name'] = ('LZ_' + aggregated_gens['load_zone_id'].map(str) + '_' +
         aggregated_gens['gen_tech'] + '_' + aggregated_gens['energy_source'] + '_HR_' +
         aggregated_gens['hr_group'].map(int).map(str))
-    aggregated_gens.drop(['generation_plant_id','generation_plant_scenario_id',
-        'eia_plant_code','latitude','longitude','county','state'],
-        axis=1, inplace=True)
-    print "Aggregated into {} projects.".format(len(aggregated_gens))
-
-    # First, delete previously stored projects for the aggregated plants
-    gen_scenario_id = 3.0
+    return aggregated_gens.drop(['generation_plant_id','generation_plant_scenario_id',
+        'eia_plant_code','latitude','longitude','county','state','hr_group','geom'],
+        axis=1)
 
-    query = 'DELETE FROM generation_plant_scenario_member\
-        WHERE generation_plant_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM generation_plant_existing_and_planned\
-        WHERE generation_plant_existing_and_planned_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM generation_plant_cost\
-        WHERE generation_plant_cost_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    query = 'DELETE FROM hydro_historical_monthly_capacity_factors\
-        WHERE hydro_simple_scenario_id = {}'.format(gen_scenario_id)
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-
-    # It is necessary to temporarily disable triggers when deleting from
-    # generation_plant table, because of multiple fkey constraints
-    query = 'SET session_replication_role = replica;\
-            DELETE FROM generation_plant\
-            WHERE generation_plant_id NOT IN\
-            (SELECT generation_plant_id FROM generation_plant_scenario_member);\
-            SET session_replication_role = DEFAULT;'
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-    print "\nDeleted previously stored projects for the load zone-aggregated EIA dataset (id 3). Pushing data..."
-
-    query = 'SELECT last_value FROM generation_plant_id_seq'
-    first_gen_id = connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True).iloc[0,0] + 1
-
-    connect_to_db_and_push_df(df=aggregated_gens.drop(['hr_group','geom'], axis=1),
-        col_formats=("(DEFAULT,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,"
-            "%s,%s,%s,%s,%s,%s,%s,%s,%s,NULL,NULL,NULL,NULL,NULL,NULL)"),
-        table='generation_plant',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully pushed aggregated project data!"
-
-    query = 'SELECT last_value FROM generation_plant_id_seq'
-    last_gen_id = connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True).iloc[0,0]
-
-    print "\nAssigning all aggregated plants to scenario id {}...".format(gen_scenario_id)
-    query = 'INSERT INTO generation_plant_scenario_member\
-    (SELECT {}, generation_plant_id FROM generation_plant\
-        WHERE generation_plant_id BETWEEN {} AND {})'.format(
-            gen_scenario_id,first_gen_id, last_gen_id)
-    connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully assigned pushed generation plants to a scenario!"
-
-    query = 'SELECT last_value FROM generation_plant_id_seq'
-    last_gen_id = connect_to_db_and_run_query(query,
-        database='switch_wecc', user=user, password=password, quiet=True)
-
-    print "\nAssigning build years to generation plants..."
-    query = 'SELECT * FROM generation_plant\
-        JOIN generation_plant_scenario_member USING (generation_plant_id)\
-        WHERE generation_plant_scenario_id = {}'.format(gen_scenario_id)
-    aggregated_gens_in_db = connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
 
+def aggregated_plant_build_years(aggregated_gens_in_db, gens_in_db, generators,
+    gen_scenario_id):
+    """
+    Returns the build years of the aggregated plants stored in the database,
+    summing the capacity of the units built in the same year.
+    """
+    aggregated_gens_in_db = aggregated_gens_in_db.copy()
     aggregated_gens_in_db['hr_group'] = aggregated_gens_in_db['full_load_heat_rate'].fillna(0).round()
     aggregated_gens_in_db['generation_plant_existing_and_planned_scenario_id'] = gen_scenario_id
+    gens_in_db = gens_in_db.copy()
+    gens_in_db['hr_group'] = gens_in_db['full_load_heat_rate'].fillna(0).round()
     gens_in_db = pd.merge(gens_in_db, generators[['eia_plant_code','energy_source',
         'gen_tech','capacity','build_year']],
         on=['eia_plant_code','energy_source','gen_tech'], suffixes=('','_y'))
@@ -994,28 +1014,16 @@ def upload_generation_projects(year):
     aggregated_gens_bld_yrs = gb.agg(
         {col:(sum if col=='capacity' else 'max')
         for col in aggregated_gens_bld_yrs.columns}).reset_index(drop=True)
-    aggregated_gens_bld_yrs = aggregated_gens_bld_yrs[aggregated_gens_bld_yrs_cols]
-
-    connect_to_db_and_push_df(df=aggregated_gens_bld_yrs,
-        col_formats="(%s,%s,%s,%s)",
-        table='generation_plant_existing_and_planned',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully pushed aggregated project build years data!"
-
-    print "\nAssigning fixed and investment costs to generation plants..."
-    aggregated_gens_costs = aggregated_gens_bld_yrs.rename(columns={
-        'generation_plant_existing_and_planned_scenario_id':
-        'generation_plant_cost_scenario_id'}).drop('capacity', axis=1)
-    aggregated_gens_costs['fixed_o_m'] = 0
-    aggregated_gens_costs['overnight_cost'] = 0
+    return aggregated_gens_bld_yrs[aggregated_gens_bld_yrs_cols]
 
-    connect_to_db_and_push_df(df=aggregated_gens_costs,
-        col_formats="(%s,%s,%s,%s,%s)", table='generation_plant_cost',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully uploaded fixed and capital costs!"
 
-    print "\nUploading hydro capacity factors..."
-    agg_hydro_cf = read_output_csv('historic_hydro_capacity_factors_NARROW.tab').rename(
+def aggregated_hydro_capacity_factors(hydro_cf, aggregated_gens_in_db,
+    gens_in_db, gen_scenario_id):
+    """
+    Returns the monthly flows of the aggregated hydro plants stored in the
+    database, summing the flows of the plants of each load zone.
+    """
+    agg_hydro_cf = hydro_cf.rename(
         columns={'Plant Code':'eia_plant_code','Prime Mover':'gen_tech',
         'Month':'month','Year':'year'})
     agg_hydro_cf.loc[:,'hydro_avg_flow_mw'] = (agg_hydro_cf.loc[:,'Capacity Factor'] *
@@ -1035,15 +1043,153 @@ def upload_generation_projects(year):
         on=['load_zone_id', 'gen_tech'], how='inner', suffixes=('','_y'))
     agg_hydro_cf = agg_hydro_cf[['hydro_simple_scenario_id','generation_plant_id','year','month',
         'hydro_min_flow_mw','hydro_avg_flow_mw']]
-    agg_hydro_cf = agg_hydro_cf.fillna(0.01)    
+    return agg_hydro_cf.fillna(0.01)
 
-    connect_to_db_and_push_df(df=agg_hydro_cf,
-        col_formats="(%s,%s,%s,%s,%s,%s)", table='hydro_historical_monthly_capacity_factors',
-        database='switch_wecc', user=user, password=password, quiet=True)
-    print "Successfully uploaded hydro capacity factors!"
 
-
-def assign_var_cap_factors():
+def reconcile_scenario_plants(db, cur, gen_scenario_id, desired, key_columns,
+    value_columns, replaced_columns=[], new_plants=False, counts=None):
+    """
+    Makes the plants of a scenario match the desired ones by their key
+    columns: new plants are inserted, plants with different values are
+    updated and plants that are not desired anymore are removed from the
+    scenario. Plants with different replaced columns (e.g. their location) are
+    inserted again instead of updated. If new_plants is True, inserted plants
+    are processed like uploaded plants (load zones and technology defaults).
+
+    Returns the plants of the scenario after the changes, and the ids of the
+    plants that were removed from it.
+    """
+    current = db.execute('scenario_plants', gen_scenario_id)
+    columns = value_columns + replaced_columns
+    inserted, updated, deleted = diff_frames(current, desired, key_columns,
+        columns, 'generation_plant_id')
+    if replaced_columns:
+        replaced = diff_frames(current, desired, key_columns, replaced_columns,
+            'generation_plant_id')[1]
+        is_replaced = updated['generation_plant_id'].isin(
+            replaced['generation_plant_id']).values
+        inserted = pd.concat([inserted, updated.loc[is_replaced, key_columns + columns]])
+        deleted = pd.concat([deleted,
+            updated.loc[is_replaced, key_columns + ['generation_plant_id']]])
+        updated = updated[~is_replaced]
+
+    first_gen_id = db.scalar('last_plant_id') + 1
+    db.insert(cur, 'generation_plant', inserted)
+    last_gen_id = db.scalar('last_plant_id')
+    if new_plants and len(inserted):
+        process_new_plants(db, first_gen_id, last_gen_id)
+    with db.timed('update generation_plant', len(updated)):
+        update_rows(cur, 'generation_plant', updated, ['generation_plant_id'], columns)
+
+    kept_ids = current.loc[~current['generation_plant_id'].isin(
+        deleted['generation_plant_id']), 'generation_plant_id']
+    new_ids = db.execute('plant_ids', first_gen_id, last_gen_id)['generation_plant_id']
+    members = pd.DataFrame({'generation_plant_id':pd.concat([kept_ids, new_ids])})
+    members['generation_plant_scenario_id'] = gen_scenario_id
+    counts[('generation_plant', gen_scenario_id)] = (len(new_ids), len(updated),
+        len(deleted))
+    current_members = db.execute('scenario_members', gen_scenario_id)
+    with db.timed('sync generation_plant_scenario_member'):
+        counts[('generation_plant_scenario_member', gen_scenario_id)] = sync_table(cur,
+            'generation_plant_scenario_member', current_members, members,
+            ['generation_plant_scenario_id','generation_plant_id'])
+
+    removed_ids = [int(i) for i in deleted['generation_plant_id']]
+    return db.execute('scenario_plants', gen_scenario_id), removed_ids
+
+
+def reconcile_scenario_data(db, cur, gen_scenario_id, build_years_df, hydro_cf,
+    counts):
+    """
+    Makes the build years, costs and hydro capacity factors of a scenario
+    match the desired ones.
+    """
+    tables = [
+        ('generation_plant_existing_and_planned', 'scenario_build_years',
+            build_years_df, ['generation_plant_existing_and_planned_scenario_id',
+            'generation_plant_id','build_year'], ['capacity']),
+        ('generation_plant_cost', 'scenario_plant_costs',
+            plant_costs(build_years_df), ['generation_plant_cost_scenario_id',
+            'generation_plant_id','build_year'], ['fixed_o_m','overnight_cost']),
+        ('hydro_historical_monthly_capacity_factors', 'scenario_hydro_capacity_factors',
+            hydro_cf, ['hydro_simple_scenario_id','generation_plant_id','year','month'],
+            ['hydro_min_flow_mw','hydro_avg_flow_mw'])]
+    for table, statement, desired, key_columns, value_columns in tables:
+        current = db.execute(statement, gen_scenario_id)
+        with db.timed('sync {}'.format(table)):
+            counts[(table, gen_scenario_id)] = sync_table(cur, table, current,
+                desired, key_columns, value_columns)
+
+
+def reconcile_generation_projects(generators, hydro_cf, user, password,
+    config=default_config):
+    """
+    Updates the plants of scenario ids 2 and 3 and their build years, costs and
+    hydro capacity factors by writing only the differences with the data
+    currently stored in the database, instead of deleting and uploading all
+    of it again. Individual plants are matched by EIA plant code, technology
+    and energy source, and aggregated plants by their name (load zone,
+    technology, energy source and heat rate group).
+
+    All changes are made in a single transaction, so the scenarios are never
+    left half-updated, and the number of inserted, updated and deleted rows of
+    each table is reported. Plants that are not members of any scenario
+    anymore are deleted.
+    """
+    print "\n-----------------------------"
+    print "Reconciling generation plants with the DB:\n"
+    db = QuerySession(database='switch_wecc', user=user, password=password,
+        report_directory=config.outputs_directory)
+    counts = OrderedDict()
+
+    with db.transaction() as cur:
+        db.execute('relax_plant_constraints')
+
+        gen_scenario_id = 2
+        generators_to_db = generators[['name','gen_tech','capacity_limit_mw',
+            'full_load_heat_rate','is_variable','is_baseload','is_cogen',
+            'energy_source','eia_plant_code','Latitude','Longitude','County',
+            'State']].drop_duplicates().rename(columns={'Latitude':'latitude',
+            'Longitude':'longitude','County':'county','State':'state'})
+        gens_in_db, removed_ids = reconcile_scenario_plants(db, cur, gen_scenario_id,
+            generators_to_db, ['eia_plant_code','gen_tech','energy_source'],
+            ['name','capacity_limit_mw','full_load_heat_rate','is_variable',
+            'is_baseload','is_cogen'], ['latitude','longitude','county','state'],
+            new_plants=True, counts=counts)
+        reconcile_scenario_data(db, cur, gen_scenario_id,
+            plant_build_years(generators, gens_in_db, gen_scenario_id),
+            plant_hydro_capacity_factors(hydro_cf, gens_in_db, gen_scenario_id),
+            counts)
+
+        gen_scenario_id = 3
+        aggregated_gens = aggregate_plants_by_load_zone(gens_in_db)
+        aggregated_gens_in_db, removed_aggregated_ids = reconcile_scenario_plants(
+            db, cur, gen_scenario_id, aggregated_gens, ['name'],
+            [col for col in aggregated_gens.columns if col != 'name'],
+            counts=counts)
+        reconcile_scenario_data(db, cur, gen_scenario_id,
+            aggregated_plant_build_years(aggregated_gens_in_db, gens_in_db,
+                generators, gen_scenario_id),
+            aggregated_hydro_capacity_factors(hydro_cf, aggregated_gens_in_db,
+                gens_in_db, gen_scenario_id),
+            counts)
+
+        removed_ids += removed_aggregated_ids
+        db.execute('delete_unused_plant_capacity_factors', removed_ids)
+        db.execute('delete_unused_plants', removed_ids)
+        db.execute('restore_plant_constraints')
+
+    print "\nChanges written to the database:"
+    print "{:<45}{:>6}{:>10}{:>10}{:>10}".format('Table', 'Id', 'Inserted',
+        'Updated', 'Deleted')
+    for (table, gen_scenario_id), (n_inserted, n_updated, n_deleted) in counts.items():
+        print "{:<45}{:>6}{:>10}{:>10}{:>10}".format(table, gen_scenario_id,
+            n_inserted, n_updated, n_deleted)
+    db.close()
+
+
+def assign_var_cap_factors(staging=False, user=None, password=None,
+    config=default_config):
     """
     Variable capacity factors are assigned to all plants with WT and PV
     technology.
@@ -1062,96 +1208,67 @@ def assign_var_cap_factors():
     All these processes take significant time, so it is recommended to run
     this script through a sturdy SSH tunnel.
 
+    If staging is True, the new capacity factors are loaded into an UNLOGGED
+    staging table without indexes, corrected there (after indexing it), and
+    then moved into variable_capacity_factors (see schema_prep.py). In that
+    case the corrections only apply to the newly loaded capacity factors.
+
     """
 
-    user = getpass.getpass('Enter username for the database:')
-    password = getpass.getpass('Enter database password for user {}:'.format(user))
+    if user is None:
+        user = getpass.getpass('Enter username for the database:')
+    if password is None:
+        password = getpass.getpass('Enter database password for user {}:'.format(user))
+    db = QuerySession(database='switch_wecc', user=user, password=password,
+        report_directory=config.outputs_directory)
+    load_zones = range(1,51)
+
+    table = 'variable_capacity_factors'
+    def statement(name):
+        return staged(name, table) if staging else name
+    if staging:
+        create_staging_table(db, table)
+
     print "\nWill assign variable capacity factors for WIND projects"
     print "(May take significant time)\n"
     # Assign average AMPL wind profile of each load zone to all projects in that zone
-    for zone in range(1,51):
-        print "Load zone {}...".format(zone)
-        query = "INSERT INTO variable_capacity_factors\
-                (SELECT generation_plant_id, timepoint_id, timestamp_utc, cap_factor, 1\
-                FROM generation_plant\
-                JOIN(\
-                SELECT area_id, timepoint_id, timestamp_utc, avg(cap_factor) AS cap_factor, 1\
-                FROM temp_ampl__proposed_projects_v3\
-                JOIN temp_variable_capacity_factors_historical USING (project_id)\
-                JOIN temp_load_scenario_historic_timepoints ON (hour=historic_hour)\
-                JOIN raw_timepoint ON (timepoint_id = raw_timepoint_id)\
-                WHERE area_id = {} AND technology_id = 4\
-                GROUP BY 1,2,3\
-                ORDER BY 1,2\
-                ) AS factors ON (area_id = load_zone_id)\
-                WHERE gen_tech = 'WT')".format(zone)
-        connect_to_db_and_run_query(query,
-                database='switch_wecc', user=user, password=password, quiet=True)
-        print "Successfully assigned factors to projects in load zone {}.".format(zone)
+    db.execute_batch(statement('insert_zone_capacity_factors'),
+        [(zone, [4], 'WT') for zone in load_zones], page_size=10)
+    print "Successfully assigned factors to projects in load zones {}-{}.".format(
+        load_zones[0], load_zones[-1])
 
     print "\nWill assign variable capacity factors for SOLAR PV projects"
     print "(May take significant time)\n"
-    for zone in range(1,51):
-        print "Load zone {}...".format(zone)
-        query = "INSERT INTO variable_capacity_factors\
-                (SELECT generation_plant_id, timepoint_id, timestamp_utc, cap_factor, 1\
-                FROM generation_plant\
-                JOIN(\
-                SELECT area_id, timepoint_id, timestamp_utc, avg(cap_factor) AS cap_factor, 1\
-                FROM temp_ampl__proposed_projects_v3\
-                JOIN temp_variable_capacity_factors_historical USING (project_id)\
-                JOIN temp_load_scenario_historic_timepoints ON (hour=historic_hour)\
-                JOIN raw_timepoint ON (timepoint_id = raw_timepoint_id)\
-                WHERE area_id = {} AND technology_id IN (6,25,26)\
-                GROUP BY 1,2,3\
-                ORDER BY 1,2\
-                ) AS factors ON (area_id = load_zone_id)\
-                WHERE gen_tech = 'PV')".format(zone)
-        connect_to_db_and_run_query(query,
-                database='switch_wecc', user=user, password=password, quiet=True)
-        print "Successfully assigned factors to projects in load zone {}.".format(zone)
-
-    print "\nSetting all capacity factors for January 1st 00:00-8:00 hrs to 0.0"
-    for zone in range(1,51):
-        query = "delete from variable_capacity_factors cf\
-        using generation_plant gp\
-        where gp.generation_plant_id = cf.generation_plant_id and\
-        gen_tech = 'PV' and load_zone_id={} and\
-        extract(day from timestamp_utc) = 1\
-        and extract(month from timestamp_utc) = 1\
-        and extract(hour from timestamp_utc) between 0 and 8".format(zone)
-        connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
-        print "Deleted existing cap factors for zone {} in that interval.".format(zone)
-
-        query = "INSERT into variable_capacity_factors\
-        (select generation_plant_id, timepoint_id, timestamp_utc, 0.0, 1\
-        from temp_load_scenario_historic_timepoints\
-        join raw_timepoint on (raw_timepoint_id=timepoint_id)\
-        cross join generation_plant\
-        where gen_tech = 'PV'\
-        and load_zone_id = {}\
-        and extract(day from timestamp_utc) = 1\
-        and extract(month from timestamp_utc) = 1\
-        and extract(hour from timestamp_utc) between 0 and 8)".format(zone)
-        connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+    db.execute_batch(statement('insert_zone_capacity_factors'),
+        [(zone, [6,25,26], 'PV') for zone in load_zones], page_size=10)
+    print "Successfully assigned factors to projects in load zones {}-{}.".format(
+        load_zones[0], load_zones[-1])
+
+    def correct_pv_capacity_factors():
+        print "\nSetting all capacity factors for January 1st 00:00-8:00 hrs to 0.0"
+        db.execute_batch(statement('delete_first_pv_hours'), [(zone,) for zone in load_zones])
+        print "Deleted existing cap factors for all zones in that interval."
+        db.execute_batch(statement('insert_first_pv_hours'), [(zone,) for zone in load_zones])
         print "Inserted values of 0.0."
 
-    # Replace the dummy values of 0.0 by moving all capacity factors 7 hours ahead
-    # This is necessary due to a mismatch with the old AMPL factors
-    print "Moving PV capacity factors 7 hours ahead. Could take a long while..."
-    query = "UPDATE variable_capacity_factors cf\
-            set capacity_factor = cf2.capacity_factor\
-            from variable_capacity_factors cf2 join generation_plant using (generation_plant_id)\
-            where gen_tech = 'PV' and\
-            cf.generation_plant_id = cf2.generation_plant_id and\
-            cf.raw_timepoint_id + 7 = cf2.raw_timepoint_id;"
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+        # Replace the dummy values of 0.0 by moving all capacity factors 7 hours ahead
+        # This is necessary due to a mismatch with the old AMPL factors
+        print "Moving PV capacity factors 7 hours ahead. Could take a long while..."
+        db.execute(statement('shift_pv_capacity_factors'), 7)
+
+    if staging:
+        index_staging_table(db, table)
+        # Errors are raised in a transaction, so the staged rows are not
+        # merged if a correction fails
+        with db.transaction():
+            correct_pv_capacity_factors()
+        merge_staging_table(db, table)
+    else:
+        correct_pv_capacity_factors()
+    db.close()
 
 
-def others():
+def others(user=None, password=None, config=default_config):
     """
     Miscellaneous processing to finish preparing the EIA dataset for Switch runs.
 
@@ -1170,62 +1287,29 @@ def others():
 
     """
 
+    if user is None:
+        user = getpass.getpass('Enter username for the database:')
+    if password is None:
+        password = getpass.getpass('Enter database password for user {}:'.format(user))
+    db = QuerySession(database='switch_wecc', user=user, password=password,
+        report_directory=config.outputs_directory)
+
     # Fuel cells ('FC') were not calculated and assigned heat rates
     # These sum up to 63 MW of capacity in WECC
     # Cleanest option is to remove them from the current runs:
-    query = "CREATE TABLE switch.fuel_cell_generation_plant_backup (like generation_plant);\
-        INSERT INTO fuel_cell_generation_plants\
-        (SELECT * FROM generation_plant WHERE gen_tech = 'FC');\
-        DELETE FROM generation_plant_scenario_member gpsm USING generation_plant gp\
-        WHERE gp.generation_plant_id = gpsm.generation_plant_id\
-        AND gen_tech = 'FC';\
-        DELETE FROM generation_plant_cost gpc USING generation_plant gp\
-        WHERE gp.generation_plant_id = gpc.generation_plant_id\
-        AND gen_tech = 'FC';\
-        DELETE FROM generation_plant_existing_and_planned gpep USING generation_plant gp\
-        WHERE gp.generation_plant_id = gpep.generation_plant_id\
-        AND gen_tech = 'FC';\
-        DELETE FROM generation_plant WHERE gen_tech = 'FC';"
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+    db.execute('remove_fuel_cells')
 
     # Others ('OT') also do not have an assigned heat rate. Assign an average.
-    query = "UPDATE generation_plant set full_load_heat_rate = \
-        (select avg(full_load_heat_rate)\
-        from generation_plant\
-        join generation_plant_scenario_member using (generation_plant_id)\
-        where energy_source = 'Gas'\
-        and generation_plant_scenario_id = 2)\
-        where gen_tech = 'OT' and energy_source = 'Gas'"
-    connect_to_db_and_run_query(query,
-            database='switch_wecc', user=user, password=password, quiet=True)
+    db.execute('assign_average_heat_rate', 'OT', 'Gas', 2)
 
     # Replace 'NaN's with 'Null's
     # (NaNs result from the aggregation process)
-    cols_to_replace_nans = ['connect_cost_per_mw','hydro_efficiency','min_build_capacity',
-                            'unit_size','storage_efficiency','store_to_release_ratio',
-                            'min_load_fraction','startup_fuel','startup_om',
-                            'ccs_capture_efficiency', 'ccs_energy_load']
-    for col in cols_to_replace_nans:
-        query = "UPDATE generation_plant SET {c} = Null WHERE {c} = 'NaN'".format(c=col)
-        connect_to_db_and_run_query(query,
-                database='switch_wecc', user=user, password=password, quiet=True)
-        print "Replaced NaNs in column '{}'".format(col)
+    db.execute('replace_nans_with_nulls')
+    print "Replaced NaNs in columns {}".format(', '.join(nan_columns))
 
     # Replace Nulls with zeros where Switch expects a number
-    query = "UPDATE generation_plant\
-            SET connect_cost_per_mw = 0.0\
-            WHERE connect_cost_per_mw is Null"
-    connect_to_db_and_run_query(query,
-                database='switch_wecc', user=user, password=password, quiet=True)
-
-
-if __name__ == "__main__":
-    finish_project_processing(2015)
-    # upload_generation_projects(2015)
-    # assign_var_cap_factors()
-    # others()
-
+    db.execute('zero_null_connect_costs')
+    db.close()
 
 
 def assign_states_to_counties():
@@ -1282,14 +1366,15 @@ def assign_states_to_counties():
         'WY': 'Wyoming'
     }
 
-    query = 'UPDATE us_counties uc SET state_name = cs.state\
-        FROM (SELECT DISTINCT c.name, state, statefp, state_fips, c.gid\
-        FROM us_counties c join us_states s ON c.statefp=s.state_fips) cs\
-        WHERE cs.gid = uc.gid'
-    connect_to_db_and_run_query(query, database='switch_wecc', user=user, password=password)
+    user = getpass.getpass('Enter username for the database:')
+    password = getpass.getpass('Enter database password for user {}:'.format(user))
+    db = QuerySession(database='switch_wecc', user=user, password=password)
+
+    db.execute('copy_county_states')
+    db.execute_batch('rename_county_state', list(state_dict.iteritems()))
+    db.close()
 
 
-    for state_abr, state_name in state_dict.iteritems():
-        query = "UPDATE us_counties SET state_name = '{}' WHERE state_name = '{}'".format(
-            state_abr, state_name)
-        connect_to_db_and_run_query(query, database='switch_wecc', user=user, password=password)
+if __name__ == "__main__":
+    # See eia_scrape.py for the other processing steps
+    finish_project_processing(2015)
@@ -0,0 +1,228 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Command line entry point for the EIA scraping and processing steps:
+
+    python eia_scrape.py scrape [--start-year Y] [--end-year Y] [--pipeline]
+        [--mirror PATH_OR_URL]
+    python eia_scrape.py parse [--start-year Y] [--end-year Y]
+    python eia_scrape.py sweep GRID [--start-year Y] [--end-year Y] [--finish]
+        [--workers N] [--output DIRECTORY]
+    python eia_scrape.py verify [--threads N] [--no-cache]
+    python eia_scrape.py archive
+    python eia_scrape.py serve-mirror DIRECTORY [--port N]
+    python eia_scrape.py restore FORM YEAR [--timestamp T] [--output PATH]
+    python eia_scrape.py finish YEAR
+    python eia_scrape.py upload YEAR [--reconcile | --resume] [--profile] [--explain]
+    python eia_scrape.py varcf [--staging] [--profile] [--explain]
+    python eia_scrape.py others [--profile] [--explain]
+    python eia_scrape.py prep-schema [--revert]
+    python eia_scrape.py plots
+    python eia_scrape.py export FILE OUTPUT [--year Y]
+    python eia_scrape.py import-times [--repeat N]
+
+Modules are only imported by the subcommands that use them, so no command
+pays for the imports of the others. Heavy libraries are also imported lazily:
+requests when a file is downloaded, psycopg2 when a query is run and matplotlib
+when plots are drawn. 'import-times' measures the startup cost of each
+subcommand by importing its modules in a fresh interpreter.
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+
+# Module and function run by each subcommand
+commands = OrderedDict([
+    ('scrape', ('scrape', 'main',
+        'Download, unzip and parse the EIA860 and EIA923 forms.')),
+    ('parse', ('scrape', 'parse_forms',
+        'Parse previously downloaded EIA860 and EIA923 forms.')),
+    ('sweep', ('sweep', 'run_sweep',
+        'Process the forms with every combination of a grid of settings.')),
+    ('verify', ('integrity', 'verify_downloads',
+        'Check the downloaded forms against the hashes in the download log.')),
+    ('archive', ('archive_store', 'archive_downloads',
+        'Add the downloaded forms to the content-addressed archive store.')),
+    ('restore', ('archive_store', 'restore',
+        'Restore an archived revision of a form to a zip file.')),
+    ('serve-mirror', ('mirror', 'serve',
+        'Serve a caching mirror of the EIA forms to the team.')),
+    ('finish', ('database_interface', 'finish_project_processing',
+        'Filter WECC generators and assign heat rates for a year.')),
+    ('upload', ('database_interface', 'upload_generation_projects',
+        'Upload the processed generation projects of a year to the database.')),
+    ('varcf', ('database_interface', 'assign_var_cap_factors',
+        'Assign capacity factors to variable generation projects.')),
+    ('others', ('database_interface', 'others',
+        'Miscellaneous fixes to the uploaded generation plants.')),
+    ('prep-schema', ('schema_prep', 'prepare_schema',
+        'Create (or drop) the indexes used by the database statements.')),
+    ('plots', ('reports', 'render_pending_plots',
+        'Render plots whose data changed since they were last drawn.')),
+    ('export', ('processed_store', 'export_table',
+        'Export records of a processed table from the embedded database.')),
+    ])
+
+
+def load_command(name):
+    """
+    Imports the module of a subcommand and returns its function.
+    """
+    module_name, function_name = commands[name][:2]
+    module = __import__(module_name)
+    return getattr(module, function_name)
+
+
+def import_times(repeat=3):
+    """
+    Prints the time needed to start the interpreter and load each subcommand,
+    measured in fresh processes (best of 'repeat' runs).
+    """
+    code = ("import time; t = time.time(); import eia_scrape; "
+        "eia_scrape.load_command('{}') if '{}' else None; "
+        "print(time.time() - t)")
+    baseline = None
+    print "Import times (best of {} runs):".format(repeat)
+    for name in [''] + list(commands):
+        times = [float(subprocess.check_output(
+            [sys.executable, '-c', code.format(name, name)],
+            cwd=os.path.dirname(os.path.abspath(__file__))))
+            for i in range(repeat)]
+        if baseline is None:
+            baseline = min(times)
+            print "{:<8} {:.3f} s".format('(cli)', baseline)
+        else:
+            print "{:<8} {:.3f} s".format(name, min(times))
+
+
+def run_config(args):
+    """
+    Returns the default run configuration (see config.py) with the settings
+    given in the command line.
+    """
+    from config import default_config
+    settings = {}
+    if args.start_year is not None:
+        settings['start_year'] = args.start_year
+    if args.end_year is not None:
+        settings['end_year'] = args.end_year
+    if getattr(args, 'pipeline', False):
+        settings['run_as_pipeline'] = True
+    if getattr(args, 'mirror', None) is not None:
+        settings['mirror'] = args.mirror
+    return default_config.replace(**settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Scrape and process EIA860 and EIA923 generator data.")
+    subparsers = parser.add_subparsers(dest='command')
+    for name, (module_name, function_name, description) in commands.items():
+        subparser = subparsers.add_parser(name, help=description)
+        if name in ('scrape', 'parse', 'sweep'):
+            subparser.add_argument('--start-year', type=int)
+            subparser.add_argument('--end-year', type=int)
+        if name == 'scrape':
+            subparser.add_argument('--pipeline', action='store_true',
+                help="Overlap the download, unzip and parse stages.")
+            subparser.add_argument('--mirror',
+                help="Directory or url of a mirror to download the forms from.")
+        if name == 'sweep':
+            subparser.add_argument('grid',
+                help="JSON file with the values of each setting, see sweep.py")
+            subparser.add_argument('--finish', action='store_true',
+                help="Also filter WECC generators and assign heat rates.")
+            subparser.add_argument('--workers', type=int)
+            subparser.add_argument('--output',
+                help="Directory of the variants (sweep_data by default)")
+        if name == 'verify':
+            subparser.add_argument('--threads', type=int)
+            subparser.add_argument('--no-cache', action='store_true',
+                help="Hash all files, even if they were verified before.")
+        if name == 'serve-mirror':
+            subparser.add_argument('directory')
+            subparser.add_argument('--port', type=int)
+        if name == 'restore':
+            subparser.add_argument('form', choices=['eia860', 'eia923'])
+            subparser.add_argument('year', type=int)
+            subparser.add_argument('--timestamp',
+                help="Download time of the revision (the latest by default)")
+            subparser.add_argument('--output', help="Path of the restored zip file")
+        if name in ('finish', 'upload'):
+            subparser.add_argument('year', type=int)
+        if name == 'upload':
+            upload_mode = subparser.add_mutually_exclusive_group()
+            upload_mode.add_argument('--reconcile', action='store_true',
+                help="Only write the differences with the stored scenarios.")
+            upload_mode.add_argument('--resume', action='store_true',
+                help="Continue a failed upload from its last completed step.")
+        if name == 'varcf':
+            subparser.add_argument('--staging', action='store_true',
+                help="Load capacity factors through an unlogged staging table.")
+        if name == 'prep-schema':
+            subparser.add_argument('--revert', action='store_true',
+                help="Drop the indexes created by prep-schema.")
+        if name in ('upload', 'varcf', 'others', 'prep-schema'):
+            subparser.add_argument('--profile', action='store_true',
+                help="Write a report of the slowest database statements.")
+            subparser.add_argument('--explain', action='store_true',
+                help="Include EXPLAIN (ANALYZE, BUFFERS) plans in the report.")
+        if name == 'export':
+            subparser.add_argument('fname',
+                help="Processed tab file, e.g. historic_heat_rates_WIDE.tab")
+            subparser.add_argument('output', help="Path of the exported tab file")
+            subparser.add_argument('--year', type=int)
+    subparser = subparsers.add_parser('import-times',
+        help="Measure the startup cost of each subcommand.")
+    subparser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'import-times':
+        import_times(args.repeat)
+        return
+    function = load_command(args.command)
+    if getattr(args, 'profile', False) or getattr(args, 'explain', False):
+        import queries
+        queries.PROFILE_QUERIES = True
+        queries.EXPLAIN_QUERIES = args.explain
+    if args.command in ('scrape', 'parse'):
+        function(run_config(args))
+    elif args.command == 'sweep':
+        import json
+        import sweep
+        with open(args.grid) as f:
+            grid = json.load(f)
+        function(grid, run_config(args), directory=args.output or sweep.sweep_directory,
+            finish=args.finish, workers=args.workers or sweep.SWEEP_WORKERS)
+    elif args.command == 'verify':
+        import integrity
+        status = function(threads=args.threads or integrity.VERIFY_THREADS,
+            use_cache=not args.no_cache)
+        if set(status.values()) - set(['ok', 'missing']):
+            sys.exit(1)
+    elif args.command == 'serve-mirror':
+        import mirror
+        function(args.directory, args.port or mirror.DEFAULT_PORT)
+    elif args.command == 'restore':
+        function(args.form, args.year, output=args.output, timestamp=args.timestamp)
+    elif args.command == 'finish':
+        function(args.year)
+    elif args.command == 'upload':
+        function(args.year, reconcile=args.reconcile, resume=args.resume)
+    elif args.command == 'varcf':
+        function(staging=args.staging)
+    elif args.command == 'prep-schema':
+        function(revert_changes=args.revert)
+    elif args.command == 'export':
+        function(args.fname, args.output,
+            where={'Year':args.year} if args.year is not None else None)
+    else:
+        function()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Vectorized statistics used to clean up heat rate data.
+
+kth_best_heat_rate() selects the k-th smallest valid monthly heat rate of each
+record with a partial sort (np.partition) over a float32 month matrix, instead
+of fully sorting a copy of the whole DataFrame.
+
+clip_outliers() replaces the top and bottom fraction of values of a column by
+the values at those positions, either over the whole column or per group (e.g.
+per Prime Mover and Energy Source), using Series.clip instead of writing each
+outlier separately.
+
+Run this file directly to benchmark both functions against the previous
+implementations with synthetic data.
+
+"""
+
+import timeit
+import numpy as np
+import pandas as pd
+
+
+def kth_best_heat_rate(heat_rates, k=2):
+    """
+    Receives a (records x months) array or DataFrame of heat rates and returns
+    an array with the k-th smallest valid heat rate of each record. Zero,
+    negative, infinite and null heat rates are ignored. Records with less than
+    k valid heat rates get a NaN value. Raises ValueError if k is lower
+    than 1.
+
+    The selection is done on a float32 copy of the data, and the values are
+    returned at full precision. Heat rates that only differ beyond float32
+    precision are considered equal, so the value of either of them may be
+    returned.
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1 (got {})".format(k))
+    values = np.asarray(heat_rates, dtype=np.float64)
+    n_records, n_months = values.shape
+    if n_records == 0 or k > n_months:
+        return np.full(n_records, np.nan)
+    candidates = values.astype(np.float32)
+    # Invalid values are moved to the end of the partition
+    with np.errstate(invalid='ignore'):
+        candidates[~(np.isfinite(candidates) & (candidates > 0))] = np.inf
+    positions = np.argpartition(candidates, k-1, axis=1)[:, k-1]
+    rows = np.arange(n_records)
+    best = values[rows, positions]
+    best[np.isinf(candidates[rows, positions])] = np.nan
+    return best
+
+
+def _order_statistic_bounds(values, fraction):
+    """
+    Returns the values found at the bottom and top 'fraction' positions of
+    the sorted values (same convention as sorting the values and reading the
+    positions int(n*fraction) and -1-int(n*fraction)).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    n_outliers = int(n*fraction)
+    if n == 0:
+        return np.nan, np.nan
+    partitioned = np.partition(values, [n_outliers, n-1-n_outliers])
+    return partitioned[n_outliers], partitioned[n-1-n_outliers]
+
+
+def clip_outliers(df, column, fraction=0.008, groupby=None):
+    """
+    Replaces the bottom and top 'fraction' of values of a column with the
+    values at those positions. If a list of columns is passed in groupby,
+    bounds are calculated separately for each group. Null values are ignored
+    and kept as they are.
+
+    Returns a tuple with the clipped column (as a Series with the same index
+    as the DataFrame) and a DataFrame with the lower and upper bound of each
+    row.
+    """
+    valid = df[df[column].notnull()]
+    if groupby:
+        # Both bounds of each group are found with a single partition, and
+        # then matched to the rows of the group
+        group_bounds = valid.groupby(groupby)[column].apply(
+            lambda s: _order_statistic_bounds(s, fraction))
+        group_bounds = pd.DataFrame(group_bounds.tolist(),
+            index=group_bounds.index, columns=['lower', 'upper'])
+        row_bounds = valid[groupby].join(group_bounds, on=groupby)
+        lower, upper = row_bounds['lower'], row_bounds['upper']
+    else:
+        min_value, max_value = _order_statistic_bounds(valid[column], fraction)
+        lower = pd.Series(min_value, index=valid.index)
+        upper = pd.Series(max_value, index=valid.index)
+    bounds = pd.DataFrame({'lower':lower, 'upper':upper}).reindex(df.index)
+    clipped = df[column].clip(lower=bounds['lower'], upper=bounds['upper'], axis=0)
+    return clipped, bounds
+
+
+def benchmark(n_records=20000, n_groups=20, fraction=0.008, repeat=3):
+    """
+    Compares the vectorized functions with the previous implementations
+    (full sort of a copy of the DataFrame and an explicit loop of .loc writes,
+    over the whole column or repeated for each group).
+    """
+    np.random.seed(0)
+    heat_rates = pd.DataFrame(np.random.lognormal(2.3, 0.3, (n_records, 12)),
+        columns=['Heat Rate Month {}'.format(m) for m in range(1,13)])
+    heat_rates[heat_rates < 8] = 0
+
+    def previous_best_heat_rate():
+        return pd.DataFrame(np.sort(heat_rates.replace([0,float('inf')],float('nan'))[
+            heat_rates>0].filter(regex=r'Heat Rate'))).iloc[:,1]
+
+    def new_best_heat_rate():
+        return kth_best_heat_rate(heat_rates.values, k=2)
+
+    gens = pd.DataFrame({
+        'Best Heat Rate':np.random.lognormal(2.3, 0.3, n_records),
+        'Prime Mover':np.random.randint(0, n_groups, n_records)})
+
+    def previous_clip(df=gens):
+        df = df.sort_values('Best Heat Rate')
+        n_outliers = int(len(df)*fraction)
+        min_hr = df.loc[df.index[n_outliers],'Best Heat Rate']
+        max_hr = df.loc[df.index[-1-n_outliers],'Best Heat Rate']
+        for i in range(n_outliers):
+            df.loc[df.index[i],'Best Heat Rate'] = min_hr
+            df.loc[df.index[-1-i],'Best Heat Rate'] = max_hr
+        return df['Best Heat Rate'].sort_index()
+
+    def new_clip():
+        return clip_outliers(gens, 'Best Heat Rate', fraction)[0]
+
+    def previous_group_clip():
+        return pd.concat([previous_clip(group)
+            for _, group in gens.groupby('Prime Mover')]).sort_index()
+
+    def new_group_clip():
+        return clip_outliers(gens, 'Best Heat Rate', fraction,
+            groupby=['Prime Mover'])[0]
+
+    assert np.allclose(previous_best_heat_rate().values, new_best_heat_rate(),
+        equal_nan=True)
+    assert np.allclose(previous_clip().values, new_clip().values)
+    assert np.allclose(previous_group_clip().values, new_group_clip().values)
+
+    print "Benchmark with {} records ({} repetitions):".format(n_records, repeat)
+    for name, previous, new in [
+        ('Second best heat rate', previous_best_heat_rate, new_best_heat_rate),
+        ('Outlier clipping', previous_clip, new_clip),
+        ('Outlier clipping per group', previous_group_clip, new_group_clip)]:
+        t_previous = min(timeit.repeat(previous, number=1, repeat=repeat))
+        t_new = min(timeit.repeat(new, number=1, repeat=repeat))
+        print "{}: {:.4f} s -> {:.4f} s ({:.1f}x)".format(
+            name, t_previous, t_new, t_previous/t_new)
+
+
+if __name__ == "__main__":
+    benchmark()
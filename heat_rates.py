@@ -0,0 +1,156 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+In-process loaders for the tab files in the processed_data directory, with
+special support for the yearly heat rate tables calculated from EIA923 data
+(historic_heat_rates_WIDE.tab).
+
+Parsed tables are kept in a small LRU cache keyed by the path, modification
+time and size of the source file, so repeated calls in the same session (or
+notebook) only parse each file once. Rewriting a file (i.e. re-running the
+scraping process) invalidates the cached copies automatically.
+
+Callers always receive copies of the cached tables, so they can be modified
+freely without corrupting the cache.
+
+If USE_PROCESSED_STORE is set, tables are queried from the embedded database
+in processed_store.py instead, so filters are applied before parsing.
+
+"""
+
+import os
+from collections import OrderedDict
+import pandas as pd
+
+from utils import read_historic_output
+from processed_store import filter_frame, read_table
+from codes import code_table
+from config import default_config
+
+heat_rate_index = ['EIA Plant Code','Prime Mover','Energy Source']
+# Maximum number of parsed tables to keep in memory
+CACHE_SIZE = 16
+# Query tables from the embedded database (see processed_store.py)
+USE_PROCESSED_STORE = False
+# Maps EIA energy source codes to the fuel names used in Switch
+fuels = {
+    'LFG':'Bio_Gas',
+    'OBG':'Bio_Gas',
+    'AB':'Bio_Solid',
+    'BLQ':'Bio_Liquid',
+    'NG':'Gas',
+    'OG':'Gas',
+    'PG':'Gas',
+    'DFO':'DistillateFuelOil',
+    'JF':'ResidualFuelOil',
+    'COAL':'Coal',
+    'GEO':'Geothermal',
+    'NUC':'Uranium',
+    'PC':'Coal',
+    'SUN':'Solar',
+    'WDL':'Bio_Liquid',
+    'WDS':'Bio_Solid',
+    'MSW':'Bio_Solid',
+    'PUR':'Purchased_Steam',
+    'WH':'Waste_Heat',
+    'OTH':'Other',
+    'WAT':'Water',
+    'MWH':'Electricity',
+    'WND':'Wind'
+}
+
+_cache = OrderedDict()
+
+
+def _file_signature(path):
+    """
+    Returns a tuple that changes whenever the file in the path is rewritten.
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def _cached(key, loader):
+    """
+    Returns the object stored in the cache under the key, or calls the loader
+    to build it. The least recently used entries are evicted when the cache
+    holds more than CACHE_SIZE objects.
+    """
+    if key in _cache:
+        value = _cache.pop(key)
+    else:
+        value = loader()
+    _cache[key] = value
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return value
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _where_key(where):
+    return tuple(sorted((column, tuple(values) if isinstance(values, list)
+        else values) for column, values in (where or {}).items()))
+
+
+def read_processed_table(fname, directory=default_config.outputs_directory,
+    year=None, where=None):
+    """
+    Reads a tab separated file from the processed data directory. The parsed
+    DataFrame is cached until the file is modified.
+
+    If a year is provided, historic files are read in chunks and only records
+    of that year are kept, so memory usage does not grow with the number of
+    years in the file. Other filters can be passed in 'where', as a dict of
+    columns and accepted values (see processed_store.build_query).
+    """
+    path = os.path.join(directory, fname)
+    if USE_PROCESSED_STORE:
+        if year is not None:
+            where = dict(where or {}, Year=year)
+        loader = lambda: read_table(fname, directory, where)
+    elif year is None:
+        loader = lambda: filter_frame(
+            pd.read_csv(path, sep='\t', index_col=None), where)
+    else:
+        loader = lambda: filter_frame(read_historic_output(path, year), where)
+    df = _cached(('table', year, _where_key(where), USE_PROCESSED_STORE) +
+        _file_signature(path), loader)
+    return df.copy()
+
+
+def load_heat_rate_table(year, map_fuels=True,
+    directory=default_config.outputs_directory,
+    codes_directory=default_config.other_data_directory):
+    """
+    Returns the 'Best Heat Rate' of each plant, prime mover and energy source
+    for the requested year, read from historic_heat_rates_WIDE.tab.
+
+    The table is indexed by (EIA Plant Code, Prime Mover, Energy Source), so
+    single records can be looked up directly with .loc. If map_fuels is True,
+    energy sources are translated to Switch fuel names (see the fuels dict),
+    with the code tables of codes_directory.
+
+    """
+    path = os.path.join(directory, 'historic_heat_rates_WIDE.tab')
+
+    def build_table():
+        heat_rate_data = read_processed_table(
+            'historic_heat_rates_WIDE.tab', directory, year).rename(
+            columns={'Plant Code':'EIA Plant Code'})
+        if map_fuels:
+            heat_rate_data['Energy Source'] = code_table('energy_source',
+                codes_directory).remap(heat_rate_data['Energy Source'], fuels)
+        heat_rate_data = heat_rate_data[heat_rate_index+['Best Heat Rate']]
+        heat_rate_data = heat_rate_data.astype({
+            'EIA Plant Code':int,
+            'Prime Mover':str,
+            'Energy Source':str,
+            'Best Heat Rate':float})
+        return heat_rate_data.set_index(heat_rate_index).sort_index()
+
+    table = _cached(('heat_rates', year, map_fuels, codes_directory) +
+        _file_signature(path), build_table)
+    return table.copy()
@@ -0,0 +1,232 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Indexed queries of the monthly series of the historic NARROW output files
+(heat rates and hydro capacity factors), without parsing the whole files.
+
+The historic files grow with every year that is processed. The first time a
+file is queried (and whenever it changes), its numeric columns and its Prime
+Mover and Energy Source codes are copied to a columnar layout: records are
+sorted by plant, prime mover, energy source, year and month, and each column
+is stored as a contiguous array in FILE.series. FILE.series.json describes the
+arrays (dtype and offset), the codes of the text columns, and the offset of
+the records of each plant. Columns are memory-mapped, so a query only reads
+the pages of the requested plants: finding a plant is a binary search in the
+plant index, and its records are a slice of each column, no matter how many
+years the file holds. Other text columns (plant name, state, county and
+secondary energy sources) are not copied.
+
+    from historic_series import get_series
+    get_series(55077, 'CC', 'Heat Rate', years=range(2012, 2016))
+
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import default_config
+
+# Historic files and the energy source of their records, for files without an
+# Energy Source column
+series_files = OrderedDict([
+    ('historic_heat_rates_NARROW.tab', None),
+    ('historic_hydro_capacity_factors_NARROW.tab', 'WAT'),
+    ])
+key_columns = ['Plant Code', 'Prime Mover', 'Energy Source', 'Year', 'Month']
+coded_columns = ['Prime Mover', 'Energy Source']
+# Text columns that are not copied (they are numeric if they are all empty)
+uncopied_columns = ['Plant Name', 'State', 'County', 'Energy Source 2',
+    'Energy Source 3']
+# Byte alignment of the arrays in the columnar files
+ALIGNMENT = 8
+_stores = {}
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def build_series_store(fname, directory=default_config.outputs_directory):
+    """
+    Writes the columnar copy of a historic file and its description.
+    """
+    path = os.path.join(directory, fname)
+    signature = _signature(path)
+    print "Indexing the series of {}...".format(fname)
+    df = pd.read_csv(path, sep='\t', index_col=None)
+    df = df.sort_values([c for c in key_columns if c in df.columns],
+        kind='mergesort')
+    arrays, categories = [], {}
+    for column in df.columns:
+        if column in coded_columns:
+            codes, values = pd.factorize(df[column], sort=True)
+            arrays.append((column, codes.astype(np.int32)))
+            categories[column] = list(values)
+        elif column not in uncopied_columns and df[column].dtype.kind in 'biuf':
+            arrays.append((column, df[column].values))
+    plants, starts = np.unique(df['Plant Code'].values, return_index=True)
+    arrays.append(('_plants', plants.astype(np.int64)))
+    arrays.append(('_starts', np.append(starts, len(df)).astype(np.int64)))
+
+    header = {'source': signature, 'rows': len(df), 'columns': []}
+    store_path = path + '.series'
+    with open(store_path + '.tmp', 'wb') as f:
+        for column, values in arrays:
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            header['columns'].append({'name': column, 'dtype': values.dtype.str,
+                'offset': f.tell(), 'length': len(values),
+                'categories': categories.get(column)})
+            values.tofile(f)
+    os.rename(store_path + '.tmp', store_path)
+    # The description is replaced last, so it never points to an older copy
+    with open(store_path + '.json.tmp', 'w') as f:
+        json.dump(header, f, indent=1)
+    os.rename(store_path + '.json.tmp', store_path + '.json')
+
+
+class SeriesStore(object):
+    """
+    Memory-mapped columns of a historic file, with the offsets of the records
+    of each plant.
+    """
+
+    def __init__(self, store_path):
+        with open(store_path + '.json') as f:
+            header = json.load(f)
+        self.source = header['source']
+        self.columns = OrderedDict()
+        self.categories = {}
+        self.codes = {}
+        for column in header['columns']:
+            dtype = np.dtype(str(column['dtype']))
+            if column['length']:
+                values = np.memmap(store_path, dtype=dtype, mode='r',
+                    offset=column['offset'], shape=(column['length'],))
+            else:
+                values = np.zeros(0, dtype=dtype)
+            self.columns[column['name']] = values
+            if column['categories'] is not None:
+                self.categories[column['name']] = np.array(
+                    column['categories'] + [None], dtype=object)
+                self.codes[column['name']] = dict((value, i)
+                    for i, value in enumerate(column['categories']))
+        self.plants = self.columns.pop('_plants')
+        self.starts = self.columns.pop('_starts')
+
+    def plant_rows(self, plant_code):
+        """
+        Returns the first and last (excluded) rows of the records of a plant.
+        """
+        i = self.plants.searchsorted(plant_code)
+        if i < len(self.plants) and self.plants[i] == plant_code:
+            return self.starts[i], self.starts[i+1]
+        return 0, 0
+
+    def column(self, column, rows):
+        """
+        Returns the values of a column in some rows, with the codes of text
+        columns translated to their values.
+        """
+        values = self.columns[column][rows]
+        if column in self.categories:
+            # Code -1 (null values) takes the last category, None
+            return self.categories[column].take(values)
+        return np.asarray(values)
+
+    def select(self, plant_code, prime_mover=None, energy_source=None,
+        years=None):
+        """
+        Returns the rows of the records of a plant that match the filters.
+        """
+        start, stop = self.plant_rows(int(plant_code))
+        mask = np.ones(stop - start, dtype=bool)
+        for column, value in (('Prime Mover', prime_mover),
+            ('Energy Source', energy_source)):
+            if value is not None:
+                mask &= (self.columns[column][start:stop] ==
+                    self.codes[column].get(value, -2))
+        if years is not None:
+            mask &= np.isin(self.columns['Year'][start:stop], list(years))
+        return start + np.flatnonzero(mask)
+
+    def records(self, plant_codes, columns=None, years=None):
+        """
+        Returns the records of the plants (with all columns by default) as a
+        DataFrame.
+        """
+        rows = np.concatenate([self.select(plant_code, years=years)
+            for plant_code in plant_codes] or [np.zeros(0, dtype=int)])
+        return pd.DataFrame(OrderedDict((column, self.column(column, rows))
+            for column in (columns or self.columns)))
+
+
+def open_series_store(fname, directory=default_config.outputs_directory):
+    """
+    Returns the columnar copy of a historic file, which is (re)built if the
+    file changed since it was last indexed.
+    """
+    path = os.path.join(directory, fname)
+    signature = _signature(path)
+    store = _stores.get(path)
+    if store is not None and store.source == signature:
+        return store
+    store_path = path + '.series'
+    if os.path.isfile(store_path + '.json'):
+        store = SeriesStore(store_path)
+    if store is None or store.source != signature:
+        build_series_store(fname, directory)
+        store = SeriesStore(store_path)
+    _stores[path] = store
+    return store
+
+
+def read_records(fname, plant_codes, columns=None, years=None,
+    directory=default_config.outputs_directory):
+    """
+    Returns the records of some plants in a historic file (see series_files),
+    without their text columns other than the Prime Mover and Energy Source.
+    """
+    store = open_series_store(fname, directory)
+    return store.records([int(p) for p in plant_codes if pd.notnull(p)],
+        columns, years)
+
+
+def get_series(plant_code, prime_mover, metric, years=None, energy_source=None,
+    directory=default_config.outputs_directory):
+    """
+    Returns the monthly values of a metric (e.g. 'Heat Rate' or 'Capacity
+    Factor') of a plant and prime mover, as a Series indexed by energy source,
+    year and month. Records of hydro plants have the WAT energy source.
+    """
+    sources, record_years, months, values = [], [], [], []
+    for fname, file_source in series_files.items():
+        if not os.path.isfile(os.path.join(directory, fname)):
+            continue
+        if file_source is not None and energy_source not in (None, file_source):
+            continue
+        store = open_series_store(fname, directory)
+        if metric not in store.columns:
+            continue
+        rows = store.select(plant_code, prime_mover,
+            energy_source if file_source is None else None, years)
+        if file_source is None:
+            sources.append(store.column('Energy Source', rows))
+        else:
+            sources.append(np.array([file_source] * len(rows), dtype=object))
+        record_years.append(store.column('Year', rows))
+        months.append(store.column('Month', rows))
+        values.append(store.column(metric, rows))
+    if not values:
+        raise KeyError("No historic file has a '{}' column".format(metric))
+    # Built from the codes of each level, which is faster than from_arrays
+    levels = [pd.factorize(np.concatenate(arrays))
+        for arrays in (sources, record_years, months)]
+    index = pd.MultiIndex([uniques for codes, uniques in levels],
+        [codes for codes, uniques in levels],
+        names=['Energy Source', 'Year', 'Month'], verify_integrity=False)
+    return pd.Series(np.concatenate(values), index=index, name=metric)
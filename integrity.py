@@ -0,0 +1,134 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Integrity verification of the archived downloads.
+
+The SHA1 hash of each form is logged in download_log.csv when it is
+downloaded. verify_downloads() hashes every zip file in the downloads
+directory again and compares it with the latest hash logged for that file, so
+archives that were modified or corrupted after their download (or that were
+never logged) are detected.
+
+Files are memory-mapped and hashed by a pool of threads. hashlib releases the
+GIL while hashing large buffers, so the threads hash different files in
+parallel. The hash of each verified file is cached with its size and
+modification time in verified_downloads.json, and is reused by later runs
+while the file is unchanged. Run 'python eia_scrape.py verify' to check the
+archive.
+
+"""
+
+import csv
+import datetime
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+from config import default_config
+from utils import file_sha1
+
+VERIFY_THREADS = 4
+# Cache of verified hashes, saved in the verified directory
+cache_name = 'verified_downloads.json'
+
+
+def logged_downloads(log_path=default_config.download_log_path):
+    """
+    Returns the latest entry of the download log of each file, by file name.
+    """
+    downloads = {}
+    with open(log_path, 'rb') as logfile:
+        entries = sorted(csv.DictReader(logfile, delimiter='\t', quotechar="'"),
+            key=lambda entry: entry['download_timestamp_utc'])
+    # Older entries logged the path of the file instead of its name
+    for entry in entries:
+        downloads[os.path.basename(entry['filename'])] = entry
+    return downloads
+
+
+def logged_hashes(log_path=default_config.download_log_path):
+    """
+    Returns the latest logged SHA1 of each downloaded file, by file name.
+    """
+    return dict((filename, entry['sha1']) for filename, entry
+        in logged_downloads(log_path).items())
+
+
+def _load_cache(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_cache(path, cache):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def verify_downloads(directory=default_config.unzip_directory,
+    log_path=default_config.download_log_path, threads=VERIFY_THREADS,
+    use_cache=True):
+    """
+    Hashes the zip files in the directory (reusing the cached hashes of
+    unchanged files) and compares them with the latest logged hashes.
+
+    Returns a dict of file names and their status:
+        ok: the hash matches the logged hash
+        mismatch: the hash differs from the logged hash
+        unlogged: the file has no entry in the download log
+        missing: the file is logged, but is not in the directory
+    """
+    expected = logged_hashes(log_path)
+    cache_path = os.path.join(directory, cache_name)
+    cache = _load_cache(cache_path) if use_cache else {}
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith('.zip'))
+    signatures = {}
+    for filename in filenames:
+        stat = os.stat(os.path.join(directory, filename))
+        signatures[filename] = [stat.st_size, stat.st_mtime]
+
+    stale = [f for f in filenames if cache.get(f, {}).get('signature') != signatures[f]]
+    print "Hashing {} files ({} unchanged files were verified before)...".format(
+        len(stale), len(filenames) - len(stale))
+    pool = ThreadPool(threads)
+    try:
+        hashes = pool.map(file_sha1, [os.path.join(directory, f) for f in stale])
+    finally:
+        pool.close()
+        pool.join()
+    now = str(datetime.datetime.utcnow())
+    for filename, sha1 in zip(stale, hashes):
+        cache[filename] = {'signature': signatures[filename], 'sha1': sha1,
+            'verified_at_utc': None}
+
+    status = {}
+    for filename in filenames:
+        if filename not in expected:
+            status[filename] = 'unlogged'
+        elif cache[filename]['sha1'] != expected[filename]:
+            status[filename] = 'mismatch'
+        else:
+            status[filename] = 'ok'
+            if cache[filename]['verified_at_utc'] is None:
+                cache[filename]['verified_at_utc'] = now
+    for filename in expected:
+        if filename not in status:
+            status[filename] = 'missing'
+
+    # Only hashes of files currently in the directory are kept
+    _save_cache(cache_path, {f: cache[f] for f in filenames})
+
+    for filename in sorted(status):
+        if status[filename] == 'mismatch':
+            print "--MISMATCH: {} has SHA1 {}, but {} was logged".format(filename,
+                cache[filename]['sha1'], expected[filename])
+        elif status[filename] != 'ok':
+            print "--{}: {}".format(status[filename].upper(), filename)
+    print "Verified {} of {} files. {} mismatches, {} unlogged, {} missing.".format(
+        status.values().count('ok'), len(filenames),
+        status.values().count('mismatch'), status.values().count('unlogged'),
+        status.values().count('missing'))
+    return status
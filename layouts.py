@@ -0,0 +1,226 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Detection of the layout of the EIA860 and EIA923 workbooks.
+
+The workbooks of each year name their files and sheets differently, and have
+a different number of rows above their headers. sniff_layout() finds, for
+each sheet needed by the parser, the workbook and sheet that hold it and the
+row of its header. Only the first SNIFF_ROWS rows of each sheet are read.
+Sheets are recognized by the columns in their header (as renamed by
+scrape.uniformize_names):
+
+    eia860 plants: plant data, without generator ids
+    eia860 existing_generators, proposed_generators: generator data, told
+        apart by the names of their sheet or file and their columns
+    eia923 generation: monthly generation and fuel consumption of each plant
+
+Layouts are saved in a registry directory, with one file per form, year and
+SHA1 of the extracted archive (see utils.unzip), so each revision of a form is
+only sniffed once. Parses of different years that run at once (see
+pipeline.py) never write the same file. read_sheets() then opens each
+workbook once and reads its sheets from their header rows.
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import pandas as pd
+
+from utils import extracted_sha1, file_sha1
+
+SNIFF_ROWS = 20
+# Columns that identify each sheet, and columns that it must not have
+sheet_signatures = {
+    'eia860': OrderedDict([
+        ('plants', (['Plant Code', 'Plant Name', 'State', 'Nerc Region'],
+            ['Generator Id'])),
+        ('existing_generators', (['Plant Code', 'Generator Id',
+            'Nameplate Capacity (MW)', 'Operating Year'], [])),
+        ('proposed_generators', (['Plant Code', 'Generator Id',
+            'Nameplate Capacity (MW)', 'Operating Year'], [])),
+        ]),
+    'eia923': OrderedDict([
+        ('generation', (['Plant Code', 'Prime Mover', 'Energy Source'], [])),
+        ]),
+    }
+# Sheets of retired and canceled generators are not parsed
+ignored_sheet_words = ['Retired', 'Canceled']
+
+
+def workbook_files(directory):
+    """
+    Returns the Excel workbooks in the directory, excluding temporary files
+    of open workbooks.
+    """
+    return sorted(f for f in os.listdir(directory)
+        if os.path.splitext(f)[1].lower() in ('.xls', '.xlsx', '.xlsm')
+        and '~' not in f)
+
+
+def iter_sheet_heads(path, n_rows=SNIFF_ROWS):
+    """
+    Yields the name and the first rows (as lists of values) of each sheet of
+    a workbook, without loading the whole sheets.
+    """
+    if os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm'):
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        for sheet_name in workbook.sheetnames:
+            yield sheet_name, [[cell.value for cell in row]
+                for row in workbook[sheet_name].iter_rows(max_row=n_rows)]
+    else:
+        import xlrd
+        workbook = xlrd.open_workbook(path, on_demand=True)
+        # Resources are also released if the caller stops iterating early
+        try:
+            for sheet_name in workbook.sheet_names():
+                sheet = workbook.sheet_by_name(sheet_name)
+                yield sheet_name, [sheet.row_values(i)
+                    for i in xrange(min(sheet.nrows, n_rows))]
+                workbook.unload_sheet(sheet_name)
+        finally:
+            workbook.release_resources()
+
+
+def header_columns(row):
+    """
+    Returns the names of the columns of a header row, as renamed by
+    scrape.uniformize_names. Rows without a plant column (e.g. data rows)
+    cannot be headers, so an empty list is returned for them.
+    """
+    from scrape import uniformize_names
+    cells = [v.strip() for v in row if isinstance(v, basestring) and v.strip()]
+    if not any('plant' in cell.lower() for cell in cells):
+        return []
+    # uniformize_names calls str() on the names, which fails on non-ASCII
+    # unicode
+    cells = [c.encode('utf-8') if isinstance(c, unicode) else c for c in cells]
+    return list(uniformize_names(pd.DataFrame(columns=cells)).columns)
+
+
+def is_proposed(fname, sheet_name, row):
+    """
+    Tells apart sheets of proposed generators from sheets of existing ones.
+    """
+    names = (fname + ' ' + sheet_name).lower()
+    raw_columns = [unicode(v).strip().lower() for v in row if v is not None]
+    return ('proposed' in names or fname.lower().startswith('prgen') or
+        'current year' in raw_columns or
+        any(c.startswith('proposed') for c in raw_columns))
+
+
+def sniff_layout(directory, form):
+    """
+    Returns the file, sheet and header row of each sheet of the form, as a
+    dict of dicts. Workbooks are searched from the largest one, and the first
+    matching sheet is used.
+    """
+    signatures = sheet_signatures[form]
+    layout = {}
+    files = sorted(workbook_files(directory), reverse=True,
+        key=lambda f: os.path.getsize(os.path.join(directory, f)))
+    for fname in files:
+        for sheet_name, rows in iter_sheet_heads(os.path.join(directory, fname)):
+            if any(word in sheet_name for word in ignored_sheet_words):
+                continue
+            for i, row in enumerate(rows):
+                columns = set(header_columns(row))
+                matches = [target for target, (required, excluded) in signatures.items()
+                    if set(required) <= columns and not columns & set(excluded)]
+                if 'existing_generators' in matches:
+                    matches.remove('proposed_generators' if
+                        not is_proposed(fname, sheet_name, row) else 'existing_generators')
+                matches = [t for t in matches if t not in layout]
+                if matches:
+                    layout[matches[0]] = {'file': fname, 'sheet': sheet_name,
+                        'header_row': i}
+                    break
+            # The remaining sheets are not sniffed once every sheet is found
+            if len(layout) == len(signatures):
+                break
+        if len(layout) == len(signatures):
+            break
+    missing = [target for target in signatures if target not in layout]
+    if missing:
+        raise ValueError("Could not find the {} sheets of the {} form in {}".format(
+            ', '.join(missing), form, directory))
+    return layout
+
+
+def _registry_entry_path(registry_directory, form, year, sha1):
+    return os.path.join(registry_directory, '{}_{}_{}.json'.format(form, year, sha1))
+
+
+def _save_registry_entry(path, layout):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another process
+            pass
+    # Entries are renamed into place once complete, so they are never partial
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(layout, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def revision_sha1(directory):
+    """
+    Returns the SHA1 of the archive extracted to the directory, or a hash of
+    its workbooks if it was not recorded.
+    """
+    sha1 = extracted_sha1(directory)
+    if sha1 is None:
+        hasher = hashlib.sha1()
+        for fname in workbook_files(directory):
+            hasher.update(fname + file_sha1(os.path.join(directory, fname)))
+        sha1 = hasher.hexdigest()
+    return sha1
+
+
+def workbook_layout(directory, form, year, registry_directory):
+    """
+    Returns the layout of a form, from the registry or sniffed from its
+    workbooks (and then saved to the registry).
+    """
+    entry_path = _registry_entry_path(registry_directory, form, year,
+        revision_sha1(directory))
+    if os.path.isfile(entry_path):
+        print "Using the registered layout of the {} {} workbooks.".format(form, year)
+        with open(entry_path) as f:
+            return json.load(f)
+    print "Detecting the layout of the {} {} workbooks...".format(form, year)
+    layout = sniff_layout(directory, form)
+    for target in sheet_signatures[form]:
+        print "--{}: sheet '{}' of {} (header in row {})".format(target,
+            layout[target]['sheet'], layout[target]['file'], layout[target]['header_row'])
+    _save_registry_entry(entry_path, layout)
+    return layout
+
+
+def read_sheets(directory, layout):
+    """
+    Reads the sheets of a layout into DataFrames, by target. Each workbook is
+    opened once.
+    """
+    frames = {}
+    files = OrderedDict()
+    for target in sorted(layout):
+        files.setdefault(layout[target]['file'], []).append(target)
+    for fname, targets in files.items():
+        workbook = pd.ExcelFile(os.path.join(directory, fname))
+        for target in targets:
+            frames[target] = workbook.parse(layout[target]['sheet'],
+                skiprows=layout[target]['header_row'])
+    return frames
@@ -0,0 +1,245 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Shared mirror of the EIA downloads, so a team fetches each form from eia.gov
+only once.
+
+If the mirror of the run configuration (see config.py) is set to a directory
+(e.g. on a shared filesystem) or to the url of a mirror server,
+utils.download_file() first copies the file from the mirror. Mirrors keep a
+download_log.csv with the SHA1 of each file they got from upstream, and
+copies that do not match it are discarded. Files are only downloaded from
+upstream if the mirror does not have them (or has a bad copy). Files
+downloaded from upstream are added to directory mirrors, so the next analyst
+finds them there.
+
+A caching mirror server can be started on any machine of the team (or
+locally, for tests) with:
+
+    python eia_scrape.py serve-mirror DIRECTORY [--port 8860]
+
+It serves the forms in the directory, downloading the missing ones from
+upstream when they are first requested. Point the scrape to a mirror with
+'python eia_scrape.py scrape --mirror PATH_OR_URL'.
+
+"""
+
+import BaseHTTPServer
+import csv
+import datetime
+import hashlib
+import os
+import shutil
+import SimpleHTTPServer
+import SocketServer
+import tempfile
+import threading
+import urllib
+import zipfile
+
+from utils import BLOCKSIZE, download_file, download_metadata_fields, file_sha1
+
+DEFAULT_PORT = 8860
+log_name = 'download_log.csv'
+# Serializes writes to the log of a mirror
+_log_lock = threading.Lock()
+
+
+def is_remote(mirror):
+    return mirror.startswith('http://') or mirror.startswith('https://')
+
+
+def _read_log(logfile):
+    """
+    Returns the latest logged SHA1 of each file in a download log.
+    """
+    entries = sorted(csv.DictReader(logfile, delimiter='\t', quotechar="'"),
+        key=lambda entry: entry['download_timestamp_utc'])
+    return dict((os.path.basename(entry['filename']), entry['sha1'])
+        for entry in entries)
+
+
+def mirror_hashes(mirror):
+    """
+    Returns the SHA1 of each file of the mirror, from its download log.
+    """
+    if is_remote(mirror):
+        import requests
+        r = requests.get(mirror.rstrip('/') + '/' + log_name)
+        if r.status_code == 404:
+            return {}
+        r.raise_for_status()
+        return _read_log(r.content.splitlines())
+    path = os.path.join(mirror, log_name)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'rb') as logfile:
+        return _read_log(logfile)
+
+
+def _copy_hashing(source, target):
+    """
+    Copies a file object to a file and returns the SHA1 of the contents.
+    """
+    hasher = hashlib.sha1()
+    with open(target, 'wb') as f:
+        while True:
+            chunk = source.read(BLOCKSIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def fetch(mirror, filename, local_path):
+    """
+    Copies a file from the mirror to the local path. Returns its SHA1, or
+    None if the mirror does not have a copy matching its log.
+    """
+    if is_remote(mirror):
+        # The server downloads missing forms before answering, so its log is
+        # read after the file
+        import requests
+        r = requests.get(mirror.rstrip('/') + '/' + urllib.quote(filename),
+            stream=True)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        r.raw.decode_content = True
+        sha1 = _copy_hashing(r.raw, local_path)
+        expected = mirror_hashes(mirror).get(filename)
+    else:
+        expected = mirror_hashes(mirror).get(filename)
+        path = os.path.join(mirror, filename)
+        if expected is None or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as source:
+            sha1 = _copy_hashing(source, local_path)
+    if sha1 != expected:
+        print "--Discarded the copy of {} in the mirror, since its SHA1 {} does "\
+            "not match the SHA1 {} in the mirror log".format(filename, sha1, expected)
+        os.remove(local_path)
+        return None
+    return sha1
+
+
+def add_to_mirror(directory, path, filename, meta_data):
+    """
+    Copies a downloaded file to a directory mirror (with the file name) and
+    logs its metadata, unless the mirror already has an identical copy.
+    """
+    mirror_path = os.path.join(directory, filename)
+    if (mirror_hashes(directory).get(filename) == meta_data[3] and
+        os.path.isfile(mirror_path) and file_sha1(mirror_path) == meta_data[3]):
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    shutil.copyfile(path, tmp_path)
+    os.rename(tmp_path, mirror_path)
+    with _log_lock:
+        log_path = os.path.join(directory, log_name)
+        write_header = not os.path.isfile(log_path)
+        with open(log_path, 'ab') as logfile:
+            logwriter = csv.writer(logfile, delimiter='\t', quotechar="'",
+                quoting=csv.QUOTE_MINIMAL)
+            if write_header:
+                logwriter.writerow(download_metadata_fields)
+            logwriter.writerow((filename,) + tuple(meta_data[1:]))
+
+
+def download(url, local_path, mirror):
+    """
+    Gets a file from the mirror, or downloads it from the url if the mirror
+    misses it. Returns the download metadata (see utils.download_file).
+    """
+    filename = os.path.basename(local_path)
+    try:
+        sha1 = fetch(mirror, filename, local_path)
+    except Exception, e:
+        print "--Could not read {} from mirror {}: {}".format(filename, mirror, e)
+        sha1 = None
+    if sha1 is not None:
+        print "Copied {} from mirror {}".format(filename, mirror)
+        return (local_path, url, datetime.datetime.utcnow(), sha1)
+    print "{} is not in mirror {}. Downloading it from upstream.".format(filename, mirror)
+    meta_data = download_file(url, local_path)
+    if not is_remote(mirror) and os.access(mirror, os.W_OK):
+        add_to_mirror(mirror, local_path, filename, meta_data)
+    return meta_data
+
+
+def upstream_url(filename):
+    """
+    Returns the url of a form file, or None if its name is not recognized.
+    """
+    import scrape
+    from archive_store import form_and_year
+    form, year = form_and_year(filename)
+    if form == 'eia860':
+        return scrape.eia860_file(year)[1]
+    if form == 'eia923':
+        return scrape.eia923_file(year)[1]
+    return None
+
+
+class _MirrorHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves the files of the mirror directory, downloading missing forms from
+    upstream first.
+    """
+
+    def translate_path(self, path):
+        filename = urllib.unquote(path.split('?')[0]).strip('/')
+        return os.path.join(self.server.directory, os.path.basename(filename))
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        url = upstream_url(path)
+        if url is not None:
+            with self.server.lock_for(os.path.basename(path)):
+                if not os.path.isfile(path):
+                    self.fetch_upstream(url, path)
+        SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def fetch_upstream(self, url, path):
+        fd, tmp_path = tempfile.mkstemp(dir=self.server.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            meta_data = download_file(url, tmp_path)
+            # An EIA page is returned instead of a missing form
+            if zipfile.is_zipfile(tmp_path):
+                add_to_mirror(self.server.directory, tmp_path,
+                    os.path.basename(path), meta_data)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+
+class MirrorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, port=DEFAULT_PORT):
+        BaseHTTPServer.HTTPServer.__init__(self, ('', port), _MirrorHandler)
+        self.directory = directory
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def lock_for(self, filename):
+        with self._locks_lock:
+            return self._locks.setdefault(filename, threading.Lock())
+
+
+def serve(directory, port=DEFAULT_PORT):
+    """
+    Runs a mirror server for the directory until it is interrupted.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    server = MirrorServer(directory, port)
+    print "Serving mirror of EIA forms in {} on port {}".format(directory, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,171 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Internal representation of monthly EIA923 metrics (net generation, fuel
+consumption, heat rates, capacity factors, etc.).
+
+Each metric is stored as a contiguous (records x 12) float array, and all
+metrics share a single DataFrame with the descriptive columns of each record
+(plant code, prime mover, nameplate capacity, etc.). Calculations across
+months become single broadcast operations, and the WIDE and NARROW output
+formats are only generated when writing results to disk.
+
+"""
+
+from calendar import monthrange
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+months = range(1,13)
+_hours_per_month = {}
+
+
+def hours_per_month(year):
+    """
+    Returns a read-only vector with the number of hours in each month of the
+    year. Vectors are calculated once per year.
+    """
+    if year not in _hours_per_month:
+        hours = np.array([monthrange(int(year), month)[1]*24 for month in months],
+            dtype=np.float64)
+        hours.flags.writeable = False
+        _hours_per_month[year] = hours
+    return _hours_per_month[year]
+
+
+def month_columns(metric):
+    """
+    Returns the names of the monthly columns of a metric in WIDE format.
+    """
+    return ['{} Month {}'.format(metric, month) for month in months]
+
+
+class MonthlyMetrics(object):
+    """
+    Set of monthly metrics for a list of records. Records are described by the
+    'index' DataFrame, and the i-th row of each metric array corresponds to
+    the i-th row of the index.
+    """
+
+    def __init__(self, index):
+        self.index = index.reset_index(drop=True)
+        self.metrics = OrderedDict()
+
+    @classmethod
+    def from_frame(cls, df, index_columns, metric_patterns):
+        """
+        Builds the representation from a DataFrame with one column per month
+        and metric. metric_patterns is a list of (metric name, regex) tuples,
+        where each regex must match the 12 monthly columns of the metric
+        (in chronological order).
+        """
+        monthly_metrics = cls(df[index_columns])
+        for metric, pattern in metric_patterns:
+            columns = df.filter(regex=pattern)
+            if columns.shape[1] != len(months):
+                raise ValueError("Found {} columns matching {} for metric {}, "
+                    "instead of {}.".format(columns.shape[1], pattern, metric,
+                    len(months)))
+            monthly_metrics[metric] = columns.values
+        return monthly_metrics
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, metric):
+        return metric in self.metrics
+
+    def __getitem__(self, metric):
+        return self.metrics[metric]
+
+    def __setitem__(self, metric, values):
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        if values.shape != (len(self.index), len(months)):
+            raise ValueError("Metric {} has shape {}, but {} is expected.".format(
+                metric, values.shape, (len(self.index), len(months))))
+        self.metrics[metric] = values
+
+    def column_vector(self, column):
+        """
+        Returns a column of the index as a (records x 1) float array, ready to
+        be broadcast against metrics.
+        """
+        return self.index[column].values.astype(np.float64)[:, np.newaxis]
+
+    def take(self, positions):
+        """
+        Returns a new set with the records in the positions (or boolean mask).
+        """
+        positions = np.arange(len(self.index))[positions]
+        result = MonthlyMetrics(self.index.iloc[positions])
+        for metric, values in self.metrics.items():
+            result.metrics[metric] = values[positions]
+        return result
+
+    def merge(self, right, **kwargs):
+        """
+        Merges the index with another DataFrame (arguments are passed to
+        pd.merge) and reorders metric arrays to match the resulting records.
+        """
+        left = self.index.copy()
+        left['_position'] = np.arange(len(left))
+        merged = pd.merge(left, right, **kwargs)
+        positions = merged.pop('_position').values
+        result = MonthlyMetrics(merged)
+        for metric, values in self.metrics.items():
+            result.metrics[metric] = values[positions]
+        return result
+
+    def aggregate(self, by):
+        """
+        Aggregates records with the same values in the 'by' columns. Metrics
+        are summed and all other columns get their 'max' value. Records are
+        sorted by the 'by' columns, as done by DataFrame.groupby.
+        """
+        keys = [self.index[col] for col in by]
+        index = self.index.groupby(by).agg('max').reset_index()
+        result = MonthlyMetrics(index[list(self.index.columns)])
+        for metric, values in self.metrics.items():
+            result[metric] = pd.DataFrame(values).groupby(keys).sum().values
+        return result
+
+    def group_sum(self, metric, by):
+        """
+        Returns an array with the same shape as the metric, where each record
+        gets the sum of the metric for all records with the same values in
+        the 'by' columns.
+        """
+        return pd.DataFrame(self.metrics[metric]).groupby(
+            [self.index[col] for col in by]).transform('sum').values
+
+    def to_wide(self, columns):
+        """
+        Returns a DataFrame in WIDE format. Columns may be index columns or
+        metrics, which are expanded into their 12 monthly columns.
+        """
+        data = OrderedDict()
+        for column in columns:
+            if column in self.metrics:
+                for month, name in enumerate(month_columns(column)):
+                    data[name] = self.metrics[column][:, month]
+            else:
+                data[column] = self.index[column].values
+        return pd.DataFrame(data, columns=list(data.keys()))
+
+    def to_narrow(self, columns):
+        """
+        Returns a DataFrame in NARROW format, with one row per record and
+        month. Rows are ordered by month first. The 'Month' column may be
+        requested along with index columns and metrics.
+        """
+        n_records = len(self.index)
+        data = OrderedDict()
+        for column in columns:
+            if column == 'Month':
+                data[column] = np.repeat(months, n_records)
+            elif column in self.metrics:
+                data[column] = self.metrics[column].T.ravel()
+            else:
+                data[column] = np.tile(self.index[column].values, len(months))
+        return pd.DataFrame(data, columns=list(data.keys()))
@@ -0,0 +1,217 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Panel of the generators reported in the EIA860 forms of every year, to follow
+each generator across years without merging the yearly generation_projects
+files.
+
+Generators are identified by their EIA Plant Code, Generator Id, Prime Mover
+and Energy Source (as reported, before combined cycles are lumped together and
+units are aggregated). The panel records the years in which each of them
+appears, with its nameplate capacity and status in each year.
+
+The panel is built incrementally: when the EIA860 form of a year is parsed,
+its generators (before filtering by status) are saved to
+generator_panel_YEAR.tab in the outputs directory. Forms of different years
+can be parsed at the same time (see pipeline.py), since each one writes its own
+file. load_panel() merges the yearly files into a GeneratorPanel, which is
+saved to generator_panel.pickle and only rebuilt when a yearly file changes.
+
+The records of the panel are sorted by generator and year, and each generator
+gets an integer id with the offset of its records, so looking up the history of
+a generator (or plant) is a dict lookup and a slice. Range queries compare the
+consecutive records of each generator with vectorized operations:
+
+    from panel import load_panel
+    panel = load_panel()
+    panel.history(55077, 'CTG1', 'CT', 'NG')
+    # Records of the generators whose status changed between 2012 and 2015
+    panel.changes(2012, 2015, 'Status')
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import default_config
+
+panel_name = 'generator_panel.pickle'
+key_columns = ['EIA Plant Code', 'Generator Id', 'Prime Mover', 'Energy Source']
+history_columns = ['Year', 'Nameplate Capacity (MW)', 'Status',
+    'Operational Status']
+_panels = {}
+
+
+def segment_name(year):
+    return 'generator_panel_{}.tab'.format(year)
+
+
+def _generator_id(value):
+    # Some years store numeric generator ids as floats (i.e. 1.0 for '1')
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return unicode(value).strip()
+
+
+def panel_records(generators, year):
+    """
+    Returns the panel records of the generators of an EIA860 form (see
+    scrape.read_eia860_generators). Generators listed twice keep their first
+    record.
+    """
+    generators = generators[generators['Plant Code'].notnull() &
+        generators['Generator Id'].notnull()]
+    records = pd.DataFrame({
+        'EIA Plant Code': generators['Plant Code'].astype(int).values,
+        'Generator Id': [_generator_id(g) for g in generators['Generator Id']],
+        'Prime Mover': generators['Prime Mover'].fillna('').values,
+        'Energy Source': generators['Energy Source'].fillna('').values,
+        'Year': year,
+        'Nameplate Capacity (MW)': pd.to_numeric(
+            generators['Nameplate Capacity (MW)'], errors='coerce').values,
+        'Status': generators['Status'].values,
+        'Operational Status': generators['Operational Status'].values,
+        }, columns=key_columns+history_columns)
+    return records.drop_duplicates(key_columns)
+
+
+def save_year(generators, year, directory=default_config.outputs_directory):
+    """
+    Saves the panel records of the generators of a year to its file, replacing
+    the records of previous parses of that year.
+    """
+    path = os.path.join(directory, segment_name(year))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        panel_records(generators, year).to_csv(f, sep='\t', encoding='utf-8',
+            index=False)
+    os.rename(tmp_path, path)
+
+
+def read_segment(path):
+    # Codes such as 'NA' are kept as strings
+    return pd.read_csv(path, sep='\t', keep_default_na=False,
+        na_values={'Nameplate Capacity (MW)': ['']},
+        dtype={'Generator Id': object, 'Prime Mover': object,
+            'Energy Source': object, 'Status': object,
+            'Operational Status': object})
+
+
+def _same_values(a, b):
+    return (a == b) | (pd.isnull(a) & pd.isnull(b))
+
+
+class GeneratorPanel(object):
+    """
+    Yearly records of every generator, indexed by generator and plant.
+    """
+
+    def __init__(self, records):
+        records = records.sort_values(key_columns + ['Year']).reset_index(drop=True)
+        # First record of each generator
+        same_key = np.ones(max(len(records)-1, 0), dtype=bool)
+        for column in key_columns:
+            values = records[column].values
+            same_key &= _same_values(values[1:], values[:-1])
+        first = np.append([True], ~same_key)[:len(records)]
+        records['Entity'] = np.cumsum(first) - 1
+        self.records = records
+        self.offsets = np.append(np.flatnonzero(first), len(records))
+        self.entities = dict((tuple(key), i) for i, key in enumerate(
+            records.loc[first, key_columns].itertuples(index=False)))
+        plants, starts = np.unique(records['EIA Plant Code'].values,
+            return_index=True)
+        stops = np.append(starts[1:], len(records))
+        self.plants = dict(zip(plants.tolist(), zip(starts, stops)))
+
+    def __len__(self):
+        return len(self.entities)
+
+    def history(self, plant_code, generator_id, prime_mover, energy_source):
+        """
+        Returns the yearly records of a generator (an empty DataFrame if it is
+        not in the panel).
+        """
+        entity = self.entities.get((int(plant_code), _generator_id(generator_id),
+            prime_mover, energy_source))
+        if entity is None:
+            return self.records.iloc[:0][history_columns]
+        return self.records.iloc[
+            self.offsets[entity]:self.offsets[entity+1]][history_columns]
+
+    def years(self, plant_code, generator_id, prime_mover, energy_source):
+        """
+        Returns the years in which a generator appears.
+        """
+        return self.history(plant_code, generator_id, prime_mover,
+            energy_source)['Year'].tolist()
+
+    def plant_history(self, plant_code):
+        """
+        Returns the yearly records of all generators of a plant.
+        """
+        start, stop = self.plants.get(int(plant_code), (0, 0))
+        return self.records.iloc[start:stop][key_columns + history_columns]
+
+    def present(self, year):
+        """
+        Returns the records of the generators that appear in a year.
+        """
+        return self.records.loc[self.records['Year'] == year,
+            key_columns + history_columns]
+
+    def changes(self, start_year, end_year, column='Status'):
+        """
+        Returns the records (between the years) of the generators whose value
+        of the column (e.g. 'Status' or 'Nameplate Capacity (MW)') changed
+        between any two of their records in those years.
+        """
+        records = self.records[(self.records['Year'] >= start_year) &
+            (self.records['Year'] <= end_year)]
+        entities = records['Entity'].values
+        values = records[column].values
+        changed = ((entities[1:] == entities[:-1]) &
+            ~_same_values(values[1:], values[:-1]))
+        records = records[records['Entity'].isin(np.unique(entities[1:][changed]))]
+        return records[key_columns + history_columns]
+
+
+def _segment_sources(directory):
+    """
+    Returns the modification time and size of the yearly files of the panel.
+    """
+    sources = {}
+    for fname in os.listdir(directory):
+        if fname.startswith('generator_panel_') and fname.endswith('.tab'):
+            stat = os.stat(os.path.join(directory, fname))
+            sources[fname] = (stat.st_mtime, stat.st_size)
+    return sources
+
+
+def load_panel(directory=default_config.outputs_directory):
+    """
+    Returns the panel of the generators of the years parsed into the
+    directory. The panel is kept in memory, and saved to generator_panel.pickle,
+    until the yearly files change.
+    """
+    sources = _segment_sources(directory)
+    if directory in _panels and _panels[directory][0] == sources:
+        return _panels[directory][1]
+    path = os.path.join(directory, panel_name)
+    saved_sources, records = (pd.read_pickle(path) if os.path.isfile(path)
+        else (None, None))
+    if saved_sources != sources:
+        print "Building the generator panel from {} yearly files...".format(
+            len(sources))
+        frames = [read_segment(os.path.join(directory, fname))
+            for fname in sorted(sources)]
+        records = (pd.concat(frames, ignore_index=True) if frames else
+            pd.DataFrame(columns=key_columns+history_columns))
+        tmp_path = path + '.tmp'
+        pd.to_pickle((sources, records), tmp_path)
+        os.rename(tmp_path, path)
+    panel = GeneratorPanel(records)
+    _panels[directory] = (sources, panel)
+    return panel
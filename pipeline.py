@@ -0,0 +1,205 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Pipelined execution of the scraping process.
+
+scrape.main() runs each stage for all years before starting the next one (all
+downloads, then all unzips, then all parses), so the network, disk and CPU
+take turns sitting idle. Here, each stage is run by its own workers, which are
+connected by bounded queues:
+
+    download (threads) -> unzip (threads) -> parse (process pool)
+
+A year's archive starts being unzipped and parsed as soon as its download
+finishes. Parsing is CPU-bound, so it is done in a pool of processes. Bounded
+queues and a limit on the number of parses in flight provide backpressure, so
+fast stages never get too far ahead of slow ones.
+
+Restrictions imposed by the data:
+    * The EIA923 form of a year is parsed only after the EIA860 form of that
+      year, since it reads the processed EIA860 generation projects.
+    * EIA923 forms are parsed one at a time and in chronological order,
+      because they append records to the historic output files.
+
+The run configuration (see config.py) is sent to the worker processes with
+each parse, so they do not depend on any settings of the parent process.
+
+"""
+
+import multiprocessing
+import os
+import Queue
+import threading
+import traceback
+
+import scrape
+from utils import unzip
+
+DOWNLOAD_WORKERS = 2
+UNZIP_WORKERS = 2
+PARSE_WORKERS = max(1, multiprocessing.cpu_count() - 1)
+# Maximum number of archives waiting between stages
+QUEUE_SIZE = 2
+# Seconds between checks for failures in other stages while waiting
+POLL_INTERVAL = 0.5
+
+
+class PipelineError(Exception):
+    pass
+
+
+class _Pipeline(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.years = list(config.years)
+        self.download_queue = Queue.Queue()
+        self.unzip_queue = Queue.Queue(maxsize=QUEUE_SIZE)
+        self.parse_queue = Queue.Queue(maxsize=QUEUE_SIZE)
+        self.pool = multiprocessing.Pool(PARSE_WORKERS)
+        self.parse_slots = threading.BoundedSemaphore(PARSE_WORKERS)
+        self.log_lock = threading.Lock()
+        self.failed = threading.Event()
+        self.errors = []
+        self.eia860_results = {}
+        self.eia860_submitted = {year: threading.Event() for year in self.years}
+        self.eia923_directories = {}
+        self.eia923_ready = {year: threading.Event() for year in self.years}
+
+    def _run_safely(self, target, *args):
+        try:
+            target(*args)
+        except PipelineError:
+            self.failed.set()
+        except Exception:
+            self.errors.append(traceback.format_exc())
+            self.failed.set()
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=self._run_safely, args=(target,)+args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _put(self, work_queue, item):
+        while not self.failed.is_set():
+            try:
+                work_queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except Queue.Full:
+                pass
+        raise PipelineError("Aborted because another stage failed.")
+
+    def _get(self, work_queue):
+        while not self.failed.is_set():
+            try:
+                return work_queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                pass
+        raise PipelineError("Aborted because another stage failed.")
+
+    def _wait(self, event):
+        while not event.wait(POLL_INTERVAL):
+            if self.failed.is_set():
+                raise PipelineError("Aborted because another stage failed.")
+
+    def download(self):
+        while True:
+            try:
+                form, year = self.download_queue.get_nowait()
+            except Queue.Empty:
+                return
+            if form == 'eia860':
+                filename, url = scrape.eia860_file(year)
+            else:
+                filename, url = scrape.eia923_file(year)
+            local_path, meta_data = scrape.download_form(filename, url, self.config)
+            if meta_data is not None:
+                with self.log_lock:
+                    scrape.write_download_log([meta_data], self.config)
+            self._put(self.unzip_queue, (form, year, local_path))
+
+    def unzip(self):
+        while True:
+            item = self._get(self.unzip_queue)
+            if item is None:
+                return
+            form, year, local_path = item
+            unzip([local_path])
+            self._put(self.parse_queue, (form, year, os.path.splitext(local_path)[0]))
+
+    def dispatch_parses(self):
+        while True:
+            item = self._get(self.parse_queue)
+            if item is None:
+                return
+            form, year, directory = item
+            if form == 'eia860':
+                while not self.parse_slots.acquire(False):
+                    self._wait_for_slot()
+                self.eia860_results[year] = self.pool.apply_async(
+                    scrape.parse_eia860_data, (directory, self.config),
+                    callback=lambda result: self.parse_slots.release())
+                self.eia860_submitted[year].set()
+            else:
+                self.eia923_directories[year] = directory
+                self.eia923_ready[year].set()
+
+    def _wait_for_slot(self):
+        if self.failed.wait(POLL_INTERVAL):
+            raise PipelineError("Aborted because another stage failed.")
+        # Failed EIA860 parses never release their slot (no error callbacks
+        # in Python 2), so surface their errors here
+        for result in self.eia860_results.values():
+            if result.ready() and not result.successful():
+                result.get()
+
+    def parse_eia923_forms(self):
+        for year in self.years:
+            self._wait(self.eia860_submitted[year])
+            self.eia860_results[year].get()
+            self._wait(self.eia923_ready[year])
+            self.pool.apply(scrape.parse_eia923_data,
+                (self.eia923_directories[year], self.config))
+
+    def run(self):
+        for year in self.years:
+            self.download_queue.put(('eia860', year))
+            self.download_queue.put(('eia923', year))
+        downloaders = [self._start(self.download) for i in range(DOWNLOAD_WORKERS)]
+        unzippers = [self._start(self.unzip) for i in range(UNZIP_WORKERS)]
+        dispatcher = self._start(self.dispatch_parses)
+        eia923_parser = self._start(self.parse_eia923_forms)
+        try:
+            for thread in downloaders:
+                thread.join()
+            for thread in unzippers:
+                self._run_safely(self._put, self.unzip_queue, None)
+            for thread in unzippers:
+                thread.join()
+            self._run_safely(self._put, self.parse_queue, None)
+            dispatcher.join()
+            eia923_parser.join()
+            for year in self.years:
+                if year in self.eia860_results:
+                    self._run_safely(self.eia860_results[year].get)
+        finally:
+            if self.errors:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+        if self.errors:
+            raise PipelineError("The pipeline failed:\n" + "\n".join(self.errors))
+
+
+def run_pipeline(config):
+    """
+    Downloads, unzips and parses the EIA860 and EIA923 forms of the years of
+    the configuration, overlapping the stages of different years. Output files
+    are the same as those produced by scrape.main().
+    """
+    print "Running pipeline for years {}-{} with {} download, {} unzip and {} "\
+        "parse workers.".format(config.start_year, config.end_year,
+        DOWNLOAD_WORKERS, UNZIP_WORKERS, PARSE_WORKERS)
+    _Pipeline(config).run()
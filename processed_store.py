@@ -0,0 +1,149 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Optional embedded database that mirrors the tab files of the processed_data
+directory (generation projects, historic heat rates and hydro capacity
+factors, and the outputs of the finish stage) as typed SQLite tables.
+
+Each tab file is loaded into a table named after the file (without its
+extension) the first time it is queried, and reloaded whenever the file is
+rewritten. Tables are indexed on their Year, plant code and Prime Mover
+columns, so filters passed to read_table() are evaluated by SQLite and only
+the matching records are parsed into pandas.
+
+The tab files remain the outputs used by the Switch workflow. Filtered
+subsets of any table can be exported back to tab files with export_table().
+
+SQLite is used because it ships with Python and needs no server.
+
+"""
+
+import os
+import sqlite3
+import pandas as pd
+
+from config import default_config
+
+store_name = 'processed_data.sqlite'
+indexed_columns = ['Year', 'Plant Code', 'EIA Plant Code', 'Prime Mover']
+# Number of rows parsed from tab files and inserted at a time
+CHUNKSIZE = 100000
+
+
+def table_name(fname):
+    return os.path.splitext(os.path.basename(fname))[0]
+
+
+def connect(directory=default_config.outputs_directory):
+    con = sqlite3.connect(os.path.join(directory, store_name))
+    con.execute("CREATE TABLE IF NOT EXISTS _sources \
+        (name TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+    return con
+
+
+def _quote(column):
+    return '"{}"'.format(column.replace('"', '""'))
+
+
+def _as_list(values):
+    if isinstance(values, (list, tuple, set)):
+        return list(values)
+    return [values]
+
+
+def _python_value(value):
+    # sqlite3 does not accept numpy scalars as parameters
+    return value.item() if hasattr(value, 'item') else value
+
+
+def sync_table(con, fname, directory=default_config.outputs_directory):
+    """
+    Loads a tab file into the table of the same name, unless the table was
+    already loaded from the current version of the file.
+    """
+    name = table_name(fname)
+    stat = os.stat(os.path.join(directory, fname))
+    loaded = con.execute("SELECT mtime, size FROM _sources WHERE name = ?",
+        (name,)).fetchone()
+    if loaded == (stat.st_mtime, stat.st_size):
+        return name
+
+    print "Loading {} into {}...".format(fname, store_name)
+    with con:
+        con.execute("DROP TABLE IF EXISTS {}".format(_quote(name)))
+        columns = []
+        for chunk in pd.read_csv(os.path.join(directory, fname), sep='\t',
+            index_col=None, chunksize=CHUNKSIZE):
+            chunk.to_sql(name, con, if_exists='append', index=False)
+            columns = list(chunk.columns)
+        for column in indexed_columns:
+            if column in columns:
+                con.execute("CREATE INDEX {} ON {} ({})".format(
+                    _quote('{}_{}'.format(name, column)), _quote(name),
+                    _quote(column)))
+        con.execute("INSERT OR REPLACE INTO _sources VALUES (?,?,?)",
+            (name, stat.st_mtime, stat.st_size))
+    return name
+
+
+def build_query(name, where=None, columns=None):
+    """
+    Returns a SELECT statement for the table and its parameters. 'where' maps
+    columns to a value or a list of accepted values, where None stands for
+    null values. Conditions on different columns are combined with AND.
+    """
+    selected = ','.join(_quote(c) for c in columns) if columns else '*'
+    query = "SELECT {} FROM {}".format(selected, _quote(name))
+    clauses, params = [], []
+    for column, values in sorted((where or {}).items()):
+        values = _as_list(values)
+        non_null = [_python_value(v) for v in values if v is not None]
+        conditions = []
+        if non_null:
+            conditions.append("{} IN ({})".format(
+                _quote(column), ','.join('?'*len(non_null))))
+            params.extend(non_null)
+        if len(non_null) < len(values):
+            conditions.append("{} IS NULL".format(_quote(column)))
+        clauses.append('(' + ' OR '.join(conditions) + ')')
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    return query, params
+
+
+def filter_frame(df, where=None):
+    """
+    Applies the same filters as build_query() to a DataFrame.
+    """
+    for column, values in (where or {}).items():
+        values = _as_list(values)
+        mask = df[column].isin([v for v in values if v is not None])
+        if None in values:
+            mask |= df[column].isnull()
+        df = df[mask]
+    return df
+
+
+def read_table(fname, directory=default_config.outputs_directory, where=None,
+    columns=None):
+    """
+    Returns the records of a processed tab file that match the filters (see
+    build_query), read from the embedded database.
+    """
+    con = connect(directory)
+    try:
+        name = sync_table(con, fname, directory)
+        query, params = build_query(name, where, columns)
+        return pd.read_sql_query(query, con, params=params)
+    finally:
+        con.close()
+
+
+def export_table(fname, path, directory=default_config.outputs_directory,
+    where=None):
+    """
+    Writes the records of a table that match the filters to a tab file.
+    """
+    df = read_table(fname, directory, where)
+    df.to_csv(path, sep='\t', encoding='utf-8', index=False)
+    print "Exported {} records from {} to {}".format(len(df), table_name(fname), path)
@@ -0,0 +1,537 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Registry of the named SQL statements run by database_interface.py.
+
+Values are never formatted into the SQL text. Statements use numbered
+parameters ($1, $2, ...), and QuerySession prepares each statement once per
+connection (PREPARE) and then executes it with bound values (EXECUTE), so
+repeated statements are only planned once by the server. Loops over load
+zones or states send all their executions in a few round trips with
+psycopg2's execute_batch.
+
+Sessions run each statement in its own transaction, unless statements are
+grouped with QuerySession.transaction().
+
+Statements that cannot be prepared (DDL, SET, or several statements in the
+same string) are sent as they are, and must not have parameters.
+
+Sessions record the duration and number of rows of each statement they run.
+If profiling is enabled, a report ranking the slowest statements is written
+to the report directory when the session is closed. The EXPLAIN (ANALYZE,
+BUFFERS) plans of the statements can be included as well.
+
+"""
+
+import datetime
+import getpass
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+from utils import register_float_decimals
+from reconcile import insert_rows
+from config import default_config
+
+# Write a report of the slowest statements when each session is closed
+PROFILE_QUERIES = False
+# Capture the plans of profiled statements with EXPLAIN (ANALYZE, BUFFERS).
+# Since EXPLAIN ANALYZE runs the statement, statements that modify data are
+# run through the EXPLAIN instead (so their rows are only shown in the plan),
+# and queries that return rows are run twice. Batches are not explained.
+EXPLAIN_QUERIES = False
+
+# Columns of generation_plant with technology defaults, and columns where NaN
+# values (resulting from the aggregation process) are replaced by Nulls
+technology_default_columns = ['max_age','forced_outage_rate',
+    'scheduled_outage_rate','variable_o_m']
+nan_columns = ['connect_cost_per_mw','hydro_efficiency','min_build_capacity',
+    'unit_size','storage_efficiency','store_to_release_ratio',
+    'min_load_fraction','startup_fuel','startup_om',
+    'ccs_capture_efficiency', 'ccs_energy_load']
+
+statements = {
+    # Reading projects and regions
+    'region_name':
+        "SELECT regionabr FROM ventyx_nerc_reg_region WHERE gid = $1",
+    'region_counties':
+        "SELECT name, state\
+        FROM ventyx_nerc_reg_region regions CROSS JOIN us_counties cts\
+        JOIN (SELECT DISTINCT state, state_fips FROM us_states) sts\
+        ON (sts.state_fips=cts.statefp)\
+        WHERE regions.gid = $1 AND\
+        ST_Area(ST_Intersection(cts.the_geom, regions.the_geom))/\
+        ST_Area(cts.the_geom) >= $2",
+    'existing_and_planned_plants':
+        "SELECT * FROM generation_plant\
+        JOIN generation_plant_existing_and_planned USING (generation_plant_id)\
+        WHERE generation_plant_existing_and_planned_scenario_id = $1",
+    'scenario_plants':
+        "SELECT * FROM generation_plant\
+        JOIN generation_plant_scenario_member USING (generation_plant_id)\
+        WHERE generation_plant_scenario_id = $1",
+
+    # Cleaning up previous uploads of a scenario
+    'relax_plant_constraints':
+        'ALTER TABLE generation_plant ALTER load_zone_id DROP NOT NULL,\
+        ALTER max_age DROP NOT NULL',
+    'restore_plant_constraints':
+        'ALTER TABLE generation_plant ALTER load_zone_id SET NOT NULL,\
+        ALTER max_age SET NOT NULL',
+    'delete_hydro_capacity_factors':
+        "DELETE FROM hydro_historical_monthly_capacity_factors\
+        WHERE hydro_simple_scenario_id = $1",
+    'delete_scenario_members':
+        "DELETE FROM generation_plant_scenario_member\
+        WHERE generation_plant_scenario_id = $1",
+    'delete_plant_costs':
+        "DELETE FROM generation_plant_cost\
+        WHERE generation_plant_cost_scenario_id = $1",
+    'delete_build_years':
+        "DELETE FROM generation_plant_existing_and_planned\
+        WHERE generation_plant_existing_and_planned_scenario_id = $1",
+    # Triggers are disabled because of multiple fkey constraints
+    'delete_plants_without_scenario':
+        "SET session_replication_role = replica;\
+        DELETE FROM generation_plant\
+        WHERE generation_plant_id NOT IN\
+        (SELECT generation_plant_id FROM generation_plant_scenario_member);\
+        SET session_replication_role = DEFAULT;",
+    # Plants left by a push that was interrupted after its insert was committed
+    'delete_unassigned_plants_from':
+        "DELETE FROM generation_plant\
+        WHERE generation_plant_id >= $1 AND generation_plant_id NOT IN\
+        (SELECT generation_plant_id FROM generation_plant_scenario_member)",
+
+    # Processing uploaded plants (ids between $1 and $2)
+    'last_plant_id':
+        "SELECT last_value FROM generation_plant_id_seq",
+    'set_plant_geoms':
+        "UPDATE generation_plant\
+        SET geom = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)\
+        WHERE longitude IS NOT NULL AND latitude IS NOT NULL AND\
+        generation_plant_id BETWEEN $1 AND $2",
+    'assign_zones_by_location':
+        "UPDATE generation_plant SET load_zone_id = z.load_zone_id\
+        FROM load_zone z\
+        WHERE ST_contains(boundary, geom) AND\
+        generation_plant_id BETWEEN $1 AND $2",
+    'assign_zones_by_county':
+        "UPDATE generation_plant g SET load_zone_id = z.load_zone_id\
+        FROM us_counties c\
+        JOIN load_zone z ON ST_contains(z.boundary, ST_centroid(c.the_geom))\
+        WHERE g.load_zone_id IS NULL AND g.state = c.state_name AND g.county = c.name\
+        AND generation_plant_id BETWEEN $1 AND $2",
+    # Only plants less than $3 miles out of the boundary are assigned
+    'assign_zones_by_distance':
+        "UPDATE generation_plant AS g1 SET load_zone_id = lz1.load_zone_id\
+        FROM load_zone lz1\
+        WHERE g1.load_zone_id is NULL AND g1.geom IS NOT NULL\
+        AND g1.generation_plant_id between $1 AND $2\
+        AND ST_Distance(g1.geom::geography,lz1.boundary::geography)/1609 < $3\
+        AND ST_Distance(g1.geom::geography,lz1.boundary::geography)/1609 = \
+        (SELECT min(ST_Distance(g2.geom::geography,lz2.boundary::geography)/1609)\
+        FROM generation_plant g2\
+        CROSS JOIN load_zone lz2\
+        WHERE g2.load_zone_id is NULL AND g2.geom IS NOT NULL\
+        AND g2.generation_plant_id = g1.generation_plant_id)",
+    'count_plants_with_zone':
+        "SELECT count(*) FROM generation_plant WHERE load_zone_id IS NOT NULL AND\
+        generation_plant_id BETWEEN $1 AND $2",
+    'count_plants_without_zone':
+        "SELECT count(*), sum(capacity_limit_mw) FROM generation_plant\
+        WHERE load_zone_id IS NULL AND generation_plant_id BETWEEN $1 AND $2",
+    'delete_plants_without_zone':
+        "DELETE FROM generation_plant\
+        WHERE load_zone_id IS NULL AND generation_plant_id BETWEEN $1 AND $2",
+    'assign_technology_defaults':
+        "UPDATE generation_plant g SET " +
+        ', '.join('{c} = t.{c}'.format(c=c) for c in technology_default_columns) +
+        " FROM generation_plant_technologies t\
+        WHERE g.energy_source = t.energy_source AND\
+        g.gen_tech = t.gen_tech AND generation_plant_id BETWEEN $1 AND $2",
+    'set_max_age_by_name':
+        "UPDATE generation_plant SET max_age = $2 WHERE name = $1",
+    'plant_ids':
+        "SELECT generation_plant_id FROM generation_plant\
+        WHERE generation_plant_id BETWEEN $1 AND $2",
+    'add_plants_to_scenario':
+        "INSERT INTO generation_plant_scenario_member\
+        (SELECT $1, generation_plant_id FROM generation_plant\
+        WHERE generation_plant_id BETWEEN $2 AND $3)",
+
+    # Current data of a scenario, and removal of plants that no longer belong
+    # to any scenario ($1 is an array of plant ids)
+    'scenario_members':
+        "SELECT * FROM generation_plant_scenario_member\
+        WHERE generation_plant_scenario_id = $1",
+    'scenario_build_years':
+        "SELECT * FROM generation_plant_existing_and_planned\
+        WHERE generation_plant_existing_and_planned_scenario_id = $1",
+    'scenario_plant_costs':
+        "SELECT * FROM generation_plant_cost\
+        WHERE generation_plant_cost_scenario_id = $1",
+    'scenario_hydro_capacity_factors':
+        "SELECT * FROM hydro_historical_monthly_capacity_factors\
+        WHERE hydro_simple_scenario_id = $1",
+    'delete_unused_plant_capacity_factors':
+        "DELETE FROM variable_capacity_factors\
+        WHERE generation_plant_id = ANY($1) AND generation_plant_id NOT IN\
+        (SELECT generation_plant_id FROM generation_plant_scenario_member)",
+    'delete_unused_plants':
+        "DELETE FROM generation_plant\
+        WHERE generation_plant_id = ANY($1) AND generation_plant_id NOT IN\
+        (SELECT generation_plant_id FROM generation_plant_scenario_member)",
+
+    # Schema preparation (see schema_prep.py). $1 is the name of a table or index
+    'relation_exists':
+        "SELECT to_regclass($1) IS NOT NULL",
+    'estimated_rows':
+        "SELECT reltuples FROM pg_class WHERE oid = to_regclass($1)",
+    'table_indexes':
+        "SELECT c.relname AS index_name, am.amname AS method,\
+        array_agg(a.attname::text ORDER BY k.n) AS columns\
+        FROM pg_index i\
+        JOIN pg_class c ON c.oid = i.indexrelid\
+        JOIN pg_am am ON am.oid = c.relam\
+        CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)\
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum\
+        WHERE i.indrelid = to_regclass($1)\
+        GROUP BY 1, 2",
+
+    # Variable capacity factors ($1 is the load zone, $2 an array of AMPL
+    # technology ids and $3 the gen_tech of the EIA projects)
+    'insert_zone_capacity_factors':
+        "INSERT INTO variable_capacity_factors\
+        (SELECT generation_plant_id, timepoint_id, timestamp_utc, cap_factor, 1\
+        FROM generation_plant\
+        JOIN(\
+        SELECT area_id, timepoint_id, timestamp_utc, avg(cap_factor) AS cap_factor, 1\
+        FROM temp_ampl__proposed_projects_v3\
+        JOIN temp_variable_capacity_factors_historical USING (project_id)\
+        JOIN temp_load_scenario_historic_timepoints ON (hour=historic_hour)\
+        JOIN raw_timepoint ON (timepoint_id = raw_timepoint_id)\
+        WHERE area_id = $1 AND technology_id = ANY($2)\
+        GROUP BY 1,2,3\
+        ORDER BY 1,2\
+        ) AS factors ON (area_id = load_zone_id)\
+        WHERE gen_tech = $3)",
+    'delete_first_pv_hours':
+        "DELETE FROM variable_capacity_factors cf\
+        USING generation_plant gp\
+        WHERE gp.generation_plant_id = cf.generation_plant_id AND\
+        gen_tech = 'PV' AND load_zone_id = $1 AND\
+        extract(day from timestamp_utc) = 1\
+        AND extract(month from timestamp_utc) = 1\
+        AND extract(hour from timestamp_utc) between 0 and 8",
+    'insert_first_pv_hours':
+        "INSERT INTO variable_capacity_factors\
+        (SELECT generation_plant_id, timepoint_id, timestamp_utc, 0.0, 1\
+        FROM temp_load_scenario_historic_timepoints\
+        JOIN raw_timepoint ON (raw_timepoint_id=timepoint_id)\
+        CROSS JOIN generation_plant\
+        WHERE gen_tech = 'PV'\
+        AND load_zone_id = $1\
+        AND extract(day from timestamp_utc) = 1\
+        AND extract(month from timestamp_utc) = 1\
+        AND extract(hour from timestamp_utc) between 0 and 8)",
+    'shift_pv_capacity_factors':
+        "UPDATE variable_capacity_factors cf\
+        SET capacity_factor = cf2.capacity_factor\
+        FROM variable_capacity_factors cf2 JOIN generation_plant USING (generation_plant_id)\
+        WHERE gen_tech = 'PV' AND\
+        cf.generation_plant_id = cf2.generation_plant_id AND\
+        cf.raw_timepoint_id + $1 = cf2.raw_timepoint_id",
+
+    # Miscellaneous fixes
+    'remove_fuel_cells':
+        "CREATE TABLE switch.fuel_cell_generation_plant_backup (like generation_plant);\
+        INSERT INTO fuel_cell_generation_plants\
+        (SELECT * FROM generation_plant WHERE gen_tech = 'FC');\
+        DELETE FROM generation_plant_scenario_member gpsm USING generation_plant gp\
+        WHERE gp.generation_plant_id = gpsm.generation_plant_id\
+        AND gen_tech = 'FC';\
+        DELETE FROM generation_plant_cost gpc USING generation_plant gp\
+        WHERE gp.generation_plant_id = gpc.generation_plant_id\
+        AND gen_tech = 'FC';\
+        DELETE FROM generation_plant_existing_and_planned gpep USING generation_plant gp\
+        WHERE gp.generation_plant_id = gpep.generation_plant_id\
+        AND gen_tech = 'FC';\
+        DELETE FROM generation_plant WHERE gen_tech = 'FC';",
+    # Assigns the average heat rate of the energy source ($2) in scenario $3
+    # to plants of a technology ($1) using that energy source
+    'assign_average_heat_rate':
+        "UPDATE generation_plant SET full_load_heat_rate =\
+        (SELECT avg(full_load_heat_rate)\
+        FROM generation_plant\
+        JOIN generation_plant_scenario_member USING (generation_plant_id)\
+        WHERE energy_source = $2\
+        AND generation_plant_scenario_id = $3)\
+        WHERE gen_tech = $1 AND energy_source = $2",
+    'replace_nans_with_nulls':
+        "UPDATE generation_plant SET " +
+        ', '.join("{c} = NULLIF({c}, 'NaN')".format(c=c) for c in nan_columns) +
+        " WHERE " + ' OR '.join("{} = 'NaN'".format(c) for c in nan_columns),
+    'zero_null_connect_costs':
+        "UPDATE generation_plant SET connect_cost_per_mw = 0.0\
+        WHERE connect_cost_per_mw IS NULL",
+    'copy_county_states':
+        "UPDATE us_counties uc SET state_name = cs.state\
+        FROM (SELECT DISTINCT c.name, state, statefp, state_fips, c.gid\
+        FROM us_counties c join us_states s ON c.statefp=s.state_fips) cs\
+        WHERE cs.gid = uc.gid",
+    'rename_county_state':
+        "UPDATE us_counties SET state_name = $1 WHERE state_name = $2",
+}
+
+_preparable = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|VALUES|WITH)\b', re.I)
+_returns_rows = re.compile(r'^\s*(SELECT|VALUES)\b', re.I)
+_parameter = re.compile(r'\$(\d+)')
+
+
+def n_parameters(name):
+    return max([int(n) for n in _parameter.findall(statements[name])] or [0])
+
+
+def is_preparable(name):
+    sql = statements[name]
+    return bool(_preparable.match(sql)) and ';' not in sql.strip().rstrip(';')
+
+
+def pyformat(name):
+    """
+    Returns the statement with %s placeholders, for use with plain psycopg2
+    cursors (e.g. named cursors, which cannot run prepared statements).
+    Parameters must appear once each, in order.
+    """
+    sql = statements[name]
+    numbers = [int(n) for n in _parameter.findall(sql)]
+    if numbers != range(1, len(numbers)+1):
+        raise ValueError("Parameters of {} are not used once each in order.".format(name))
+    return _parameter.sub('%s', sql)
+
+
+class QuerySession(object):
+    """
+    Database connection that runs registered statements by name. Statements
+    are prepared the first time they are run in the session. Each execution
+    is committed as it is run (autocommit), and errors are printed, unless
+    it is run in a transaction block. NUMERIC values are read as floats.
+
+    The duration and rows of each execution are recorded in timings. If
+    profile is True (PROFILE_QUERIES by default), a report of the slowest
+    statements is written to report_directory when the session is closed,
+    including their plans if explain is True (EXPLAIN_QUERIES by default).
+    """
+
+    def __init__(self, database='switch_wecc', host='localhost', port=5433,
+        user=None, password=None, quiet=True, profile=None, explain=None,
+        report_directory=default_config.outputs_directory):
+        if user == None:
+            user = getpass.getpass('Enter username for database {}:'.format(database))
+        if password == None:
+            password = getpass.getpass('Enter database password for user {}:'.format(user))
+        import psycopg2
+        try:
+            self.con = psycopg2.connect(database=database, user=user, host=host,
+                port=port, password=password)
+        except:
+            sys.exit("Error connecting to database {} at host {}:{}.".format(database,host,port))
+        self.con.autocommit = True
+        register_float_decimals(self.con)
+        self.quiet = quiet
+        self.prepared = set()
+        self.explain = EXPLAIN_QUERIES if explain is None else explain
+        self.profile = (PROFILE_QUERIES or self.explain) if profile is None else profile
+        self.report_directory = report_directory
+        # Name, duration in seconds, rows and plan of each execution
+        self.timings = []
+        if not quiet:
+            print "Connection to database established..."
+
+    def _statement(self, name):
+        """
+        Prepares the statement if needed, and returns the SQL to execute it
+        with psycopg2 placeholders for its parameters.
+        """
+        if not is_preparable(name):
+            if n_parameters(name):
+                raise ValueError("Statement {} has parameters but cannot be prepared.".format(name))
+            return statements[name]
+        if name not in self.prepared:
+            cur = self.con.cursor()
+            cur.execute("PREPARE {} AS {}".format(name, statements[name]))
+            cur.close()
+            self.prepared.add(name)
+        n = n_parameters(name)
+        if n == 0:
+            return "EXECUTE {}".format(name)
+        return "EXECUTE {} ({})".format(name, ','.join(['%s']*n))
+
+    def execute(self, name, *params):
+        """
+        Runs a registered statement with the parameters. Returns a DataFrame if
+        the statement returns rows, or None otherwise (or if it fails).
+        """
+        cur = self.con.cursor()
+        try:
+            sql = self._statement(name)
+            plan = None
+            if self.explain and is_preparable(name):
+                plan = self._explain(cur, sql, params)
+                if not _returns_rows.match(statements[name]):
+                    # The statement was run by EXPLAIN ANALYZE
+                    self._record(name, plan[1], None, plan[0])
+                    return None
+            start = time.time()
+            cur.execute(sql, params)
+            result = None
+            if cur.description != None:
+                result = pd.DataFrame(cur.fetchall(),
+                    columns=[col[0] for col in cur.description])
+            self._record(name, time.time() - start, cur.rowcount,
+                plan[0] if plan else None)
+            if result is not None:
+                return result
+            if not self.quiet:
+                print 'Successfully executed {} with no results.'.format(name)
+        except Exception, e:
+            if not self.con.autocommit:
+                raise
+            print 'Query {} failed with error: {}'.format(name, e)
+            return None
+        finally:
+            cur.close()
+
+    def execute_batch(self, name, params_list, page_size=100):
+        """
+        Runs a registered statement once for each tuple of parameters, sending
+        up to page_size executions to the server in each round trip.
+        """
+        from psycopg2.extras import execute_batch
+        cur = self.con.cursor()
+        try:
+            start = time.time()
+            execute_batch(cur, self._statement(name), params_list,
+                page_size=page_size)
+            self._record('{} (batch of {})'.format(name, len(params_list)),
+                time.time() - start, None)
+        except Exception, e:
+            if not self.con.autocommit:
+                raise
+            print 'Batch of {} failed with error: {}'.format(name, e)
+        finally:
+            cur.close()
+
+    def scalar(self, name, *params):
+        """
+        Runs a statement that returns a single value, and returns it (as a
+        Python object, so it can be passed as a parameter to other statements).
+        Raises RuntimeError if the statement failed.
+        """
+        result = self.execute(name, *params)
+        if result is None:
+            raise RuntimeError("Statement {} did not return a value".format(name))
+        value = result.iloc[0,0]
+        return value.item() if hasattr(value, 'item') else value
+
+    def insert(self, cur, table, df):
+        """
+        Inserts the rows of a DataFrame into a table (see reconcile.insert_rows)
+        with the cursor of a transaction, recording its duration.
+        """
+        with self.timed('insert into {}'.format(table), len(df)):
+            insert_rows(cur, table, df)
+
+    def _explain(self, cur, sql, params):
+        """
+        Runs the statement with EXPLAIN (ANALYZE, BUFFERS), and returns its
+        plan and duration.
+        """
+        start = time.time()
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, params)
+        plan = '\n'.join(row[0] for row in cur.fetchall())
+        return plan, time.time() - start
+
+    def _record(self, name, seconds, rows, plan=None):
+        if rows is not None and rows < 0:
+            rows = None
+        self.timings.append((name, seconds, rows, plan))
+
+    @contextmanager
+    def timed(self, name, rows=None):
+        """
+        Records the duration of the operations run in the block (e.g. bulk
+        inserts or reads through other connections) under the given name.
+        """
+        start = time.time()
+        yield
+        self._record(name, time.time() - start, rows)
+
+    def report(self, top=10, directory=None):
+        """
+        Prints the statements with the longest total durations, and writes the
+        durations of all statements (and the plans of their slowest
+        executions, if captured) to a report file. Returns its path.
+        """
+        if not self.timings:
+            return None
+        timings = pd.DataFrame(self.timings,
+            columns=['statement','seconds','rows','plan'])
+        timings['rows'] = timings['rows'].astype(float)
+        gb = timings.groupby('statement')
+        rows = gb['rows'].sum()
+        rows[gb['rows'].count() == 0] = float('nan')
+        summary = pd.DataFrame({
+            'executions': gb.size(),
+            'total_s': gb['seconds'].sum(),
+            'max_s': gb['seconds'].max(),
+            'rows': rows.map(lambda n: '-' if pd.isnull(n) else '{:.0f}'.format(n))
+            })[['executions','total_s','max_s','rows']]
+        summary = summary.sort_values('total_s', ascending=False)
+        summary['share'] = (summary['total_s'] / summary['total_s'].sum()).map(
+            '{:.1%}'.format)
+
+        directory = directory or self.report_directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'query_report_{}.txt'.format(
+            datetime.datetime.now().strftime('%Y%m%d_%H%M%S')))
+        with open(path, 'w') as f:
+            f.write('Statements ranked by total duration:\n\n')
+            f.write(summary.to_string(float_format='{:.3f}'.format) + '\n')
+            for name in summary.index:
+                executions = timings[timings['statement'] == name]
+                slowest = executions.loc[executions['seconds'].idxmax()]
+                if slowest['plan'] is not None:
+                    f.write('\n\n{} (slowest execution, {:.3f} s):\n\n{}\n'.format(
+                        name, slowest['seconds'], slowest['plan']))
+        print "\nSlowest statements (full report in {}):".format(path)
+        print summary.head(top).to_string(float_format='{:.3f}'.format)
+        return path
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all statements of the block in a single transaction, which is
+        committed at the end of the block or rolled back if an error is raised.
+        """
+        self.con.autocommit = False
+        try:
+            yield self.con.cursor()
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+        finally:
+            self.con.autocommit = True
+
+    def close(self):
+        if self.profile:
+            self.report()
+        self.con.close()
+        if not self.quiet:
+            print 'Database connection closed.'
@@ -0,0 +1,137 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Diff-based synchronization of database tables with DataFrames.
+
+The rows currently stored in a table are compared with the desired rows by a
+natural key, and only the differences are written: new keys are inserted,
+keys with different values are updated and missing keys are deleted. Used by
+database_interface.upload_generation_projects() to update the EIA scenarios
+without deleting and reloading all of their data.
+
+Table and column names are taken from the code and quoted as identifiers;
+all values are bound by psycopg2.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+# Maximum number of rows sent to the server in each round trip
+PAGE_SIZE = 500
+
+
+def _values_differ(current, desired):
+    """
+    Compares two aligned Series, considering nulls equal to each other and
+    numbers equal within floating point precision.
+    """
+    current_null = current.isnull().values
+    desired_null = desired.isnull().values
+    differ = current_null != desired_null
+    both = ~current_null & ~desired_null
+    try:
+        close = np.isclose(current.values[both].astype(np.float64),
+            desired.values[both].astype(np.float64), rtol=1e-9, atol=0)
+    except (TypeError, ValueError):
+        close = current.values[both] == desired.values[both]
+    differ[both] = ~close
+    return differ
+
+
+def diff_frames(current, desired, key_columns, value_columns=[], id_column=None):
+    """
+    Compares the current rows of a table with the desired ones by the key
+    columns. Returns three DataFrames:
+        inserted: desired rows with keys not currently stored
+        updated: desired rows whose value columns differ from the stored ones
+        deleted: stored rows whose keys are not desired
+    Keys stored more than once are deleted and inserted again. The id column
+    of the current rows (e.g. a serial primary key) is carried over to the
+    updated and deleted rows.
+    """
+    carried = [id_column] if id_column else []
+    desired = desired.drop_duplicates(key_columns)
+    is_duplicated = current.duplicated(key_columns, keep=False).values
+    duplicated = current[is_duplicated]
+    current = current[~is_duplicated]
+    merged = pd.merge(current[key_columns + value_columns + carried],
+        desired[key_columns + value_columns], on=key_columns, how='outer',
+        suffixes=('_current', ''), indicator=True)
+
+    inserted = merged.loc[merged['_merge'] == 'right_only', key_columns + value_columns]
+    deleted = pd.concat([merged.loc[merged['_merge'] == 'left_only', key_columns + carried],
+        duplicated[key_columns + carried]], axis=0)
+    both = merged[merged['_merge'] == 'both']
+    changed = np.zeros(len(both), dtype=bool)
+    for col in value_columns:
+        changed |= _values_differ(both[col + '_current'], both[col])
+    updated = both.loc[changed, key_columns + value_columns + carried]
+    return (inserted.reset_index(drop=True), updated.reset_index(drop=True),
+        deleted.reset_index(drop=True))
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _rows(df, columns):
+    """
+    Returns the rows of the columns as lists of Python objects (nulls as
+    None), which is what psycopg2 can adapt.
+    """
+    values = df[columns].astype(object)
+    return values.where(df[columns].notnull(), None).values.tolist()
+
+
+def insert_rows(cur, table, df):
+    if len(df) == 0:
+        return 0
+    from psycopg2.extras import execute_values
+    columns = list(df.columns)
+    execute_values(cur, "INSERT INTO {} ({}) VALUES %s".format(_quote(table),
+        ','.join(_quote(c) for c in columns)), _rows(df, columns),
+        page_size=PAGE_SIZE)
+    return len(df)
+
+
+def _key_condition(key_columns):
+    # Compared with '=' so the index of the key can be used (keys are ids,
+    # years and months, which are never null)
+    return ' AND '.join('{} = %s'.format(_quote(c)) for c in key_columns)
+
+
+def update_rows(cur, table, df, key_columns, value_columns):
+    if len(df) == 0 or not value_columns:
+        return 0
+    from psycopg2.extras import execute_batch
+    query = "UPDATE {} SET {} WHERE {}".format(_quote(table),
+        ', '.join('{} = %s'.format(_quote(c)) for c in value_columns),
+        _key_condition(key_columns))
+    execute_batch(cur, query, _rows(df, value_columns + key_columns),
+        page_size=PAGE_SIZE)
+    return len(df)
+
+
+def delete_rows(cur, table, df, key_columns):
+    if len(df) == 0:
+        return 0
+    from psycopg2.extras import execute_batch
+    df = df.drop_duplicates(key_columns)
+    query = "DELETE FROM {} WHERE {}".format(_quote(table),
+        _key_condition(key_columns))
+    execute_batch(cur, query, _rows(df, key_columns), page_size=PAGE_SIZE)
+    return len(df)
+
+
+def sync_table(cur, table, current, desired, key_columns, value_columns=[]):
+    """
+    Writes the differences between the current and desired rows of a table
+    (see diff_frames). Returns the number of inserted, updated and deleted
+    rows. Deletions run first, so duplicated keys can be inserted again.
+    """
+    inserted, updated, deleted = diff_frames(current, desired, key_columns,
+        value_columns)
+    n_deleted = delete_rows(cur, table, deleted, key_columns)
+    n_updated = update_rows(cur, table, updated, key_columns, value_columns)
+    return insert_rows(cur, table, inserted), n_updated, n_deleted
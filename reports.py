@@ -0,0 +1,167 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Optional reporting stage of the processing steps (plots of processed data).
+
+Plots are rendered outside of the data pipeline. The data of each plot is
+saved to a tab file next to the PDF, and the PDF is rendered from that file
+either in a background process, inline, or on demand (run this file directly
+or use 'python eia_scrape.py plots'). A marker file stores the sha1 hash of
+the data used for the current PDF, so unchanged inputs reuse the previous
+plot instead of rendering it again. Data, PDF and marker files are written to
+temporary files and renamed into place. A new plot of a directory waits for
+the background renderer of the previous one, so renderers of consecutive
+years never overlap, and the process waits for its renderers before exiting.
+
+Plots are drawn directly with matplotlib (Agg backend), which is much faster
+to import and render than ggplot.
+
+"""
+
+import atexit
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+from config import default_config
+
+heat_rate_plot_name = 'heat_rate_distributions'
+# Background renderer of each plot data file
+_renderers = {}
+
+
+def _plot_paths(directory, name):
+    """
+    Returns the paths of the data, PDF and hash marker files of a plot.
+    """
+    base = os.path.join(directory, name)
+    return base + '_data.tab', base + '.pdf', base + '.sha1'
+
+
+def _temporary_path(path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+        prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+
+def _write_file(path, contents):
+    """
+    Replaces a file with the contents once they are completely written.
+    """
+    tmp_path = _temporary_path(path)
+    with open(tmp_path, 'w') as f:
+        f.write(contents)
+    os.rename(tmp_path, path)
+
+
+def wait_for_renderers():
+    """
+    Waits for the plots being rendered in the background.
+    """
+    while _renderers:
+        _renderers.popitem()[1].wait()
+
+atexit.register(wait_for_renderers)
+
+
+def _plot_is_current(pdf_path, marker_path, digest):
+    if not (os.path.isfile(pdf_path) and os.path.isfile(marker_path)):
+        return False
+    with open(marker_path) as f:
+        return f.read().strip() == digest
+
+
+def request_heat_rate_plot(thermal_gens,
+    directory=default_config.outputs_directory, mode='background'):
+    """
+    Saves the data for the histograms of heat rates per technology and fuel,
+    and renders them according to the mode:
+        'background': in a separate process (returns the Popen object), once
+            the previous background renderer of the directory finished
+        'inline': before returning
+        'deferred': only saves the data, so the plot is rendered on demand
+    Nothing is rendered if the PDF was already drawn from the same data.
+    """
+    data = thermal_gens[['Technology','Best Heat Rate']].sort_values(
+        ['Technology','Best Heat Rate'])
+    contents = data.to_csv(sep='\t', index=False)
+    digest = hashlib.sha1(contents).hexdigest()
+    data_path, pdf_path, marker_path = _plot_paths(directory, heat_rate_plot_name)
+    # The previous renderer may still be reading the data or writing the PDF
+    previous = _renderers.pop(os.path.abspath(data_path), None)
+    if previous is not None:
+        previous.wait()
+    if _plot_is_current(pdf_path, marker_path, digest):
+        print "Heat rate distributions are up to date in {}".format(pdf_path)
+        return None
+    _write_file(data_path, contents)
+    if mode == 'background':
+        print "Rendering heat rate distributions in the background..."
+        renderer = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+            directory])
+        _renderers[os.path.abspath(data_path)] = renderer
+        return renderer
+    elif mode == 'inline':
+        render_heat_rate_plot(directory)
+    return None
+
+
+def render_heat_rate_plot(directory=default_config.outputs_directory,
+    bin_width=0.5, max_count=30):
+    """
+    Renders histograms of heat rates for each technology from the data saved
+    by request_heat_rate_plot(), unless the PDF is already up to date.
+    """
+    data_path, pdf_path, marker_path = _plot_paths(directory, heat_rate_plot_name)
+    if not os.path.isfile(data_path):
+        print "No heat rate data to plot in {}".format(directory)
+        return
+    with open(data_path) as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if _plot_is_current(pdf_path, marker_path, digest):
+        return
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    data = pd.read_csv(data_path, sep='\t')
+    data = data[data['Best Heat Rate'].notnull()]
+    technologies = sorted(data['Technology'].unique())
+    n_cols = max(1, int(np.ceil(np.sqrt(len(technologies)))))
+    n_rows = max(1, int(np.ceil(len(technologies)/float(n_cols))))
+    bins = np.arange(np.floor(data['Best Heat Rate'].min()),
+        data['Best Heat Rate'].max()+bin_width, bin_width) if len(data) else 1
+    fig, axes = plt.subplots(n_rows, n_cols, sharex=True, sharey=True,
+        squeeze=False, figsize=(2.5*n_cols, 2*n_rows))
+    for ax, technology in zip(axes.flat, technologies):
+        ax.hist(data.loc[data['Technology']==technology, 'Best Heat Rate'].values,
+            bins=bins)
+        ax.set_title(technology, fontsize=8)
+        ax.set_ylim(0, max_count)
+        ax.tick_params(labelsize=6)
+    for ax in axes.flat[len(technologies):]:
+        ax.axis('off')
+    fig.text(0.5, 0.01, 'Best Heat Rate (MMBTU/MWh)', ha='center', fontsize=8)
+    fig.tight_layout(rect=(0, 0.03, 1, 1))
+
+    # Replace the previous PDF only when the new one is complete
+    tmp_path = _temporary_path(pdf_path)
+    fig.savefig(tmp_path, format='pdf')
+    plt.close(fig)
+    os.rename(tmp_path, pdf_path)
+    _write_file(marker_path, digest)
+    print "Saved heat rate distributions to {}".format(pdf_path)
+
+
+def render_pending_plots(directory=default_config.outputs_directory):
+    render_heat_rate_plot(directory)
+
+
+if __name__ == "__main__":
+    render_pending_plots(*sys.argv[1:2])
@@ -0,0 +1,244 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Preparation of the Switch-WECC schema for the heavy writes of the upload,
+variable capacity factor and cleanup steps.
+
+ensure_indexes() creates the indexes that the statements in queries.py rely
+on (plant id and timepoint lookups in variable_capacity_factors, filters by
+technology and energy source, scenario ids, etc.), unless an existing index
+already covers their columns. Indexes created here are named with a common
+prefix, so revert() drops them (and any leftover staging table) without
+touching the other indexes of the database.
+
+Large loads can be written to UNLOGGED staging tables without indexes, which
+are much faster to fill. The indexes needed by the statements that run on
+the staged rows are built after the bulk load, and the rows are then moved to
+the target table. If they are a large fraction of the table, its indexes are
+dropped during the move and rebuilt afterwards.
+
+Every action is reported with its duration. Run 'python eia_scrape.py
+prep-schema' (or with --revert) to prepare or revert the schema.
+
+"""
+
+import getpass
+import re
+import time
+from collections import OrderedDict
+
+from queries import QuerySession, statements
+
+index_prefix = 'eia_scrape_'
+# Indexes needed by the registered statements: name, table, columns, method
+required_indexes = OrderedDict([
+    ('vcf_plant_timepoint', ('variable_capacity_factors',
+        ['generation_plant_id','raw_timepoint_id'], 'btree')),
+    ('plant_tech_source', ('generation_plant', ['energy_source','gen_tech'], 'btree')),
+    ('plant_zone_tech', ('generation_plant', ['load_zone_id','gen_tech'], 'btree')),
+    ('plant_eia_code', ('generation_plant',
+        ['eia_plant_code','gen_tech','energy_source'], 'btree')),
+    ('plant_name', ('generation_plant', ['name'], 'btree')),
+    ('member_plant', ('generation_plant_scenario_member', ['generation_plant_id'], 'btree')),
+    ('build_years_scenario', ('generation_plant_existing_and_planned',
+        ['generation_plant_existing_and_planned_scenario_id'], 'btree')),
+    ('costs_scenario', ('generation_plant_cost',
+        ['generation_plant_cost_scenario_id'], 'btree')),
+    ('hydro_scenario', ('hydro_historical_monthly_capacity_factors',
+        ['hydro_simple_scenario_id'], 'btree')),
+    ('load_zone_boundary', ('load_zone', ['boundary'], 'gist')),
+    ('ampl_cf_project', ('temp_variable_capacity_factors_historical',
+        ['project_id'], 'btree')),
+    ('ampl_timepoint_hour', ('temp_load_scenario_historic_timepoints',
+        ['historic_hour'], 'btree')),
+    ])
+# Tables that can be loaded through staging tables
+staged_tables = ['variable_capacity_factors']
+# Indexes of the target table are rebuilt after moving the staged rows if
+# these are more than this fraction of the rows of the table
+REBUILD_INDEX_FRACTION = 0.2
+
+
+def staging_name(table):
+    return table + '_staging'
+
+
+# Register the DDL of the indexes and staging tables
+for name, (table, columns, method) in required_indexes.items():
+    statements['create_index__' + name] = "CREATE INDEX {} ON {} USING {} ({})".format(
+        index_prefix + name, table, method, ', '.join(columns))
+    statements['drop_index__' + name] = "DROP INDEX IF EXISTS {}".format(
+        index_prefix + name)
+for table in staged_tables:
+    statements['create_staging__' + table] = ("DROP TABLE IF EXISTS {s};"
+        "CREATE UNLOGGED TABLE {s} (LIKE {t} INCLUDING DEFAULTS)").format(
+        s=staging_name(table), t=table)
+    statements['analyze_staging__' + table] = "ANALYZE {}".format(staging_name(table))
+    statements['count_staging__' + table] = "SELECT count(*) FROM {}".format(
+        staging_name(table))
+    statements['merge_staging__' + table] = "INSERT INTO {} SELECT * FROM {}".format(
+        table, staging_name(table))
+    statements['drop_staging__' + table] = "DROP TABLE IF EXISTS {}".format(
+        staging_name(table))
+    statements['analyze__' + table] = "ANALYZE {}".format(table)
+    for name, (index_table, columns, method) in required_indexes.items():
+        if index_table == table:
+            statements['create_staging_index__' + name] = "CREATE INDEX ON {} USING {} ({})".format(
+                staging_name(table), method, ', '.join(columns))
+
+
+def staged(name, table):
+    """
+    Registers a copy of a statement that reads and writes the staging table
+    instead of the table, and returns the name of the copy.
+    """
+    staged_name = name + '__staged'
+    if staged_name not in statements:
+        statements[staged_name] = re.sub(r'\b{}\b'.format(table),
+            staging_name(table), statements[name])
+    return staged_name
+
+
+def _covering_index(db, name):
+    """
+    Returns the name of an existing index of the table that covers the
+    columns of a required index (as its leading columns), or None.
+    """
+    table, columns, method = required_indexes[name]
+    for row in db.execute('table_indexes', table).itertuples():
+        if row.method == method and list(row.columns[:len(columns)]) == columns:
+            return row.index_name
+    return None
+
+
+def _run(db, statement, description):
+    """
+    Runs a DDL statement in a transaction and reports its duration. Returns
+    False if it failed.
+    """
+    start = time.time()
+    try:
+        with db.transaction():
+            db.execute(statement)
+    except Exception, e:
+        print "--{}: failed with error: {}".format(description, e)
+        return False
+    print "--{} ({:.1f} s)".format(description, time.time() - start)
+    return True
+
+
+def ensure_indexes(db, names=None):
+    """
+    Creates the required indexes (all, or the listed names) that are not
+    covered by existing ones. Returns the names of the created indexes.
+    """
+    print "\nChecking indexes needed by the upload statements..."
+    created = []
+    for name in (required_indexes if names is None else names):
+        table, columns, method = required_indexes[name]
+        if not db.scalar('relation_exists', table):
+            print "--Skipped {}: table {} does not exist".format(name, table)
+            continue
+        covering = _covering_index(db, name)
+        if covering is not None:
+            print "--{} ({}) is covered by index {}".format(table,
+                ', '.join(columns), covering)
+        elif _run(db, 'create_index__' + name, "Created index {}{} on {} ({})".format(
+            index_prefix, name, table, ', '.join(columns))):
+            created.append(name)
+    return created
+
+
+def drop_indexes(db, names=None):
+    """
+    Drops the indexes created by ensure_indexes (all, or the listed names).
+    Returns the names of the dropped indexes.
+    """
+    dropped = []
+    for name in (required_indexes if names is None else names):
+        if db.scalar('relation_exists', index_prefix + name):
+            if _run(db, 'drop_index__' + name, "Dropped index {}{}".format(
+                index_prefix, name)):
+                dropped.append(name)
+    return dropped
+
+
+def create_staging_table(db, table):
+    """
+    Creates an empty UNLOGGED staging table with the columns of the table and
+    no indexes.
+    """
+    print "\nLoading {} through staging table {}".format(table, staging_name(table))
+    if not _run(db, 'create_staging__' + table, "Created unlogged table {}".format(
+        staging_name(table))):
+        raise RuntimeError("Could not create staging table for {}".format(table))
+
+
+def index_staging_table(db, table):
+    """
+    Builds the required indexes of the table on its staging table (once the
+    bulk load is done) and updates its statistics.
+    """
+    for name, (index_table, columns, method) in required_indexes.items():
+        if index_table == table:
+            _run(db, 'create_staging_index__' + name, "Indexed {} ({})".format(
+                staging_name(table), ', '.join(columns)))
+    _run(db, 'analyze_staging__' + table, "Analyzed {}".format(staging_name(table)))
+
+
+def merge_staging_table(db, table):
+    """
+    Moves the staged rows into the table and drops the staging table. The
+    indexes created by ensure_indexes on the table are dropped during the
+    move and rebuilt afterwards if the staged rows are a large fraction of
+    the table. If the move fails, the indexes are rebuilt, the staging table
+    is kept and RuntimeError is raised.
+    """
+    n_staged = db.scalar('count_staging__' + table)
+    # Tables that were never analyzed have no estimate (-1)
+    n_rows = max(db.scalar('estimated_rows', table), 0)
+    rebuilt = []
+    if n_staged > REBUILD_INDEX_FRACTION * n_rows:
+        rebuilt = drop_indexes(db, [name for name, index in required_indexes.items()
+            if index[0] == table])
+    merged = _run(db, 'merge_staging__' + table, "Moved {} rows from {} to {}".format(
+        n_staged, staging_name(table), table))
+    if merged:
+        _run(db, 'drop_staging__' + table, "Dropped {}".format(staging_name(table)))
+    if rebuilt:
+        ensure_indexes(db, rebuilt)
+    if not merged:
+        # The staged rows are kept, so the merge can be retried or inspected
+        raise RuntimeError("Could not move the staged rows to {}. They were "
+            "kept in {}".format(table, staging_name(table)))
+    _run(db, 'analyze__' + table, "Analyzed {}".format(table))
+
+
+def revert(db):
+    """
+    Drops all indexes created by ensure_indexes and any leftover staging
+    tables.
+    """
+    print "\nReverting schema preparation..."
+    dropped = drop_indexes(db)
+    for table in staged_tables:
+        if db.scalar('relation_exists', staging_name(table)):
+            _run(db, 'drop_staging__' + table, "Dropped {}".format(staging_name(table)))
+    print "Dropped {} indexes.".format(len(dropped))
+
+
+def prepare_schema(revert_changes=False):
+    """
+    Creates the indexes needed by the upload statements, or reverts the
+    preparation, and reports the changes.
+    """
+    user = getpass.getpass('Enter username for the database:')
+    password = getpass.getpass('Enter database password for user {}:'.format(user))
+    db = QuerySession(database='switch_wecc', user=user, password=password)
+    if revert_changes:
+        revert(db)
+    else:
+        created = ensure_indexes(db)
+        print "Created {} indexes. Run 'prep-schema --revert' to drop them.".format(
+            len(created))
+    db.close()
@@ -20,39 +20,30 @@ but first check that uprating is not significant for hydro plants.
 
 """
 
-import csv, os, re
+import csv, glob, os, re
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from calendar import monthrange
-
-from utils import download_file, download_metadata_fields, unzip, append_historic_output_to_csv
-
-unzip_directory = 'downloads'
-pickle_directory = 'pickle_data'
-other_data_directory = 'other_data'
-outputs_directory = 'processed_data'
-download_log_path = os.path.join(unzip_directory, 'download_log.csv')
-REUSE_PRIOR_DOWNLOADS = True
-CLEAR_PRIOR_OUTPUTS = True
-REWRITE_PICKLES = False
-AGGREGATE_COAL = True
-start_year, end_year = 2010, 2015
+
+from utils import download_file, download_metadata_fields, unzip, append_historic_output_to_csv, iter_excel_chunks
+from heat_rate_stats import kth_best_heat_rate
+from month_matrix import MonthlyMetrics, hours_per_month
+from layouts import workbook_layout, read_sheets, revision_sha1
+from codes import code_table, coal_codes
+import panel
+from config import default_config
+
+# Settings of the runs (years, directories, filtering and aggregation
+# criteria...) are passed to each stage in a RunConfig (see config.py)
 fuel_prime_movers = ['ST','GT','IC','CA','CT','CS','CC']
 wecc_states = ['WA','OR','CA','AZ','NV','NM','UT','ID','MT','WY','CO','TX']
-accepted_status_codes = ['OP','SB','CO','SC','OA','OZ','TS','L','T','U','V']
-coal_codes = ['ANT','BIT','LIG','SGC','SUB','WC','RC']
+# Gas and steam turbines of combined cycle plants are treated indistinctly
+combined_cycle_prime_movers = {'CA':'CC', 'CT':'CC', 'CS':'CC'}
 gen_relevant_data = ['Plant Code', 'Plant Name', 'Status', 'Nameplate Capacity (MW)',
                     'Prime Mover', 'Energy Source', 'Energy Source 2',
                     'Energy Source 3', 'County', 'State', 'Nerc Region',
                     'Operating Year', 'Planned Retirement Year',
                     'Generator Id', 'Unit Code', 'Operational Status']
 gen_data_to_be_summed = ['Nameplate Capacity (MW)']
-gen_aggregation_lists = [
-                            ['Plant Code','Unit Code'],
-                            ['Plant Code', 'Prime Mover', 'Energy Source',
-                            'Operating Year']
-                        ]
 gen_relevant_data_for_last_year = ['Time From Cold Shutdown To Full Load',
                         'Latitude','Longitude','Balancing Authority Name',
                         'Grid Voltage (kV)', 'Carbon Capture Technology', 'Cogen']
@@ -90,102 +81,170 @@ def uniformize_names(df):
     return df
 
 
-def main():
-    for directory in (unzip_directory, other_data_directory, outputs_directory, pickle_directory):
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+def main(config=default_config):
+    prepare_directories(config)
 
-    if CLEAR_PRIOR_OUTPUTS:
-        for f in os.listdir(outputs_directory):
-            os.remove(os.path.join(outputs_directory,f))
+    if config.run_as_pipeline:
+        from pipeline import run_pipeline
+        run_pipeline(config)
+        return
 
-    zip_file_list = scrape_eia860()
+    zip_file_list = scrape_eia860(config)
     unzip(zip_file_list)
     eia860_directory_list = [os.path.splitext(f)[0] for f in zip_file_list]
     for eia860_annual_filing in eia860_directory_list:
-        parse_eia860_data(eia860_annual_filing)
+        parse_eia860_data(eia860_annual_filing, config)
 
-    zip_file_list = scrape_eia923()
+    zip_file_list = scrape_eia923(config)
     unzip(zip_file_list)
     eia923_directory_list = [os.path.splitext(f)[0] for f in zip_file_list]
     for eia923_annual_filing in eia923_directory_list:
-        parse_eia923_data(eia923_annual_filing)
+        parse_eia923_data(eia923_annual_filing, config)
 
 
-def scrape_eia860():
+def parse_forms(config=default_config):
+    """
+    Unzips (if necessary) and parses the previously downloaded EIA860 and
+    EIA923 forms of the years of the configuration, without checking for new
+    downloads.
     """
-    Downloads EIA860 forms for each year between start_year and end_year.
+    prepare_directories(config)
+    for annual_filing in unzip_downloaded_forms(eia860_file, config.years, config):
+        parse_eia860_data(annual_filing, config)
+    for annual_filing in unzip_downloaded_forms(eia923_file, config.years, config):
+        parse_eia923_data(annual_filing, config)
 
+
+def unzip_downloaded_forms(form_file, years, config=default_config):
+    """
+    Unzips (if necessary) the previously downloaded forms of the years, and
+    returns the directories they were extracted to. form_file is eia860_file
+    or eia923_file.
     """
+    zip_file_list = [os.path.join(config.unzip_directory, form_file(year)[0])
+        for year in years]
+    missing = [f for f in zip_file_list if not os.path.isfile(f)]
+    if missing:
+        raise IOError("Missing downloads: {}".format(', '.join(missing)))
+    unzip(zip_file_list)
+    return [os.path.splitext(f)[0] for f in zip_file_list]
+
 
-    if not os.path.exists(unzip_directory):
-        os.makedirs(unzip_directory)
+def prepare_directories(config=default_config):
+    for directory in (config.unzip_directory, config.other_data_directory,
+        config.outputs_directory, config.pickle_directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    if config.clear_prior_outputs:
+        for f in os.listdir(config.outputs_directory):
+            os.remove(os.path.join(config.outputs_directory,f))
+
+
+def scrape_eia860(config=default_config):
+    """
+    Downloads EIA860 forms for each year between the start and end years of the
+    configuration.
+
+    """
+
+    if not os.path.exists(config.unzip_directory):
+        os.makedirs(config.unzip_directory)
     log_dat = []
-    file_list = ['eia860{}.zip'.format(year) for year in range(start_year, end_year+1)]
-    for filename in file_list:
-        local_path = os.path.join(unzip_directory, filename)
-        if REUSE_PRIOR_DOWNLOADS and os.path.isfile(local_path):
-            print "Skipping " + filename + " because it was already downloaded."
-            continue
-        print "Downloading " + local_path
-        url = 'http://www.eia.gov/electricity/data/eia860/xls/' + filename
-        meta_data = download_file(url, local_path)
-        log_dat.append(meta_data)
+    file_list = []
+    for year in config.years:
+        local_path, meta_data = download_form(*eia860_file(year), config=config)
+        file_list.append(local_path)
+        if meta_data is not None:
+            log_dat.append(meta_data)
+    write_download_log(log_dat, config)
 
-    # Only write the log file header if we are starting a new log
-    write_log_header = not os.path.isfile(download_log_path)
-    with open(download_log_path, 'ab') as logfile:
-        logwriter = csv.writer(logfile, delimiter='\t',
-                               quotechar="'", quoting=csv.QUOTE_MINIMAL)
-        if write_log_header:
-            logwriter.writerow(download_metadata_fields)
-        logwriter.writerows(log_dat)
-    
-    return [os.path.join(unzip_directory, f) for f in file_list]
+    return file_list
 
 
-def scrape_eia923():
+def scrape_eia923(config=default_config):
     """
-    Downloads EIA923 forms for each year between start_year and end_year.
+    Downloads EIA923 forms for each year between the start and end years of the
+    configuration.
 
     """
 
-    if not os.path.exists(unzip_directory):
-        os.makedirs(unzip_directory)
+    if not os.path.exists(config.unzip_directory):
+        os.makedirs(config.unzip_directory)
     log_dat = []
-    file_list = ['f923_{}.zip'.format(year) if year >= 2008
-                    else 'f906920_{}.zip'.format(year)
-                        for year in range(start_year, end_year+1)]
-    for filename in file_list:
-        local_path = os.path.join(unzip_directory, filename)
-        if REUSE_PRIOR_DOWNLOADS and os.path.isfile(local_path):
-            print "Skipping " + filename + " because it was already downloaded."
-            continue
-        print "Downloading " + local_path
-        url = 'https://www.eia.gov/electricity/data/eia923/xls/' + filename
-        meta_data = download_file(url, local_path)
-        log_dat.append(meta_data)
+    file_list = []
+    for year in config.years:
+        local_path, meta_data = download_form(*eia923_file(year), config=config)
+        file_list.append(local_path)
+        if meta_data is not None:
+            log_dat.append(meta_data)
+    write_download_log(log_dat, config)
+
+    return file_list
+
+
+def eia860_file(year):
+    """
+    Returns the file name and url of the EIA860 form of a year.
+    """
+    filename = 'eia860{}.zip'.format(year)
+    return filename, 'http://www.eia.gov/electricity/data/eia860/xls/' + filename
+
+
+def eia923_file(year):
+    """
+    Returns the file name and url of the EIA923 form of a year (named EIA906/920
+    before 2008).
+    """
+    if year >= 2008:
+        filename = 'f923_{}.zip'.format(year)
+    else:
+        filename = 'f906920_{}.zip'.format(year)
+    return filename, 'https://www.eia.gov/electricity/data/eia923/xls/' + filename
+
+
+def download_form(filename, url, config=default_config):
+    """
+    Downloads a form to the unzip directory (from the mirror of the
+    configuration, if it has one), unless it was already downloaded and
+    reuse_prior_downloads is set.
 
+    Returns the local path and the download metadata (None if the download
+    was skipped). New downloads are added to the archive store if
+    archive_downloads is set.
+    """
+    local_path = os.path.join(config.unzip_directory, filename)
+    if config.reuse_prior_downloads and os.path.isfile(local_path):
+        print "Skipping " + filename + " because it was already downloaded."
+        return local_path, None
+    print "Downloading " + local_path
+    meta_data = download_file(url, local_path, config.mirror)
+    if config.archive_downloads:
+        import archive_store
+        archive_store.add_file(local_path, meta_data[2], url, meta_data[3])
+    return local_path, meta_data
+
+
+def write_download_log(log_dat, config=default_config):
     # Only write the log file header if we are starting a new log
-    write_log_header = not os.path.isfile(download_log_path)
-    with open(download_log_path, 'ab') as logfile:
+    write_log_header = not os.path.isfile(config.download_log_path)
+    with open(config.download_log_path, 'ab') as logfile:
         logwriter = csv.writer(logfile, delimiter='\t',
                                quotechar="'", quoting=csv.QUOTE_MINIMAL)
         if write_log_header:
             logwriter.writerow(download_metadata_fields)
         logwriter.writerows(log_dat)
-    
-    return [os.path.join(unzip_directory, f) for f in file_list]
 
 
-def parse_eia860_data(directory):
+def parse_eia860_data(directory, config=default_config):
     """
     Processes EIA860 Form data.
 
     First, data for existing and proposed plants and units are merged together.
     Some information is only specified per plant and not unit (i.e. NERC region).
     
-    Proposed units are filtered according to status, as defined in accepted_status_codes.
+    Proposed units are filtered according to status, as defined in the
+    accepted_status_codes of the configuration.
     For now, all status up to units with regulatory approvals pending are accepted
     as certain. If a unit has not initiated regulatory approval processes, then
     it is filtered out.
@@ -193,8 +252,8 @@ def parse_eia860_data(directory):
     Gas and steam turbines of combined cycle plants are considered indistinct,
     treated as 'CC' technologies.
 
-    Generator data is aggregated according to the lists defined in
-    gen_aggregation_lists; mainly by summing up their capacities.
+    Generator data is aggregated according to the gen_aggregation_lists of the
+    configuration; mainly by summing up their capacities.
     First, units with the same code belonging to the same plant are aggregated
     together. This is usually the case for gas and steam turbines belonging to the
     same combined cycle (though there are some other cases). Secondly, units are
@@ -207,56 +266,60 @@ def parse_eia860_data(directory):
     year = int(directory[-4:])
     print "============================="
     print "Processing data for year {}.".format(year)
+    save_eia860_generators(read_eia860_generators(directory, year, config),
+        year, config)
+
+
+def form_pickle_paths(directory, names, config=default_config):
+    """
+    Returns the paths of the pickles of a form (e.g. eia860_2015_plants), named
+    after the revision of its extracted archive (see layouts.revision_sha1), so
+    they are rebuilt when utils.unzip extracts a changed archive. Pickles of
+    other revisions are removed.
+
+    """
+
+    revision = revision_sha1(directory)[:12]
+    paths = [os.path.join(config.pickle_directory, '{}_{}.pickle'.format(
+        name, revision)) for name in names]
+    for name in names:
+        for path in glob.glob(os.path.join(config.pickle_directory,
+            '{}*.pickle'.format(name))):
+            if path not in paths:
+                os.remove(path)
+    return paths
+
+
+def read_eia860_generators(directory, year, config=default_config):
+    """
+    Reads the plants and the existing and proposed generators of an EIA860
+    form, and merges them into a single DataFrame of generators. The result
+    does not depend on the filtering and aggregation settings, so it can be
+    shared by several runs of save_eia860_generators (see sweep.py).
+
+    """
 
     # First, try saving data as pickle if it hasn't been done before
     # Reading pickle files is orders of magnitude faster than reading Excel
     # files directly. This saves tons of time when re-running the script.
-    pickle_path_plants = os.path.join(pickle_directory,'eia860_{}_plants.pickle'.format(year))
-    pickle_path_existing_generators = os.path.join(pickle_directory,'eia860_{}_existing.pickle'.format(year))
-    pickle_path_proposed_generators = os.path.join(pickle_directory,'eia860_{}_proposed.pickle'.format(year))
+    pickle_path_plants, pickle_path_existing_generators, pickle_path_proposed_generators = \
+        form_pickle_paths(directory, ['eia860_{}_{}'.format(year, table)
+        for table in ('plants', 'existing', 'proposed')], config)
     
     if not os.path.exists(pickle_path_plants) \
         or not os.path.exists(pickle_path_existing_generators) \
             or not os.path.exists(pickle_path_proposed_generators) \
-                or REWRITE_PICKLES:
+                or config.rewrite_pickles:
         print "Pickle files have to be written for this EIA860 form. Creating..."
-        # Different number of blank rows depending on year
-        if year <= 2010:
-            rows_to_skip = 0
-        else:
-            rows_to_skip = 1
-
-        for f in os.listdir(directory):
-            path = os.path.join(directory, f)
-            # Use a simple for loop, since for years previous to 2008, there are
-            # multiple ocurrences of "GenY" in files. Haven't found a clever way
-            # to do a pattern search with Glob that excludes unwanted files.
-            # In any case, all files have to be read differently, so I'm not
-            # sure that the code would become any cleaner by using Glob.
-
-            # From 2009 onwards, look for files with "Plant" and "Generator"
-            # in their name.
-            # Avoid trying to read a temporal file if any Excel workbook is open
-            if 'Plant' in f and '~' not in f:
-                plants = uniformize_names(
-                    pd.read_excel(path, sheetname=0, skiprows=rows_to_skip))
-            if 'Generator' in f and '~' not in f:
-                existing_generators = uniformize_names(
-                    pd.read_excel(path, sheetname=0, skiprows=rows_to_skip))
-                existing_generators['Operational Status'] = 'Operable'
-                proposed_generators = uniformize_names(
-                    pd.read_excel(path, sheetname=1, skiprows=rows_to_skip))
-                proposed_generators['Operational Status'] = 'Proposed'
-            # Different names from 2008 backwards
-            if f.startswith('PRGenY'):
-                proposed_generators = uniformize_names(
-                    pd.read_excel(path, sheetname=0, skiprows=rows_to_skip))
-                proposed_generators['Operational Status'] = 'Proposed'
-            if f.startswith('GenY'):
-                existing_generators = uniformize_names(
-                    pd.read_excel(path, sheetname=0, skiprows=rows_to_skip))
-                existing_generators['Operational Status'] = 'Operable'
-        
+        # Workbooks, sheets and header rows change between years
+        sheets = read_sheets(directory, workbook_layout(directory, 'eia860',
+            year, config.layout_registry_directory))
+        plants = uniformize_names(sheets['plants'])
+        existing_generators = uniformize_names(sheets['existing_generators'])
+        existing_generators['Operational Status'] = 'Operable'
+        proposed_generators = uniformize_names(sheets['proposed_generators'])
+        proposed_generators['Operational Status'] = 'Proposed'
+
         plants.to_pickle(pickle_path_plants)
         existing_generators.to_pickle(pickle_path_existing_generators)
         proposed_generators.to_pickle(pickle_path_proposed_generators)
@@ -272,9 +335,23 @@ def parse_eia860_data(directory):
     generators = generators.append(proposed_generators)
     print "Read in data for {} existing and {} proposed generation units in "\
         "the US.".format(len(existing_generators), len(proposed_generators))
+    return generators
+
+
+def save_eia860_generators(generators, year, config=default_config):
+    """
+    Filters the generators of a year by status and aggregates them (see
+    parse_eia860_data), and saves them to generation_projects_YEAR.tab.
+    All generators are first added to the generator panel (see panel.py).
+
+    """
+
+    panel.save_year(generators, year, config.outputs_directory)
 
     # Filter projects according to status
-    generators = generators.loc[generators['Status'].isin(accepted_status_codes)]
+    generators = generators.loc[code_table('status',
+        config.other_data_directory).isin(generators['Status'],
+        config.accepted_status_codes)]
     print "Filtered to {} existing and {} proposed generation units by removing inactive "\
         "and planned projects not yet started.".format(
             len(generators[generators['Operational Status']=='Operable']),
@@ -287,10 +364,12 @@ def parse_eia860_data(directory):
         generators[col].replace('.', float('nan'), inplace=True)
 
     # Manually set Prime Mover of combined cycle plants before aggregation
-    generators.loc[generators['Prime Mover'].isin(['CA','CT','CS']),'Prime Mover'] = 'CC'
+    generators['Prime Mover'] = code_table('prime_mover',
+        config.other_data_directory).remap(generators['Prime Mover'],
+        combined_cycle_prime_movers)
 
     # Aggregate according to user criteria
-    for agg_list in gen_aggregation_lists:
+    for agg_list in [list(l) for l in config.gen_aggregation_lists]:
         # Assign unique values to empty cells in columns that will be aggregated upon
         for col in agg_list:
             if generators[col].dtype == np.float64:
@@ -302,7 +381,7 @@ def parse_eia860_data(directory):
         gb = generators.groupby(agg_list)
         # Some columns will be summed and all others will get the 'max' value
         # Columns are reordered after aggregation for easier inspection
-        if year != end_year:
+        if year != config.end_year:
             generators = gb.agg({datum:('max' if datum not in gen_data_to_be_summed else sum)
                             for datum in gen_relevant_data}).loc[:,gen_relevant_data]
         else:
@@ -320,12 +399,73 @@ def parse_eia860_data(directory):
     generators = generators.rename(columns={'Plant Code':'EIA Plant Code'})
 
     fname = 'generation_projects_{}.tab'.format(year)
-    with open(os.path.join(outputs_directory, fname),'w') as f:
+    with open(os.path.join(config.outputs_directory, fname),'w') as f:
         generators.to_csv(f, sep='\t', encoding='utf-8', index=False)
     print "Saved data to {} file.\n".format(fname)
 
 
-def parse_eia923_data(directory):
+def find_eia923_workbook(directory, year, config=default_config):
+    """
+    Returns the path to the EIA923 workbook with generation and fuel data in
+    the directory, the name of its sheet and the number of rows to skip
+    before its header (see layouts.py).
+
+    """
+
+    layout = workbook_layout(directory, 'eia923', year,
+        config.layout_registry_directory)['generation']
+    return (os.path.join(directory, layout['file']), layout['sheet'],
+        layout['header_row'])
+
+
+def prepare_eia923_generation(generation, year, config=default_config):
+    """
+    Prepares raw EIA923 generation and fuel data (or a chunk of it) for
+    aggregation: sets the year, removes fictional plants, replaces characters
+    in numeric columns with nan values and treats combined cycle units as 'CC'.
+
+    Returns the DataFrame and its original column order.
+
+    """
+
+    generation.loc[:,'Year'] = year
+    # Get column order for easier month matching later on
+    column_order = list(generation.columns)
+    # Remove "State-Fuel Level Increment" fictional plants
+    generation = generation.loc[generation['Plant Code']!=99999]
+
+    # Replace characters with proper nan values
+    for col in eia923_numeric_columns(generation.columns):
+        generation[col].replace(' ', float('nan'), inplace=True)
+        generation[col].replace('.', float('nan'), inplace=True)
+
+    # First assign CC as prime mover for combined cycles.
+    generation['Prime Mover'] = code_table('prime_mover',
+        config.other_data_directory).remap(generation['Prime Mover'],
+        combined_cycle_prime_movers)
+    return generation, column_order
+
+
+def eia923_numeric_columns(columns):
+    return [col for col in columns if
+        re.compile('(?i)elec[_\s]mmbtu').match(col) or re.compile('(?i)netgen').match(col)]
+
+
+def aggregate_eia923_generation(generation):
+    """
+    Aggregates generation of plants per Plant Code, Prime Mover and Energy
+    Source. Numeric columns are summed and all others get their 'max' value,
+    so partial aggregations of chunks of data can be aggregated again.
+
+    """
+
+    numeric_columns = eia923_numeric_columns(generation.columns)
+    gb = generation.groupby(['Plant Code','Prime Mover','Energy Source'])
+    return gb.agg({datum:('max' if datum not in numeric_columns else sum)
+                                    for datum in generation.columns})
+
+
+def parse_eia923_data(directory, config=default_config):
     """
     Processes EIA923 Form data.
 
@@ -336,7 +476,10 @@ def parse_eia923_data(directory):
     Monthly energy consumption for generation of electricity ('elec_mmbtu'
     columns) and monthly net generation of electricity ('netgen' columns) are
     aggregated per plant, technology and energy source, to match the level
-    of aggregation of the processed EIA860 data.
+    of aggregation of the processed EIA860 data. If stream_eia923 is set, the
+    workbook is read in chunks of eia923_chunksize rows, which are aggregated
+    as they are read, so memory usage of xlsx forms does not depend on their
+    size (xls forms are still loaded whole, see utils.iter_excel_chunks).
 
     Hydro projects are identified by selecting units which use 'WAT' fuel.
     Fuel-based projects are identified by technology, selecting units that
@@ -365,7 +508,9 @@ def parse_eia923_data(directory):
     Both hydro capacity factors and fuel consumption/heat rates are outputted
     in WIDE and in NARROW formats. The WIDE format is usually easier for visual
     inspection and spreadsheet exploration, whereas NARROW formats allow and
-    easier merging with relational databases.
+    easier merging with relational databases. Internally, monthly metrics are
+    held as (records x 12) arrays (see month_matrix.py) and both formats are
+    only generated when writing the outputs.
 
     Hydro Profiles:
         Electricity consumption is summed (in positive values) to the net
@@ -399,49 +544,73 @@ def parse_eia923_data(directory):
     year = int(directory[-4:])
     print "============================="
     print "Processing data for year {}.".format(year)
+    generation, column_order = read_eia923_generation(directory, year, config)
+    save_eia923_outputs(generation, column_order, year, config)
 
-    # First, try saving data as pickle if it hasn't been done before
-    # Reading pickle files is orders of magnitude faster than reading Excel
-    # files directly. This saves tons of time when re-running the script.
-    pickle_path = os.path.join(pickle_directory,'eia923_{}.pickle'.format(year))
-    if not os.path.exists(pickle_path) or REWRITE_PICKLES:
-        print "Pickle file has to be written for this EIA923 form. Creating..."
-        # Name of the relevant spreadsheet is not consistent throughout years
-        # Read largest file in the directory instead of looking by name
-        largest_file = max([os.path.join(directory, f)
-            for f in os.listdir(directory)], key=os.path.getsize)
-        # Different number of blank rows depending on year
-        if year >= 2011:
-            rows_to_skip = 5
-        else:
-            rows_to_skip = 7
-        generation = uniformize_names(pd.read_excel(largest_file,
-            sheetname='Page 1 Generation and Fuel Data', skiprows=rows_to_skip))
-        generation.to_pickle(pickle_path)
+
+def read_eia923_generation(directory, year, config=default_config):
+    """
+    Reads the generation and fuel data of an EIA923 form, aggregated per
+    Plant Code, Prime Mover and Energy Source (see parse_eia923_data).
+
+    Returns the DataFrame and the original column order. The result does not
+    depend on the settings of the outputs, so it can be shared by several runs
+    of save_eia923_outputs (see sweep.py).
+
+    """
+
+    if config.stream_eia923:
+        # Bounded memory mode: the workbook is read in chunks of rows, which
+        # are aggregated as they are read. Pickles are not used, since they
+        # would hold the whole spreadsheet in memory.
+        print "Reading EIA923 form in chunks of {} rows...".format(
+            config.eia923_chunksize)
+        workbook, sheet, rows_to_skip = find_eia923_workbook(directory, year, config)
+        generation = None
+        n_records = 0
+        for chunk in iter_excel_chunks(workbook, sheet,
+                skiprows=rows_to_skip, chunksize=config.eia923_chunksize):
+            chunk, column_order = prepare_eia923_generation(
+                uniformize_names(chunk), year, config)
+            n_records += len(chunk)
+            chunk = aggregate_eia923_generation(chunk).reset_index(drop=True)
+            if generation is not None:
+                chunk = aggregate_eia923_generation(
+                    pd.concat([generation, chunk], axis=0)).reset_index(drop=True)
+            generation = chunk
+        generation = aggregate_eia923_generation(generation)
     else:
-        print "Pickle file exists for this EIA923. Reading..."
-        generation = pd.read_pickle(pickle_path)
+        # First, try saving data as pickle if it hasn't been done before
+        # Reading pickle files is orders of magnitude faster than reading Excel
+        # files directly. This saves tons of time when re-running the script.
+        pickle_path, = form_pickle_paths(directory, ['eia923_{}'.format(year)], config)
+        if not os.path.exists(pickle_path) or config.rewrite_pickles:
+            print "Pickle file has to be written for this EIA923 form. Creating..."
+            workbook, sheet, rows_to_skip = find_eia923_workbook(directory, year, config)
+            generation = uniformize_names(pd.read_excel(workbook,
+                sheetname=sheet, skiprows=rows_to_skip))
+            generation.to_pickle(pickle_path)
+        else:
+            print "Pickle file exists for this EIA923. Reading..."
+            generation = pd.read_pickle(pickle_path)
+        generation, column_order = prepare_eia923_generation(generation, year,
+            config)
+        n_records = len(generation)
+        generation = aggregate_eia923_generation(generation)
 
-    generation.loc[:,'Year'] = year
-    # Get column order for easier month matching later on
-    column_order = list(generation.columns)
-    # Remove "State-Fuel Level Increment" fictional plants
-    generation = generation.loc[generation['Plant Code']!=99999]
     print ("Read in EIA923 fuel and generation data for {} generation units "
-           "and plants in the US.").format(len(generation))
+           "and plants in the US.").format(n_records)
+    return generation, column_order
 
-    # Replace characters with proper nan values
-    numeric_columns = [col for col in generation.columns if 
-        re.compile('(?i)elec[_\s]mmbtu').match(col) or re.compile('(?i)netgen').match(col)]
-    for col in numeric_columns:
-        generation[col].replace(' ', float('nan'), inplace=True)
-        generation[col].replace('.', float('nan'), inplace=True)
 
-    # Aggregated generation of plants. First assign CC as prime mover for combined cycles.
-    generation.loc[generation['Prime Mover'].isin(['CA','CT','CS']),'Prime Mover']='CC'
-    gb = generation.groupby(['Plant Code','Prime Mover','Energy Source'])
-    generation = gb.agg({datum:('max' if datum not in numeric_columns else sum)
-                                    for datum in generation.columns})
+def save_eia923_outputs(generation, column_order, year, config=default_config):
+    """
+    Calculates the hydro capacity factors and heat rates of a year from the
+    aggregated EIA923 data and the processed EIA860 generation projects, and
+    appends them to the historic output files (see parse_eia923_data).
+
+    """
+
     hydro_generation = generation[generation['Energy Source']=='WAT']
     fuel_based_generation = generation[generation['Prime Mover'].isin(fuel_prime_movers)]
     print ("Aggregated generation data to {} generation plants through Plant "
@@ -452,7 +621,7 @@ def parse_eia923_data(directory):
         len(generation) - len(fuel_based_generation) - len(hydro_generation))
 
     # Reload a summary of generation projects for nameplate capacity.
-    generation_projects = pd.read_csv(os.path.join(outputs_directory,
+    generation_projects = pd.read_csv(os.path.join(config.outputs_directory,
         'generation_projects_{}.tab').format(year), sep='\t')
     generation_projects_columns = generation_projects.columns
     print ("Read in processed EIA860 plant data for {} generation units in "
@@ -530,11 +699,11 @@ def parse_eia923_data(directory):
 
 
     # Check for projects that have plant data but no generation data, and vice versa
-    log_path = os.path.join(outputs_directory,
+    log_path = os.path.join(config.outputs_directory,
         'incomplete_data_hydro_{}.csv'.format(year))
     check_overlap_proj_and_production(hydro_gen_projects, hydro_generation,
                                       'hydro', log_path)
-    log_path = os.path.join(outputs_directory,
+    log_path = os.path.join(config.outputs_directory,
         'incomplete_data_thermal_{}.csv'.format(year))
     check_overlap_proj_and_production(fuel_based_gen_projects, fuel_based_generation, 
                                       'thermal', log_path)
@@ -547,226 +716,140 @@ def parse_eia923_data(directory):
     #############################
     # Save hydro profiles
 
-    def df_to_long_format(df, col_name, month, index_cols):
-        """
-        Transforms a DataFrame from 'WIDE' (SHORT) to 'NARROW' (LONG) format.
-        """
-        return pd.melt(df, index_cols, '{} Month {}'.format(col_name, month)
-            ).drop('variable',axis=1).rename(columns={'value':col_name})
-
-    ###############
-    # WIDE format
-    hydro_outputs=pd.concat([
-        hydro_generation[['Year','Plant Code','Plant Name','Prime Mover']],
-        hydro_generation.filter(regex=r'(?i)netgen'),
-        hydro_generation.filter(regex=r'(?i)elec quantity')
-        ], axis=1)
-    hydro_outputs=pd.merge(hydro_outputs, hydro_gen_projects[['Plant Code',
+    # Monthly metrics are held as (plants x 12) arrays, so calculations are
+    # done for all months at once. The WIDE and NARROW formats are only
+    # generated when saving the outputs.
+    hydro_outputs = MonthlyMetrics.from_frame(hydro_generation,
+        ['Year','Plant Code','Plant Name','Prime Mover'],
+        [('Net Electricity Generation (MWh)', r'(?i)netgen'),
+         ('Electricity Consumed (MWh)', r'(?i)elec quantity')])
+    hydro_outputs = hydro_outputs.merge(hydro_gen_projects[['Plant Code',
         'Prime Mover', 'Nameplate Capacity (MW)', 'County', 'State']],
         on=['Plant Code','Prime Mover'], suffixes=('',''))
-    for month in range(1,13):
-        hydro_outputs.rename(
-            columns={hydro_outputs.columns[3+month]:
-                'Net Electricity Generation (MWh) Month {}'.format(month)},
-            inplace=True)
-        hydro_outputs.rename(
-            columns={hydro_outputs.columns[15+month]:
-                'Electricity Consumed (MWh) Month {}'.format(month)},
-            inplace=True)
-        hydro_outputs.loc[:,'Net Electricity Generation (MWh) Month {}'.format(month)] += \
-            hydro_outputs.loc[:,'Electricity Consumed (MWh) Month {}'.format(month)]
-        hydro_outputs.loc[:,'Capacity Factor Month {}'.format(month)] = \
-            hydro_outputs.loc[:,'Net Electricity Generation (MWh) Month {}'.format(month)].div(
-            monthrange(int(year),month)[1]*24*hydro_outputs['Nameplate Capacity (MW)'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hydro_outputs['Net Electricity Generation (MWh)'] += \
+            hydro_outputs['Electricity Consumed (MWh)']
+        hydro_outputs['Capacity Factor'] = \
+            hydro_outputs['Net Electricity Generation (MWh)'] / (
+            hours_per_month(year) * hydro_outputs.column_vector('Nameplate Capacity (MW)'))
 
+    ###############
+    # WIDE format
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'historic_hydro_capacity_factors_WIDE.tab'), hydro_outputs)
+        os.path.join(config.outputs_directory,'historic_hydro_capacity_factors_WIDE.tab'),
+        hydro_outputs.to_wide(['Year','Plant Code','Plant Name','Prime Mover',
+            'Net Electricity Generation (MWh)', 'Electricity Consumed (MWh)',
+            'Nameplate Capacity (MW)', 'County', 'State', 'Capacity Factor']))
     print "\nSaved hydro capacity factor data in wide format for {}.".format(year)
 
     ###############
     # NARROW format
-    index_columns = [
-            'Year',
-            'Plant Code',
-            'Plant Name',
-            'Prime Mover',
-            'Nameplate Capacity (MW)',
-            'State',
-            'County']
-    hydro_outputs_narrow = pd.DataFrame(columns=['Month'])
-    for month in range(1,13):
-        hydro_outputs_narrow = pd.concat([
-            hydro_outputs_narrow,
-            pd.merge(
-                df_to_long_format(hydro_outputs,
-                    'Capacity Factor', month, index_columns),
-                df_to_long_format(hydro_outputs,
-                    'Net Electricity Generation (MWh)', month, index_columns),
-                on=index_columns)
-            ], axis=0)
-        hydro_outputs_narrow.loc[:,'Month'].fillna(month, inplace=True)
-
-    # Get friendlier output
-    hydro_outputs_narrow = hydro_outputs_narrow[['Month', 'Year',
+    hydro_outputs_narrow = hydro_outputs.to_narrow(['Month', 'Year',
             'Plant Code', 'Plant Name', 'State','County','Prime Mover',
-            'Nameplate Capacity (MW)', 'Capacity Factor', 'Net Electricity Generation (MWh)']]
+            'Nameplate Capacity (MW)', 'Capacity Factor', 'Net Electricity Generation (MWh)'])
     hydro_outputs_narrow = hydro_outputs_narrow.astype(
             {c: int for c in ['Month', 'Year', 'Plant Code']})
 
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'historic_hydro_capacity_factors_NARROW.tab'), hydro_outputs_narrow)
+        os.path.join(config.outputs_directory,'historic_hydro_capacity_factors_NARROW.tab'), hydro_outputs_narrow)
     print "Saved {} hydro capacity factor records in narrow format for {}.\n".format(
         len(hydro_outputs_narrow), year)
 
     #############################
     # Save heat rate profiles
 
-    ###############
-    # WIDE format
-    heat_rate_outputs=pd.concat([
-        fuel_based_generation[
-            ['Plant Code','Plant Name','Prime Mover','Energy Source','Year']],
-            fuel_based_generation.filter(regex=r'(?i)elec[_\s]mmbtu'),
-            fuel_based_generation.filter(regex=r'(?i)netgen')
-        ], axis=1)
+    heat_rate_outputs = MonthlyMetrics.from_frame(fuel_based_generation,
+        ['Plant Code','Plant Name','Prime Mover','Energy Source','Year'],
+        [('Heat Rate', r'(?i)elec[_\s]mmbtu'),
+         ('Net Electricity Generation (MWh)', r'(?i)netgen')])
 
     # Aggregate consumption/generation of/by different types of coal in a same plant
-    if AGGREGATE_COAL:
-        fuel_based_gen_projects.loc[:,'Energy Source'].replace(
-            to_replace=coal_codes, value='COAL', inplace=True)
-        heat_rate_outputs_columns = list(heat_rate_outputs.columns)
-        heat_rate_outputs.loc[:,'Energy Source'].replace(
-            to_replace=coal_codes, value='COAL', inplace=True)
-        gb = heat_rate_outputs.groupby(
+    if config.aggregate_coal:
+        energy_sources = code_table('energy_source', config.other_data_directory)
+        fuel_based_gen_projects['Energy Source'] = energy_sources.remap(
+            fuel_based_gen_projects['Energy Source'], dict.fromkeys(coal_codes, 'COAL'))
+        heat_rate_outputs.index['Energy Source'] = energy_sources.remap(
+            heat_rate_outputs.index['Energy Source'], dict.fromkeys(coal_codes, 'COAL'))
+        heat_rate_outputs = heat_rate_outputs.aggregate(
             ['Plant Code','Prime Mover','Energy Source'])
-        heat_rate_outputs = gb.agg(
-            {col:('max' if col in ['Plant Code','Plant Name','Prime Mover',
-                                    'Energy Source','Year']
-                else sum) for col in heat_rate_outputs_columns}).reset_index(drop=True)
-        heat_rate_outputs = heat_rate_outputs[heat_rate_outputs_columns]
         print "Aggregated coal power plant consumption.\n"
 
+    # Get total fuel consumption per plant and prime mover (the 'Heat Rate'
+    # metric holds fuel consumption until heat rates are calculated below)
+    heat_rate_outputs['Fraction of Total Fuel Consumption'] = \
+        heat_rate_outputs.group_sum('Heat Rate', ['Plant Code','Prime Mover'])
+
     # Merge with project data
-    heat_rate_outputs = pd.merge(heat_rate_outputs,
+    heat_rate_outputs = heat_rate_outputs.merge(
         fuel_based_gen_projects[['Plant Code','Prime Mover','Energy Source',
         'Energy Source 2', 'Energy Source 3', 'State','County','Nameplate Capacity (MW)']],
         on=['Plant Code','Prime Mover','Energy Source'], suffixes=('',''))
 
-    # Get total fuel consumption per plant and prime mover
-    total_fuel_consumption = pd.concat([
-            fuel_based_generation[['Plant Code','Prime Mover']],
-            fuel_based_generation.filter(regex=r'(?i)elec[_\s]mmbtu')
-            ], axis=1)
-    total_fuel_consumption.rename(columns={
-        total_fuel_consumption.columns[1+m]:
-        'Fraction of Total Fuel Consumption Month {}'.format(m)
-            for m in range(1,13)}, inplace=True)
-    total_fuel_consumption_columns = list(total_fuel_consumption.columns)
-    gb = total_fuel_consumption.groupby(['Plant Code','Prime Mover'])
-    total_fuel_consumption = gb.agg({col:('max' if col in ['Plant Code','Prime Mover'] else sum)
-                                for col in total_fuel_consumption_columns}).reset_index(drop=True)
-    total_fuel_consumption = total_fuel_consumption[total_fuel_consumption_columns]
-    heat_rate_outputs = pd.merge(heat_rate_outputs, total_fuel_consumption,
-            on=['Plant Code','Prime Mover'], suffixes=('',''))
-
-    # Calculate fraction total use of each fuel in the year
-    heat_rate_outputs.loc[:,'Fraction of Yearly Fuel Use'] = \
-        heat_rate_outputs.filter(regex=r'(?i)elec[_\s]mmbtu').sum(axis=1).div(
-        heat_rate_outputs.filter(regex=r'Fraction of Total').sum(axis=1))
-    # To Do: Use regex filtering for this in case number of columns changes
-    for month in range(1,13):
-        heat_rate_outputs.rename(
-            columns={heat_rate_outputs.columns[4+month]:
-                'Heat Rate Month {}'.format(month)},
-            inplace=True)
-        heat_rate_outputs.rename(
-            columns={heat_rate_outputs.columns[16+month]:
-                'Net Electricity Generation (MWh) Month {}'.format(month)},
-            inplace=True)
+    fuel_consumption = heat_rate_outputs['Heat Rate']
+    total_fuel_consumption = heat_rate_outputs['Fraction of Total Fuel Consumption']
+    net_generation = heat_rate_outputs['Net Electricity Generation (MWh)']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculate fraction total use of each fuel in the year
+        heat_rate_outputs.index['Fraction of Yearly Fuel Use'] = \
+            np.nansum(fuel_consumption, axis=1) / np.nansum(total_fuel_consumption, axis=1)
         # Calculate fraction of total fuel use
-        heat_rate_outputs.loc[:,'Fraction of Total Fuel Consumption Month {}'.format(month)] = \
-            heat_rate_outputs.loc[:,'Heat Rate Month {}'.format(month)].div(
-            heat_rate_outputs.loc[:,'Fraction of Total Fuel Consumption Month {}'.format(month)])
+        heat_rate_outputs['Fraction of Total Fuel Consumption'] = \
+            fuel_consumption / total_fuel_consumption
         # Heat rates
-        heat_rate_outputs.loc[:,'Heat Rate Month {}'.format(month)] = \
-            heat_rate_outputs.loc[:,'Heat Rate Month {}'.format(month)].div(
-                heat_rate_outputs.loc[:,'Net Electricity Generation (MWh) Month {}'.format(month)])
+        heat_rate_outputs['Heat Rate'] = fuel_consumption / net_generation
         # Capacity factors
-        heat_rate_outputs['Capacity Factor Month {}'.format(month)] = \
-            heat_rate_outputs.loc[:,'Net Electricity Generation (MWh) Month {}'.format(month)].div(
-                monthrange(int(year),month)[1]*24*heat_rate_outputs['Nameplate Capacity (MW)'])
+        heat_rate_outputs['Capacity Factor'] = net_generation / (
+            hours_per_month(year) * heat_rate_outputs.column_vector('Nameplate Capacity (MW)'))
+    wide_columns = ['Plant Code','Plant Name','Prime Mover','Energy Source','Year',
+        'Heat Rate', 'Net Electricity Generation (MWh)', 'Energy Source 2',
+        'Energy Source 3', 'State', 'County', 'Nameplate Capacity (MW)',
+        'Fraction of Total Fuel Consumption', 'Fraction of Yearly Fuel Use',
+        'Capacity Factor']
 
     # Filter records of consistently negative heat rates throughout the year
-    negative_filter = (heat_rate_outputs <= 0).filter(regex=r'Heat Rate').all(axis=1)
-    negative_heat_rate_outputs = heat_rate_outputs[negative_filter]
+    with np.errstate(invalid='ignore'):
+        negative_filter = (heat_rate_outputs['Heat Rate'] <= 0).all(axis=1)
+    negative_heat_rate_outputs = heat_rate_outputs.take(negative_filter).to_wide(
+        wide_columns)
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'negative_heat_rate_outputs.tab'), negative_heat_rate_outputs)
-    heat_rate_outputs = heat_rate_outputs[~negative_filter]
+        os.path.join(config.outputs_directory,'negative_heat_rate_outputs.tab'), negative_heat_rate_outputs)
+    heat_rate_outputs = heat_rate_outputs.take(~negative_filter)
+    # Keep the position of each record before filtering (previously written
+    # by DataFrame.reset_index), so the layout of historic files is unchanged
+    heat_rate_outputs.index['index'] = np.flatnonzero(~negative_filter)
     print ("Removed {} records of consistently negative heat rates and saved"
         " them to negative_heat_rate_outputs.tab".format(
         len(negative_heat_rate_outputs)))
 
-    # Get the second best heat rate in a separate column
-    heat_rate_outputs.reset_index(inplace=True)
-    heat_rate_outputs.loc[:,'Best Heat Rate'] = pd.DataFrame(
-        np.sort(heat_rate_outputs.replace([0,float('inf')],float('nan'))[
-            heat_rate_outputs>0].filter(regex=r'Heat Rate'))).iloc[:,1]
+    # Get the second best heat rate in a separate column (k-th best, as
+    # defined by best_heat_rate_rank)
+    heat_rate_outputs.index['Best Heat Rate'] = kth_best_heat_rate(
+        heat_rate_outputs['Heat Rate'], k=config.best_heat_rate_rank)
 
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'historic_heat_rates_WIDE.tab'), heat_rate_outputs)
+        os.path.join(config.outputs_directory,'historic_heat_rates_WIDE.tab'),
+        heat_rate_outputs.to_wide(['index']+wide_columns+['Best Heat Rate']))
     print "\nSaved heat rate data in wide format for {}.".format(year)
 
     ###############
     # NARROW format
-    index_columns = [
-            'Year',
-            'Plant Code',
-            'Plant Name',
-            'Prime Mover',
-            'Energy Source',
-            'Energy Source 2',
-            'Energy Source 3',
-            'Nameplate Capacity (MW)',
-            'State',
-            'County'
-        ]
-    heat_rate_outputs_narrow = pd.DataFrame(columns=['Month'])
-    for month in range(1,13):
-        # To Do: Collapse the mergers into a more compact function
-        heat_rate_outputs_narrow = pd.concat([
-            heat_rate_outputs_narrow,
-            pd.merge(
-                pd.merge(
-                    pd.merge(
-                        df_to_long_format(heat_rate_outputs,
-                            'Heat Rate', month, index_columns),
-                        df_to_long_format(heat_rate_outputs,
-                            'Capacity Factor', month, index_columns),
-                    on=index_columns),
-                    df_to_long_format(heat_rate_outputs,
-                        'Net Electricity Generation (MWh)', month, index_columns),
-                    on=index_columns),
-                df_to_long_format(heat_rate_outputs,
-                    'Fraction of Total Fuel Consumption', month, index_columns),
-                on=index_columns)
-            ], axis=0)
-        heat_rate_outputs_narrow.loc[:,'Month'].fillna(month, inplace=True)
-
-    # Get friendlier output
-    heat_rate_outputs_narrow = heat_rate_outputs_narrow[['Month', 'Year',
+    heat_rate_outputs_narrow = heat_rate_outputs.to_narrow(['Month', 'Year',
             'Plant Code', 'Plant Name', 'State', 'County', 'Prime Mover',
             'Energy Source', 'Energy Source 2', 'Energy Source 3',
             'Nameplate Capacity (MW)', 'Heat Rate', 'Capacity Factor',
-            'Fraction of Total Fuel Consumption', 'Net Electricity Generation (MWh)']]
+            'Fraction of Total Fuel Consumption', 'Net Electricity Generation (MWh)'])
     heat_rate_outputs_narrow = heat_rate_outputs_narrow.astype(
             {c: int for c in ['Month', 'Year', 'Plant Code']})
 
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'historic_heat_rates_NARROW.tab'),
+        os.path.join(config.outputs_directory,'historic_heat_rates_NARROW.tab'),
         heat_rate_outputs_narrow)
     print "Saved {} heat rate records in narrow format for {}.".format(
         len(heat_rate_outputs_narrow), year)
 
+    heat_rate_outputs = heat_rate_outputs.to_wide(
+        ['index']+wide_columns+['Best Heat Rate'])
+
     # Save plants that present multiple fuels in separate file
     multi_fuel_heat_rate_outputs = heat_rate_outputs[
         (heat_rate_outputs['Fraction of Yearly Fuel Use'] >= 0.05) &
@@ -779,7 +862,7 @@ def parse_eia923_data(directory):
     multi_fuel_heat_rate_outputs = multi_fuel_heat_rate_outputs.drop(indices_to_drop)
 
     append_historic_output_to_csv(
-        os.path.join(outputs_directory,'multi_fuel_heat_rates.tab'),
+        os.path.join(config.outputs_directory,'multi_fuel_heat_rates.tab'),
         multi_fuel_heat_rate_outputs)
     print ("\n{} records show use of multiple fuels (more than 5% of the secondary fuel in the year). "
             "Saved them to multi_fuel_heat_rates.tab".format(len(multi_fuel_heat_rate_outputs)))
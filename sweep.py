@@ -0,0 +1,262 @@
+# Copyright 2017. All rights reserved. See AUTHORS.txt
+# Licensed under the Apache License, Version 2.0 which is in LICENSE.txt
+"""
+Parameter sweeps over the settings of the processing steps, for sensitivity
+studies.
+
+run_sweep() takes a grid of settings of the run configuration (see config.py)
+and their values, e.g.
+
+    {"accepted_status_codes": [["OP","SB","CO"], ["OP","SB","CO","SC","OA"]],
+     "aggregate_coal": [true, false]}
+
+and processes every combination of those values (a variant), writing its
+outputs to its own directory (sweep_data/variant_001, ...). The settings of
+each variant are saved to settings.json in its directory and listed in
+sweep_data/variants.tab, and its console output is saved to sweep.log.
+Settings that are not in the grid keep their values in the given
+configuration.
+
+Work that does not depend on the swept settings is only done once:
+    * The EIA860 and EIA923 workbooks of each year are read (or their pickles
+      loaded) once. The merged EIA860 generators and the aggregated EIA923
+      generation are shared by all variants.
+    * Variants that only differ in the settings of later stages share the
+      outputs of the earlier ones, which are computed once and copied. For
+      example, a sweep of the heat rate outlier fraction parses the forms once.
+    * The counties of the region are queried once per area threshold.
+
+Variants are processed in parallel, in a pool of processes. Workers are forked
+after the shared data is read, so they inherit it without copying it through
+pipes. Each task carries the configuration of its variant.
+
+Settings that can be swept (see sweep_settings), by stage:
+    eia860: accepted_status_codes, gen_aggregation_lists
+    eia923: aggregate_coal
+    finish: region_county_area, heat_rate_outlier_fraction
+
+The finish stage (filtering WECC generators and assigning heat rates, see
+database_interface.finish_project_processing) reads the counties of the region
+from the switch_gis database, so it is only run if finish is set. Heat rate
+plots of the variants are deferred (render them with reports.py).
+
+    python eia_scrape.py sweep GRID.json [--start-year Y] [--end-year Y]
+        [--finish] [--workers N] [--output DIRECTORY]
+
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+import pandas as pd
+
+import scrape
+from config import default_config
+
+sweep_directory = 'sweep_data'
+SWEEP_WORKERS = max(1, multiprocessing.cpu_count() - 1)
+# Stage of each setting of the run configuration that can be swept
+sweep_settings = OrderedDict([
+    ('accepted_status_codes', 'eia860'),
+    ('gen_aggregation_lists', 'eia860'),
+    ('aggregate_coal', 'eia923'),
+    ('region_county_area', 'finish'),
+    ('heat_rate_outlier_fraction', 'finish'),
+    ])
+stages = ['eia860', 'eia923', 'finish']
+# Files of a variant directory that are not outputs
+variant_files = ['settings.json', 'sweep.log']
+# Merged EIA860 generators and aggregated EIA923 generation (with its column
+# order) of each year, read by the parent process before forking the workers
+_shared = {}
+
+
+def variants(grid):
+    """
+    Returns every combination of the values of the grid, as OrderedDicts of
+    settings (in the order of sweep_settings).
+    """
+    unknown = [name for name in grid if name not in sweep_settings]
+    if unknown:
+        raise ValueError("These settings cannot be swept: {}".format(
+            ', '.join(unknown)))
+    names = [name for name in sweep_settings if name in grid]
+    return [OrderedDict(zip(names, values))
+        for values in itertools.product(*[grid[name] for name in names])]
+
+
+def stage_key(settings, stage):
+    """
+    Returns a key of the settings that the outputs of a stage depend on (its
+    own settings and those of the earlier stages).
+    """
+    relevant = stages[:stages.index(stage)+1]
+    return json.dumps([(name, value) for name, value in settings.items()
+        if sweep_settings[name] in relevant])
+
+
+def variant_config(config, settings, directory):
+    """
+    Returns the configuration of a variant, which writes its outputs to the
+    directory.
+    """
+    return config.replace(outputs_directory=directory,
+        heat_rate_plots=config.heat_rate_plots and 'deferred', **settings)
+
+
+def _run_logged(function, config):
+    """
+    Runs a stage of a variant, saving its console output to the log of the
+    variant.
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.path.join(config.outputs_directory, 'sweep.log'), 'a')
+    try:
+        function(config)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return config.outputs_directory
+
+
+def _parse(config):
+    # Copies are processed, since the shared frames are modified in place
+    for year in config.years:
+        generators = _shared[year][0]
+        scrape.save_eia860_generators(generators.copy(), year, config)
+    for year in config.years:
+        generation, column_order = _shared[year][1:]
+        scrape.save_eia923_outputs(generation.copy(), list(column_order),
+            year, config)
+
+
+def _finish(config):
+    import database_interface
+    for year in config.years:
+        database_interface.finish_project_processing(year, config)
+
+
+def _parse_variant(config):
+    return _run_logged(_parse, config)
+
+
+def _finish_variant(config):
+    return _run_logged(_finish, config)
+
+
+def _run_tasks(function, tasks, workers):
+    """
+    Runs the function for each task, in a pool of processes if there are
+    several tasks and workers.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        return pool.map(function, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_shared_data(config):
+    """
+    Reads the EIA860 and EIA923 forms of the years once, for all variants.
+    """
+    if not os.path.exists(config.pickle_directory):
+        os.makedirs(config.pickle_directory)
+    years = config.years
+    eia860_directories = scrape.unzip_downloaded_forms(scrape.eia860_file,
+        years, config)
+    eia923_directories = scrape.unzip_downloaded_forms(scrape.eia923_file,
+        years, config)
+    for year, eia860_directory, eia923_directory in zip(years,
+        eia860_directories, eia923_directories):
+        print "Reading the forms of {} for all variants...".format(year)
+        generators = scrape.read_eia860_generators(eia860_directory, year, config)
+        generation, column_order = scrape.read_eia923_generation(
+            eia923_directory, year, config)
+        _shared[year] = (generators, generation, column_order)
+
+
+def prepare_sweep_directory(directory, variant_list):
+    """
+    Creates the directory of each variant with its settings, and lists them
+    in variants.tab. The directories of a previous sweep are removed, since
+    historic outputs are appended to.
+    """
+    if os.path.isdir(directory) and os.listdir(directory):
+        if not os.path.isfile(os.path.join(directory, 'variants.tab')):
+            raise IOError("{} is not empty and does not hold a previous "
+                "sweep".format(directory))
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    directories = []
+    for i, settings in enumerate(variant_list):
+        variant_directory = os.path.join(directory, 'variant_{:03d}'.format(i+1))
+        os.makedirs(variant_directory)
+        with open(os.path.join(variant_directory, 'settings.json'), 'w') as f:
+            json.dump(settings, f, indent=1)
+        directories.append(variant_directory)
+    listing = pd.DataFrame([OrderedDict([('variant', os.path.basename(d))] +
+        [(name, json.dumps(value)) for name, value in settings.items()])
+        for d, settings in zip(directories, variant_list)])
+    listing.to_csv(os.path.join(directory, 'variants.tab'), sep='\t',
+        index=False)
+    return directories
+
+
+def copy_outputs(source, target):
+    for fname in os.listdir(source):
+        if fname not in variant_files:
+            shutil.copy2(os.path.join(source, fname), target)
+
+
+def run_sweep(grid, config=default_config, directory=sweep_directory,
+    finish=False, workers=SWEEP_WORKERS):
+    """
+    Processes the forms of the years of the configuration with each variant
+    of the grid of settings (a dict of setting names and lists of values),
+    writing the outputs of each variant to its own directory.
+
+    Returns the directory and settings of each variant.
+    """
+    variant_list = variants(grid)
+    directories = prepare_sweep_directory(directory, variant_list)
+    configs = [variant_config(config, settings, variant_directory)
+        for variant_directory, settings in zip(directories, variant_list)]
+    print "Sweeping {} variants of {} for years {}-{} with {} workers.".format(
+        len(variant_list), ', '.join(grid), config.start_year, config.end_year,
+        workers)
+
+    read_shared_data(config)
+
+    # Variants with the same parsing settings are parsed once
+    groups = OrderedDict()
+    for variant, settings in zip(configs, variant_list):
+        groups.setdefault(stage_key(settings, 'eia923'), []).append(variant)
+    print "Parsing {} distinct variants of the forms...".format(len(groups))
+    _run_tasks(_parse_variant, [members[0] for members in groups.values()],
+        workers)
+    for members in groups.values():
+        for variant in members[1:]:
+            copy_outputs(members[0].outputs_directory, variant.outputs_directory)
+
+    if finish:
+        import database_interface
+        # Counties are queried before forking, so workers read them from file
+        for area, other_data_directory in sorted(set((c.region_county_area,
+            c.other_data_directory) for c in configs)):
+            database_interface.region_counties(13, area,
+                directory=other_data_directory)
+        print "Assigning heat rates to the generators of {} variants...".format(
+            len(variant_list))
+        _run_tasks(_finish_variant, configs, workers)
+
+    print "Saved the outputs of the variants to {}".format(directory)
+    return zip(directories, variant_list)
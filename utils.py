@@ -11,23 +11,37 @@ http://stackoverflow.com/questions/16694907/how-to-download-large-file-in-python
 import datetime
 import getpass
 import hashlib
+import mmap
 import os, sys
-import psycopg2
-import requests
+import shutil
 import zipfile
+import zlib
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 
 download_metadata_fields = ('filename', 'url', 'download_timestamp_utc', 'sha1')
 # A standard size for chunking data for disk writes: 64kb = 2^16 = 65536
 BLOCKSIZE = 65536
+# Archives are extracted by this number of threads (see unzip)
+UNZIP_WORKERS = 4
+# File that records the SHA1 of the archive extracted to a directory
+unzip_marker = '.archive_sha1'
 
-def download_file(url, local_path):
+def download_file(url, local_path, mirror=None):
     """
     Robustly download the contents of a url to a local file.
     Return metadata suitable for a log file:
         (local_path, url, timestamp, sha1_hash)
     See also: download_metadata_fields
+
+    If the directory or url of a mirror is given (see mirror.py), the file is
+    copied from the mirror unless it is missing there.
     """
+    if mirror is not None:
+        import mirror as mirrors
+        return mirrors.download(url, local_path, mirror)
+    import requests
     r = requests.get(url, stream=True)
     hasher = hashlib.sha1()
     with open(local_path, 'wb') as f:
@@ -39,24 +53,152 @@ def download_file(url, local_path):
     return (local_path, url, timestamp, hasher.hexdigest())
 
 
-def unzip(file_list):
+def file_sha1(path):
+    """
+    Returns the SHA1 hex digest of a file, read through a memory map.
+    """
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as f:
+        # Empty files cannot be mapped
+        if os.fstat(f.fileno()).st_size > 0:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                hasher.update(mapped)
+            finally:
+                mapped.close()
+    return hasher.hexdigest()
+
+
+def extracted_sha1(directory):
+    """
+    Returns the SHA1 of the archive extracted to the directory, or None if it
+    was not recorded.
+    """
+    marker_path = os.path.join(directory, unzip_marker)
+    if not os.path.isfile(marker_path):
+        return None
+    with open(marker_path) as f:
+        return f.read().strip()
+
+
+def _extract_member(task):
+    """
+    Extracts a member of an archive to a directory, checking its CRC-32 while
+    it is written.
+    """
+    path, name, directory = task
+    # Members are written inside the directory, whatever their names
+    parts = [p for p in name.split('/') if p not in ('', '.', '..')]
+    target = os.path.join(directory, *parts)
+    try:
+        os.makedirs(os.path.dirname(target))
+    except OSError:
+        # Created by another worker
+        pass
+    zip_ref = zipfile.ZipFile(path, 'r')
+    try:
+        info = zip_ref.getinfo(name)
+        source = zip_ref.open(info)
+        crc = 0
+        with open(target, 'wb') as f:
+            while True:
+                chunk = source.read(BLOCKSIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+        source.close()
+    finally:
+        zip_ref.close()
+    if crc & 0xffffffff != info.CRC:
+        raise zipfile.BadZipfile("Bad CRC-32 for {} in {}".format(name, path))
+
+
+def _try_extract_member(task):
+    """
+    Extracts a member (see _extract_member), and returns its archive and the
+    error that made the extraction fail, or None.
+    """
+    try:
+        _extract_member(task)
+    except Exception, e:
+        return task[0], "{}: {}".format(task[1], e)
+    return task[0], None
+
+
+def unzip(file_list, workers=None):
+    """
+    Extracts each archive to a directory with its name, unless the directory
+    holds an extraction of an archive with the same SHA1 (recorded in a
+    marker file). Members of all archives are extracted concurrently by a pool
+    of threads and their CRCs are checked. Archives are extracted to temporary
+    directories, which replace the previous extractions once all their members
+    are verified. If members of some archives fail to extract, the other
+    archives are still put in place, the temporary directories of the failed
+    ones are removed, and BadZipfile is raised naming them.
+    """
+    from multiprocessing.pool import ThreadPool
+    pending = []
+    tasks = []
     for path in file_list:
         unzip_name = os.path.splitext(path)[0]
-        # Skip unzipping if the directory exists
-        if not os.path.isdir(unzip_name):
-            print "Unzipping " + path
-            zip_ref = zipfile.ZipFile(path, 'r')
-            zip_ref.extractall(unzip_name)
-            zip_ref.close()
-        else:
+        sha1 = file_sha1(path)
+        previous_sha1 = extracted_sha1(unzip_name)
+        if previous_sha1 == sha1:
             print "Skipping "+unzip_name+" because it was already unzipped."
+            continue
+        if previous_sha1 is not None:
+            print "Unzipping " + path + " again, because it changed since it was unzipped."
+        elif os.path.isdir(unzip_name):
+            print "Unzipping " + path + " again, because it has no extraction marker."
+        else:
+            print "Unzipping " + path
+        partial_name = unzip_name + '.partial'
+        if os.path.isdir(partial_name):
+            shutil.rmtree(partial_name)
+        os.makedirs(partial_name)
+        pending.append((path, unzip_name, partial_name, sha1))
+        zip_ref = zipfile.ZipFile(path, 'r')
+        tasks.extend((info.file_size, path, info.filename, partial_name)
+            for info in zip_ref.infolist() if not info.filename.endswith('/'))
+        zip_ref.close()
+    if not pending:
+        return
+
+    # Largest members first, so workers finish at about the same time
+    tasks.sort(reverse=True)
+    pool = ThreadPool(workers or UNZIP_WORKERS)
+    errors = {}
+    try:
+        for path, error in pool.imap_unordered(_try_extract_member,
+            [task[1:] for task in tasks]):
+            if error is not None:
+                errors.setdefault(path, []).append(error)
+    finally:
+        pool.close()
+        pool.join()
+
+    for path, unzip_name, partial_name, sha1 in pending:
+        if path in errors:
+            shutil.rmtree(partial_name)
+            continue
+        with open(os.path.join(partial_name, unzip_marker), 'w') as f:
+            f.write(sha1 + '\n')
+        if os.path.isdir(unzip_name):
+            shutil.rmtree(unzip_name)
+        os.rename(partial_name, unzip_name)
+    if errors:
+        raise zipfile.BadZipfile("Could not extract {}: {}".format(
+            ', '.join(sorted(errors)), '; '.join(e for path in sorted(errors)
+            for e in errors[path])))
 
 
-def connect_to_db_and_push_df(df, col_formats, table, database='postgres', host='localhost', port=5433, user=None, password=None, quiet=False):
+def connect_to_db_and_run_query(query, database='postgres', host='localhost', port=5433, user=None, password=None, quiet=False, params=None):
     if user == None:
         user = getpass.getpass('Enter username for database {}:'.format(database))
-    if password == None:    
+    if password == None:
         password = getpass.getpass('Enter database password for user {}:'.format(user))
+    import psycopg2
     try:
         con = psycopg2.connect(database=database, user=user, host=host,
             port=port, password=password)
@@ -67,11 +209,18 @@ def connect_to_db_and_push_df(df, col_formats, table, database='postgres', host=
 
     cur = con.cursor()
     try:
-        args_str = ','.join(cur.mogrify(col_formats, x[1]) for x in df.iterrows())
-        query = "INSERT INTO "+table+" VALUES " + args_str+";"
-        cur.execute(query)
-        if not quiet:
-            print "Successfully pushed values"
+        # Values in params are bound by psycopg2 to the %s placeholders
+        cur.execute(query, params)
+        # fetchall() returns a list of tuples with the rows resulting from the query
+        # column names must be gotten from the cursor's description
+        if cur.description != None:
+            df = pd.DataFrame(cur.fetchall(), columns=[col[0] for col in cur.description])
+            if not quiet:
+                print 'Successfully executed query: returning results.'
+            return df
+        else:
+            if not quiet:
+                print 'Successfully executed query with no results.'
     except Exception, e:
         print 'Query execution failed with error: {}'.format(e)
         return None
@@ -83,11 +232,21 @@ def connect_to_db_and_push_df(df, col_formats, table, database='postgres', host=
     return
 
 
-def connect_to_db_and_run_query(query, database='postgres', host='localhost', port=5433, user=None, password=None, quiet=False):
+def iter_query_chunks(query, database='postgres', host='localhost', port=5433, user=None, password=None, chunksize=50000, quiet=False, params=None):
+    """
+    Runs a query with a named (server-side) cursor and yields the results as
+    DataFrames of up to chunksize rows, so rows are transferred from the
+    server as they are consumed instead of all at once. NUMERIC values are
+    read as floats and numeric columns with nulls as float columns.
+
+    A single empty DataFrame (with the result columns) is yielded if the
+    query returns no rows.
+    """
     if user == None:
         user = getpass.getpass('Enter username for database {}:'.format(database))
     if password == None:
         password = getpass.getpass('Enter database password for user {}:'.format(user))
+    import psycopg2
     try:
         con = psycopg2.connect(database=database, user=user, host=host,
             port=port, password=password)
@@ -96,31 +255,149 @@ def connect_to_db_and_run_query(query, database='postgres', host='localhost', po
     except:
         sys.exit("Error connecting to database {} at host {}:{}.".format(database,host,port))
 
-    cur = con.cursor()
+    register_float_decimals(con)
     try:
-        cur.execute(query)
-        # fetchall() returns a list of tuples with the rows resulting from the query
-        # column names must be gotten from the cursor's description
-        if cur.description != None:
-            df = pd.DataFrame(cur.fetchall(), columns=[col[0] for col in cur.description])
-            if not quiet:
-                print 'Successfully executed query: returning results.'
-            return df
-        else:
-            if not quiet:
-                print 'Successfully executed query with no results.'
-    except Exception, e:
-        print 'Query execution failed with error: {}'.format(e)
-        return None
-    con.commit()
-    cur.close()
-    con.close()
-    if not quiet:
-        print 'Database connection closed.'
-    return
+        cur = con.cursor(name='iter_query_chunks')
+        cur.itersize = chunksize
+        cur.execute(query, params)
+        n_rows = 0
+        while True:
+            rows = cur.fetchmany(chunksize)
+            columns = [col[0] for col in cur.description]
+            if not rows and n_rows > 0:
+                break
+            chunk = pd.DataFrame.from_records(rows, columns=columns)
+            for col, description in zip(columns, cur.description):
+                if (description[1] in psycopg2.NUMBER.values and
+                    chunk[col].dtype == object):
+                    chunk[col] = pd.to_numeric(chunk[col])
+            n_rows += len(rows)
+            yield chunk
+            if not rows:
+                break
+        cur.close()
+        if not quiet:
+            print 'Successfully streamed {} rows.'.format(n_rows)
+    finally:
+        con.close()
+
+
+def register_float_decimals(con):
+    """
+    Makes a psycopg2 connection return NUMERIC values as floats instead of
+    Decimal objects.
+    """
+    import psycopg2.extensions
+    decimal_to_float = psycopg2.extensions.new_type(
+        psycopg2.extensions.DECIMAL.values, 'DECIMAL_TO_FLOAT',
+        lambda value, cur: float(value) if value is not None else None)
+    psycopg2.extensions.register_type(decimal_to_float, con)
+
+
+def read_frame(query, chunksize=50000, n_rows=None, **kwargs):
+    """
+    Reads the results of a query into a DataFrame, streaming them with
+    iter_query_chunks(). Chunks are copied into preallocated column arrays
+    (of n_rows, if the number of rows is known in advance, otherwise grown by
+    doubling), so the whole result never exists as Python tuples.
+    Other arguments are passed to iter_query_chunks.
+    """
+    columns, arrays, size = None, None, 0
+    for chunk in iter_query_chunks(query, chunksize=chunksize, **kwargs):
+        if arrays is None:
+            columns = list(chunk.columns)
+            capacity = max(n_rows or 0, len(chunk))
+            arrays = [np.empty(capacity, dtype=chunk[col].dtype) for col in columns]
+        end = size + len(chunk)
+        if end > len(arrays[0]):
+            capacity = max(end, 2*len(arrays[0]))
+            arrays = [_grow_array(a, capacity, size) for a in arrays]
+        for i, col in enumerate(columns):
+            values = chunk[col].values
+            if values.dtype != arrays[i].dtype:
+                # e.g. integer columns that get nulls in later chunks
+                arrays[i] = arrays[i].astype(
+                    np.promote_types(arrays[i].dtype, values.dtype))
+            arrays[i][size:end] = values
+        size = end
+    return pd.DataFrame(OrderedDict((col, a[:size]) for col, a in zip(columns, arrays)),
+        columns=columns)
+
+
+def _grow_array(array, capacity, size):
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
 
 
 def append_historic_output_to_csv(fpath, df):
         write_header = not os.path.isfile(fpath)
         with open(fpath, 'ab') as outfile:
-            df.to_csv(outfile, sep='\t', header=write_header, encoding='utf-8', index=False)
\ No newline at end of file
+            df.to_csv(outfile, sep='\t', header=write_header, encoding='utf-8', index=False)
+
+
+def iter_excel_chunks(path, sheetname, skiprows=0, chunksize=20000):
+    """
+    Reads a worksheet in chunks of rows, so that the whole worksheet never
+    needs to be held in memory as a DataFrame. The first row after skiprows
+    is used as the header. Yields DataFrames with up to chunksize rows.
+
+    xlsx workbooks are streamed with openpyxl in read-only mode, so memory
+    usage is bounded by the chunk size. Legacy xls workbooks (EIA923 forms
+    before 2011) are read with xlrd, which loads all cells of the requested
+    worksheet, so their memory usage is not bounded and a warning is printed.
+
+    """
+    if os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm'):
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        rows = ([cell.value for cell in row]
+            for row in workbook[sheetname].iter_rows())
+    else:
+        import xlrd
+        print ("Warning: {} is an xls workbook. All cells of sheet '{}' are "
+            "loaded in memory (only xlsx workbooks are streamed).").format(
+            os.path.basename(path), sheetname)
+        workbook = xlrd.open_workbook(path, on_demand=True)
+        sheet = workbook.sheet_by_name(sheetname)
+        # Mimic pd.read_excel: integral floats become ints and empty cells nan
+        rows = ([int(v) if isinstance(v, float) and v.is_integer()
+                else (None if v == '' else v)
+                for v in sheet.row_values(i)] for i in xrange(sheet.nrows))
+
+    for i in range(skiprows):
+        next(rows)
+    header = next(rows)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunksize:
+            yield pd.DataFrame(chunk, columns=header)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header)
+    if hasattr(workbook, 'release_resources'):
+        workbook.release_resources()
+
+
+def iter_historic_output(fpath, year=None, chunksize=100000):
+    """
+    Iterates over a historic output file (written with
+    append_historic_output_to_csv) in chunks of rows. If a year is provided,
+    only records of that year are yielded.
+    """
+    for chunk in pd.read_csv(fpath, sep='\t', chunksize=chunksize):
+        if year is not None:
+            chunk = chunk[chunk['Year']==year]
+        yield chunk
+
+
+def read_historic_output(fpath, year=None, chunksize=100000):
+    """
+    Reads a historic output file, optionally filtered by year. Files are read
+    in chunks, so peak memory usage depends on the records of the year and
+    not on the number of years in the file.
+    """
+    chunks = list(iter_historic_output(fpath, year, chunksize))
+    return pd.concat(chunks, axis=0, ignore_index=True)
+